@@ -0,0 +1,37 @@
+import random
+
+import pytest
+from PIL import Image
+
+from conftest import FONT_PATH
+from corpus import synthetic_image, TINY, SCREEN, PHOTO, HUGE, PANORAMA
+from handler.colorthief import ColorThief
+from handler.imageeditor import resize_and_center, write_label, image_from_file
+
+BENCHMARKED_SIZES = SCREEN[:1] + PHOTO[:1] + HUGE + PANORAMA[1:]
+
+
+@pytest.fixture(scope='module', params=BENCHMARKED_SIZES, ids=lambda s: f'{s[0]}x{s[1]}')
+def source_image(request) -> Image.Image:
+    return synthetic_image(*request.param, random.Random(0))
+
+
+def bench_get_color(benchmark):
+    # The manager runs ColorThief on an image of about 200x200 pixels
+    img = synthetic_image(230, 173, random.Random(0))
+    benchmark(lambda: ColorThief(img).get_color())
+
+
+def bench_resize_and_center(benchmark, source_image):
+    benchmark(resize_and_center, source_image, 1920, 1080, (0, 0, 0))
+
+
+def bench_write_label(benchmark):
+    img = Image.new('RGB', (1920, 1080))
+    benchmark(write_label, img, 'holidays/2021/some rather long file name', FONT_PATH, 30.0, 20, 60)
+
+
+@pytest.mark.parametrize('ext', ['jpg', 'png', 'bmp'])
+@pytest.mark.parametrize('size', TINY[:1] + BENCHMARKED_SIZES, ids=lambda s: f'{s[0]}x{s[1]}')
+def bench_image_from_file(benchmark, image_corpus, ext, size):
+    benchmark(image_from_file, image_corpus[size[0], size[1], ext])
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from conftest import FONT_PATH
+from corpus import generate_corpus
+from handler import platform
+from handler.configmanager import ConfigManager, ConfigField
+from handler.imagesource import DirectorySource
+from handler.manager import WallpaperManager
+
+
+def bench_directory_scan(benchmark, deep_tree):
+    source = DirectorySource('tree', deep_tree)
+    files = benchmark(source.scan)
+    assert len(files) == 5000
+
+
+@pytest.fixture(scope='module')
+def manager(corpus_root, tmp_path_factory) -> WallpaperManager:
+    platform.select_backend('file')
+    corpus_dir = os.path.join(corpus_root, 'pipeline')
+    generate_corpus(corpus_dir, 30, seed=3)
+    work_dir = tmp_path_factory.mktemp('pipeline')
+    config = ConfigManager()
+    config.set_value(ConfigField.SOURCES, [DirectorySource('pipeline', corpus_dir)])
+    config.write(str(work_dir / 'config.ini'))
+    res = WallpaperManager(str(work_dir / 'config.ini'), str(work_dir), FONT_PATH)
+    res.refresh_config()
+    return res
+
+
+def bench_manager_next(benchmark, manager):
+    benchmark.pedantic(manager.next, rounds=30, warmup_rounds=2)
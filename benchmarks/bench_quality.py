@@ -0,0 +1,27 @@
+import math
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageStat
+
+from corpus import synthetic_image, PHOTO, HUGE
+from handler.imageeditor import resize_and_center, Quality
+
+
+def psnr(img: Image.Image, reference: Image.Image) -> float:
+    """Peak signal-to-noise ratio in dB, infinite for identical images."""
+    mse = sum(rms ** 2 for rms in ImageStat.Stat(ImageChops.difference(img, reference)).rms) / 3
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+@pytest.fixture(scope='module', params=PHOTO[:1] + HUGE, ids=lambda s: f'{s[0]}x{s[1]}')
+def source_image(request) -> Image.Image:
+    return synthetic_image(*request.param, random.Random(0))
+
+
+@pytest.mark.parametrize('quality', list(Quality), ids=lambda q: q.value)
+def bench_resampling_quality(benchmark, source_image, quality):
+    reference = resize_and_center(source_image, 1920, 1080, (0, 0, 0), Quality.HIGH)
+    res = benchmark(resize_and_center, source_image, 1920, 1080, (0, 0, 0), quality)
+    # Stored with the benchmark results, so the quality loss of every tier is tracked next to its speed
+    benchmark.extra_info['psnr_db'] = psnr(res, reference)
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import ALL_SIZES, generate_corpus, generate_matrix  # noqa: E402
+
+FONT_PATH = os.path.join(PROJECT_DIR, 'assets', 'fonts', 'Arial.ttf')
+# Set to a directory to keep the generated corpora between runs
+CORPUS_ENV = 'WALLPAPER_BENCHMARK_CORPUS'
+
+
+@pytest.fixture(scope='session')
+def corpus_root(tmp_path_factory) -> str:
+    root = os.environ.get(CORPUS_ENV)
+    if root is None:
+        root = str(tmp_path_factory.mktemp('corpus'))
+    return root
+
+
+@pytest.fixture(scope='session')
+def image_corpus(corpus_root) -> dict[tuple[int, int, str], str]:
+    """One image of every size in every format."""
+    return generate_matrix(os.path.join(corpus_root, 'images'), ALL_SIZES, seed=1)
+
+
+@pytest.fixture(scope='session')
+def deep_tree(corpus_root) -> str:
+    root = os.path.join(corpus_root, 'tree')
+    generate_corpus(root, 5000, seed=2, depth=6, placeholders=True)
+    return root
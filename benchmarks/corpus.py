@@ -0,0 +1,81 @@
+"""Deterministic generator for synthetic image corpora used by the benchmarks."""
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+TINY = [(50, 50), (64, 48), (120, 90)]
+SMALL = [(640, 480), (1024, 768)]
+SCREEN = [(1920, 1080), (1080, 1920), (2560, 1440)]
+PHOTO = [(4000, 3000), (3000, 4000), (6000, 4000)]
+HUGE = [(8660, 5773)]  # 50 MP
+PANORAMA = [(6000, 1000), (12000, 2000)]
+
+DEFAULT_SIZES = SMALL + SCREEN + PHOTO[:2] + PANORAMA[:1]
+ALL_SIZES = TINY + SMALL + SCREEN + PHOTO + HUGE + PANORAMA
+DEFAULT_FORMATS = ['jpg', 'png', 'bmp']
+
+
+def synthetic_image(width: int, height: int, rng: random.Random) -> Image.Image:
+    """A gradient with a few shapes, so that compression and color extraction behave like on photos."""
+    top = tuple(rng.randrange(256) for _ in range(3))
+    bottom = tuple(rng.randrange(256) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    img = Image.composite(Image.new('RGB', (width, height), bottom), Image.new('RGB', (width, height), top),
+                          gradient)
+    draw = ImageDraw.Draw(img)
+    for _ in range(8):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(1, max(2, min(width, height) // 4))
+        draw.ellipse([(x - r, y - r), (x + r, y + r)], fill=tuple(rng.randrange(256) for _ in range(3)))
+    return img
+
+
+def corpus_path(root: str, index: int, width: int, height: int, ext: str, depth: int) -> str:
+    """Spread images over a tree that is `depth` directories deep, with four branches per level."""
+    dirs = [f'd{(index >> (2 * level)) % 4}' for level in range(depth)]
+    return os.path.join(root, *dirs, f'img{index:05d}_{width}x{height}.{ext}')
+
+
+def generate_corpus(root: str, count: int, seed: int = 0, sizes: list[tuple[int, int]] = None,
+                    formats: list[str] = None, depth: int = 1, placeholders: bool = False) -> list[str]:
+    """
+    Write `count` images below `root` and return their paths. Existing files are reused, so a corpus
+    can be kept between runs. With `placeholders`, empty files are written instead of images, which
+    is enough for benchmarking directory scans.
+    """
+    rng = random.Random(seed)
+    sizes = sizes or DEFAULT_SIZES
+    formats = formats or DEFAULT_FORMATS
+    paths = []
+    for i in range(count):
+        width, height = rng.choice(sizes)
+        ext = rng.choice(formats)
+        image_seed = rng.random()
+        path = corpus_path(root, i, width, height, ext, depth)
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if placeholders:
+            open(path, 'wb').close()
+        else:
+            synthetic_image(width, height, random.Random(image_seed)).save(path)
+    return paths
+
+
+def generate_matrix(root: str, sizes: list[tuple[int, int]], formats: list[str] = None,
+                    seed: int = 0) -> dict[tuple[int, int, str], str]:
+    """Write one image for every combination of size and format, returned by (width, height, format)."""
+    rng = random.Random(seed)
+    formats = formats or DEFAULT_FORMATS
+    res = {}
+    for width, height in sizes:
+        for ext in formats:
+            image_seed = rng.random()
+            path = os.path.join(root, f'{width}x{height}.{ext}')
+            res[width, height, ext] = path
+            if not os.path.exists(path):
+                os.makedirs(root, exist_ok=True)
+                synthetic_image(width, height, random.Random(image_seed)).save(path)
+    return res
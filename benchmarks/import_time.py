@@ -0,0 +1,52 @@
+"""
+Startup benchmark: measures the import time of the application modules with `python -X importtime`.
+
+Usage: python benchmarks/import_time.py [--repeat N] [--resolve] [module ...]
+
+`--resolve` additionally resolves the platform backend (desktop detection, wallpaper setter) after
+importing, which is the cost that used to be paid at import time.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+DEFAULT_MODULES = ['handler.platform', 'handler.manager']
+
+
+def measure(module: str, resolve: bool) -> dict[str, int]:
+    """Import `module` in a fresh interpreter and return the cumulative import time per module in us."""
+    code = f'import {module}'
+    if resolve:
+        code += '; import handler.platform; handler.platform.get_platform()'
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=SRC_DIR,
+                          stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'Importing {module} failed:\n{proc.stderr}')
+    times = {}
+    for line in proc.stderr.splitlines():
+        # Format: "import time: <self us> | <cumulative us> | <indented module name>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--resolve', action='store_true')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [measure(module, args.resolve).get(module, 0) for _ in range(args.repeat)]
+        print(f'{module:<24} median {statistics.median(runs) / 1000:8.2f} ms   '
+              f'min {min(runs) / 1000:8.2f} ms   max {max(runs) / 1000:8.2f} ms   ({args.repeat} runs)')
+
+
+if __name__ == '__main__':
+    main()
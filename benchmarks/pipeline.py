@@ -0,0 +1,112 @@
+"""
+End-to-end throughput benchmark of WallpaperManager on the headless `file` platform.
+
+Usage: python benchmarks/pipeline.py [--cycles N] [--images N] [--corpus DIR] [--seed N]
+
+Every cycle calls next(), previous(), next() and rotate_current_left() on a synthetic corpus and
+reports wallpapers/second and p50/p95/p99 latency per action and per pipeline stage.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'src'))
+
+from corpus import generate_corpus  # noqa: E402
+from handler import platform  # noqa: E402
+from handler.configmanager import ConfigManager, ConfigField  # noqa: E402
+from handler.imagesource import DirectorySource  # noqa: E402
+from handler.manager import WallpaperManager  # noqa: E402
+from handler.metrics import MetricsObserver  # noqa: E402
+
+FONT_PATH = os.path.join(PROJECT_DIR, 'assets', 'fonts', 'Arial.ttf')
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class SpanRecorder(MetricsObserver):
+    def __init__(self) -> None:
+        self.spans: dict[str, list[float]] = {}
+
+    def on_span(self, stage: str, seconds: float) -> None:
+        self.spans.setdefault(stage, []).append(seconds)
+
+
+def create_manager(work_dir: str, corpus_dir: str) -> WallpaperManager:
+    config_path = os.path.join(work_dir, 'config.ini')
+    config = ConfigManager()
+    config.set_value(ConfigField.SOURCES, [DirectorySource('corpus', corpus_dir)])
+    config.write(config_path)
+    temp_dir = os.path.join(work_dir, 'temp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return WallpaperManager(config_path, temp_dir, FONT_PATH)
+
+
+def run(manager: WallpaperManager, cycles: int) -> dict[str, list[float]]:
+    stages = {
+        'next': manager.next,
+        'previous': manager.previous,
+        'next (history)': manager.next,
+        'rotate': manager.rotate_current_left,
+    }
+    latencies = {name: [] for name in stages}
+    for _ in range(cycles):
+        for name, action in stages.items():
+            start = time.perf_counter()
+            action()
+            latencies[name].append(time.perf_counter() - start)
+    return latencies
+
+
+def report(latencies: dict[str, list[float]]) -> None:
+    print(f'{"stage":<16}{"n":>6}{"mean":>10}{"p50":>10}{"p95":>10}{"p99":>10}   (ms)')
+    for name, values in latencies.items():
+        if len(values) == 0:
+            continue
+        print(f'{name:<16}{len(values):>6}{statistics.mean(values) * 1000:>10.1f}'
+              f'{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}'
+              f'{percentile(values, 99) * 1000:>10.1f}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=20)
+    parser.add_argument('--images', type=int, default=50)
+    parser.add_argument('--corpus', help='directory to generate the corpus in (reused between runs)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    platform.select_backend('file')
+    with tempfile.TemporaryDirectory() as work_dir:
+        corpus_dir = args.corpus or os.path.join(work_dir, 'corpus')
+        generate_corpus(corpus_dir, args.images, args.seed)
+        manager = create_manager(work_dir, corpus_dir)
+        manager.refresh_config()
+        recorder = SpanRecorder()
+        manager.metrics.subscribe(recorder)
+
+        start = time.perf_counter()
+        latencies = run(manager, args.cycles)
+        elapsed = time.perf_counter() - start
+
+        applied = platform.get_platform().applied
+        intervals = [b.time - a.time for a, b in zip(applied, applied[1:])]
+        latencies['between applies'] = intervals
+        print(f'{len(applied)} wallpapers in {elapsed:.2f} s: {len(applied) / elapsed:.2f} wallpapers/s')
+        report(latencies)
+        print()
+        report(recorder.spans)
+        print()
+        for counter, value in sorted(manager.metrics.counters().items()):
+            print(f'{counter:<20}{value:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from handler.configmanager import ConfigField
+from handler.manager import WallpaperManager, WallpaperObserver
+from handler.metrics import BUCKETS, resident_memory_bytes, peak_resident_memory_bytes
+from timer.timer import WallpaperTimer
+
+
+def format_prometheus(manager: WallpaperManager, timer: WallpaperTimer) -> str:
+    lines = [
+        '# HELP wallpaper_stage_seconds Duration of the stages of the render pipeline.',
+        '# TYPE wallpaper_stage_seconds histogram',
+    ]
+    for stage, h in sorted(manager.metrics.histograms().items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h.bucket_counts):
+            cumulative += count
+            lines.append(f'wallpaper_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'wallpaper_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+        lines.append(f'wallpaper_stage_seconds_sum{{stage="{stage}"}} {h.total}')
+        lines.append(f'wallpaper_stage_seconds_count{{stage="{stage}"}} {h.count}')
+    lines += [
+        '# HELP wallpaper_events_total Pipeline events such as cache hits and rejected candidates.',
+        '# TYPE wallpaper_events_total counter',
+    ]
+    for counter, value in sorted(manager.metrics.counters().items()):
+        lines.append(f'wallpaper_events_total{{event="{counter}"}} {value}')
+    lines += [
+        '# HELP wallpaper_pipeline_gauge Current values measured by the pipeline, such as image memory.',
+        '# TYPE wallpaper_pipeline_gauge gauge',
+    ]
+    for gauge, value in sorted(manager.metrics.gauges().items()):
+        lines.append(f'wallpaper_pipeline_gauge{{gauge="{gauge}"}} {value}')
+    gauges = [
+        ('wallpaper_scanned_files', 'Number of images found in the configured sources.', manager.scanned_count),
+        ('wallpaper_history_size', 'Number of wallpapers in the history.', manager.history_size),
+        ('wallpaper_timer_running', 'Whether wallpapers currently change automatically.', int(timer.is_running)),
+        ('process_resident_memory_bytes', 'Resident memory size in bytes.', resident_memory_bytes()),
+        ('process_max_resident_memory_bytes', 'Peak resident memory size in bytes.', peak_resident_memory_bytes()),
+    ]
+    for name, help_text, value in gauges:
+        if value is None:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
+
+
+class ControlServer(WallpaperObserver):
+    """
+    Local HTTP endpoint that serves `GET /metrics` in the Prometheus text format, `GET /metrics/summary` as a
+    table of stage percentiles and counters that is also written to the log, and accepts
+    `POST /next`, `/previous`, `/pause` and `/resume`. Disabled while `control_port` is 0.
+    """
+
+    def __init__(self, manager: WallpaperManager, timer: WallpaperTimer) -> None:
+        self.manager = manager
+        self.timer = timer
+        self.commands: dict[str, Callable[[], None]] = {
+            'next': manager.next,
+            'previous': manager.previous,
+            'pause': timer.pause,
+            'resume': timer.resume,
+        }
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Optional[tuple[str, int]]:
+        if self._server is None:
+            return None
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        self.manager.subscribe(self)
+        self._listen()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
+
+    def _listen(self) -> None:
+        self.stop()
+        host = self.manager.get_config(ConfigField.CONTROL_HOST)
+        port = self.manager.get_config(ConfigField.CONTROL_PORT)
+        if port == 0:
+            return
+        try:
+            self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        except OSError:
+            logging.exception(f'Cannot listen for control requests on {host}:{port}')
+            return
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='control', daemon=True)
+        self._thread.start()
+        logging.info(f'Listening for control requests on {host}:{port}')
+
+    def _create_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == '/metrics':
+                    body = format_prometheus(server.manager, server.timer)
+                    self._respond(200, body, 'text/plain; version=0.0.4')
+                elif self.path == '/metrics/summary':
+                    self._respond(200, server.manager.dump_metrics() + '\n')
+                else:
+                    self._respond(404, 'Not found\n')
+
+            def do_POST(self) -> None:
+                command = server.commands.get(self.path.strip('/'))
+                if command is None:
+                    self._respond(404, f'Unknown command. Possible commands are {", ".join(server.commands)}\n')
+                    return
+                try:
+                    command()
+                except Exception as e:
+                    logging.exception(f'Control command {self.path} failed')
+                    self._respond(500, f'{e}\n')
+                    return
+                self._respond(200, 'OK\n')
+
+            def _respond(self, status: int, body: str, content_type: str = 'text/plain') -> None:
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logging.debug('Control request: ' + format, *args)
+
+        return Handler
+
+    def on_config_changes(self, changes: dict[ConfigField, Any]) -> None:
+        if ConfigField.CONTROL_HOST in changes or ConfigField.CONTROL_PORT in changes:
+            self._listen()
@@ -0,0 +1,263 @@
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+from dataclasses import dataclass
+from typing import Optional, BinaryIO
+
+import PIL.Image as Image
+
+from .fingerprint import hash_buffer, SAMPLE_SIZE
+from .imageeditor import image_from_file, image_size, DecodeBudget
+from .imagesource import ImageSource, ReadOnlySourceError, EXTS
+from .platform import platform
+
+ZIP_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+
+_index_folder: Optional[str] = None
+
+
+def set_index_folder(folder: str) -> None:
+    """Persist the member indexes of the archive sources that are created from now on as JSON files in `folder`."""
+    global _index_folder
+    _index_folder = folder
+
+
+@dataclass(frozen=True)
+class ArchiveMember:
+    name: str
+    size: int
+    # Offset of the data of an uncompressed member in the archive, of the local header for zip members
+    offset: Optional[int]
+    crc: Optional[int] = None
+
+
+class MemberReader(io.RawIOBase):
+    """Seekable read-only file over a slice of a memory-mapped archive, so members are not extracted or copied."""
+
+    def __init__(self, data: memoryview) -> None:
+        super().__init__()
+        self._data = data
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._data) - self._pos))
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def getbuffer(self) -> memoryview:
+        """The whole member, like `io.BytesIO.getbuffer`. Valid until the reader is closed."""
+        return self._data
+
+    def close(self) -> None:
+        if not self.closed:
+            self._data.release()
+        super().close()
+
+
+class ArchiveSource(ImageSource):
+    """
+    Images in a zip or tar archive, read without extracting it. The member index is built once per version
+    of the archive, identified by its size and modification time, and kept in the index folder if one was set
+    with `set_index_folder`. Uncompressed members, which are most images in practice, are read straight from a memory
+    map of the archive; compressed members are inflated into memory. The archive is never modified.
+    """
+    type_name = 'archive'
+    process_safe = True
+    read_only = True
+
+    def __init__(self, name: str, archive_path: str) -> None:
+        super().__init__(name)
+        self.archive_path = archive_path
+        self._lock = threading.Lock()
+        self._stamp: Optional[tuple[int, int]] = None
+        self._members: dict[str, ArchiveMember] = {}
+        self._map: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._is_zip = False
+        self._index_path: Optional[str] = None
+        if _index_folder is not None:
+            digest = hashlib.sha1(os.path.abspath(archive_path).encode('utf-8')).hexdigest()
+            self._index_path = os.path.join(_index_folder, digest + '.json')
+
+    def __getstate__(self) -> dict:
+        # The copy loads the index and maps the archive when it is first read
+        return {'name': self.name, 'archive_path': self.archive_path, 'index_path': self._index_path}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state['name'], state['archive_path'])
+        self._index_path = state['index_path']
+
+    def get_label(self, path: str) -> str:
+        return os.path.splitext(self._member_name(path))[0]
+
+    def scan(self) -> list[str]:
+        return [os.path.join(self.archive_path, name) for name in self._index()
+                if name.lower().endswith(EXTS)]
+
+    def read_image(self, path: str, budget: DecodeBudget = None) -> Image.Image:
+        with self._open(path) as f:
+            return image_from_file(path, budget, f)
+
+    def image_size(self, path: str) -> tuple[int, int]:
+        with self._open(path) as f:
+            return image_size(path, f)
+
+    def fingerprint(self, path: str) -> str:
+        member = self._index()[self._member_name(path)]
+        if member.crc is not None:
+            return f'crc32:{member.crc:08x}:{member.size}'
+        with self._open(path) as f:
+            return hash_buffer(f.getbuffer(), SAMPLE_SIZE)
+
+    def write_image(self, path: str, img: Image.Image) -> None:
+        raise ReadOnlySourceError(self, 'write')
+
+    def delete_image(self, path: str, to_trash: bool = False) -> None:
+        raise ReadOnlySourceError(self, 'delete')
+
+    def show_source(self, path: str) -> None:
+        platform.open_file_in_explorer(self.archive_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_map()
+
+    def _member_name(self, path: str) -> str:
+        return os.path.relpath(path, self.archive_path).replace(os.sep, '/')
+
+    def _index(self) -> dict[str, ArchiveMember]:
+        stat = os.stat(self.archive_path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if stamp != self._stamp:
+                self._close_map()
+                if not self._load_index(stamp):
+                    self._is_zip = zipfile.is_zipfile(self.archive_path)
+                    if self._is_zip:
+                        self._members = self._index_zip()
+                    else:
+                        self._members = self._index_tar()
+                    logging.info(f'Indexed {len(self._members)} members of {self.archive_path}')
+                    self._save_index(stamp)
+                self._stamp = stamp
+            return self._members
+
+    def _load_index(self, stamp: tuple[int, int]) -> bool:
+        """Load the saved index, if it was made for this version of the archive."""
+        if self._index_path is None:
+            return False
+        try:
+            with open(self._index_path, 'r') as f:
+                index = json.load(f)
+            if tuple(index['stamp']) != stamp:
+                return False
+            self._is_zip = index['zip']
+            self._members = {m[0]: ArchiveMember(*m) for m in index['members']}
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def _save_index(self, stamp: tuple[int, int]) -> None:
+        if self._index_path is None:
+            return
+        index = {
+            'stamp': list(stamp),
+            'zip': self._is_zip,
+            'members': [[m.name, m.size, m.offset, m.crc] for m in self._members.values()],
+        }
+        tmp_path = self._index_path + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(self._index_path), exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self._index_path)
+        except IOError:
+            logging.warning(f'Could not write archive index {self._index_path}')
+
+    def _close_map(self) -> None:
+        """Unmap the archive. Called with the lock held."""
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A member is still open: the map is closed once its reader is
+                pass
+            self._map = None
+
+    def _index_zip(self) -> dict[str, ArchiveMember]:
+        res = {}
+        with zipfile.ZipFile(self.archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                # Only unencrypted, stored members can be read in place
+                in_place = info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1
+                res[info.filename] = ArchiveMember(info.filename, info.file_size,
+                                                   info.header_offset if in_place else None, info.CRC)
+        return res
+
+    def _index_tar(self) -> dict[str, ArchiveMember]:
+        res = {}
+        with tarfile.open(self.archive_path) as archive:
+            # Only plain tar files store the members as they are
+            in_place = isinstance(archive.fileobj, io.BufferedReader)
+            for info in archive:
+                if info.isfile() and not info.issparse():
+                    res[info.name] = ArchiveMember(info.name, info.size, info.offset_data if in_place else None)
+        return res
+
+    def _open(self, path: str) -> BinaryIO:
+        name = self._member_name(path)
+        member = self._index()[name]
+        if member.offset is None:
+            return io.BytesIO(self._extract(name))
+        with self._lock:
+            if self._map is None:
+                with open(self.archive_path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+            offset = member.offset
+            if self._is_zip:
+                header = ZIP_LOCAL_HEADER.unpack_from(self._view, offset)
+                offset += ZIP_LOCAL_HEADER.size + header[9] + header[10]
+            return MemberReader(self._view[offset:offset + member.size])
+
+    def _extract(self, name: str) -> bytes:
+        if self._is_zip:
+            with zipfile.ZipFile(self.archive_path) as archive:
+                return archive.read(name)
+        with tarfile.open(self.archive_path) as archive:
+            return archive.extractfile(name).read()
+
+    def __eq__(self, other):
+        if isinstance(other, ArchiveSource):
+            return self.archive_path == other.archive_path
+        return False
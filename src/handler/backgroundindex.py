@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Generic, Optional, TypeVar
+
+from .imagesource import ImageSource
+
+T = TypeVar('T')
+
+
+def file_stamp(path: str) -> Optional[list[int]]:
+    """Size and modification time of `path`, or None if it is not a file on disk."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class BackgroundIndex(ABC, Generic[T]):
+    """
+    A value per scanned image, computed in the background and persisted in the JSON file at `index_path`.
+    Values are computed again when the size or modification time of a file changed. Subclasses keep their
+    lookup structures up to date in `_added` and `_removed`, which are called with the lock held.
+    """
+    SAVE_INTERVAL = 1000
+    WORKERS = 1
+    # What is computed, for the log
+    description = 'values'
+
+    def __init__(self, index_path: Optional[str]) -> None:
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        # path -> (file stamp, value)
+        self._entries: dict[str, tuple[Optional[list[int]], T]] = {}
+        self._file_ids: dict[str, tuple[ImageSource, str]] = {}
+        self._generation = 0
+        self._loaded = False
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def indexed_count(self) -> int:
+        return len(self._entries)
+
+    def value(self, path: str) -> Optional[T]:
+        entry = self._entries.get(path)
+        return entry[1] if entry is not None else None
+
+    def update(self, file_ids: list[tuple[ImageSource, str]]) -> None:
+        """Forget images that are no longer scanned and compute values for new or modified ones in the background."""
+        if not self._loaded:
+            self._load()
+        with self._lock:
+            self._file_ids = {path: (source, path) for source, path in file_ids}
+            for path in [p for p in self._entries if p not in self._file_ids]:
+                self._removed(path, self._entries.pop(path)[1])
+            self._generation += 1
+            generation = self._generation
+        self._worker = threading.Thread(target=self._compute_all, args=(list(file_ids), generation),
+                                        name=type(self).__name__, daemon=True)
+        self._worker.start()
+
+    def record(self, path: str, value: T) -> None:
+        """Store a value that was computed along the way."""
+        self._add(path, file_stamp(path), value)
+
+    def forget(self, path: str) -> Optional[tuple[Optional[list[int]], T]]:
+        """Drop a deleted image right away, without waiting for the next scan. Returns its entry, for `restore`."""
+        with self._lock:
+            self._file_ids.pop(path, None)
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._removed(path, entry[1])
+        return entry
+
+    def restore(self, file_id: tuple[ImageSource, str], entry: Optional[tuple[Optional[list[int]], T]]) -> None:
+        """Take back an image that was forgotten, with the entry that `forget` returned."""
+        path = file_id[1]
+        with self._lock:
+            self._file_ids[path] = file_id
+        if entry is not None:
+            self._add(path, entry[0], entry[1])
+
+    @abstractmethod
+    def _compute(self, source: ImageSource, path: str) -> Optional[T]:
+        pass
+
+    def _added(self, path: str, value: T) -> None:
+        pass
+
+    def _removed(self, path: str, value: T) -> None:
+        pass
+
+    def _prepare(self, batch: list[tuple[ImageSource, str]]) -> None:
+        """Called by the background thread before the values of a batch are computed."""
+        pass
+
+    def _batch_done(self) -> None:
+        """Called by the background thread after every batch."""
+        pass
+
+    def _finished(self) -> None:
+        """Called by the background thread when all values are computed."""
+        pass
+
+    def _to_json(self, value: T) -> Any:
+        return value
+
+    def _from_json(self, data: Any) -> T:
+        return data
+
+    def _add(self, path: str, stamp: Optional[list[int]], value: T) -> None:
+        with self._lock:
+            old = self._entries.get(path)
+            if old is not None:
+                self._removed(path, old[1])
+            self._entries[path] = (stamp, value)
+            self._added(path, value)
+
+    def _compute_all(self, file_ids: list[tuple[ImageSource, str]], generation: int) -> None:
+        def compute(file_id: tuple[ImageSource, str]) -> Optional[T]:
+            source, path = file_id
+            if not source.is_available(path):
+                return None
+            try:
+                return self._compute(source, path)
+            except Exception as e:
+                logging.debug(f'Cannot compute {self.description} of {path}: {e}')
+                return None
+
+        missing = []
+        for source, path in file_ids:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != file_stamp(path):
+                missing.append((source, path))
+        if len(missing) == 0:
+            self._finished()
+            return
+        logging.info(f'Computing {self.description} of {len(missing)} images in the background')
+        with ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix=type(self).__name__) as pool:
+            for start in range(0, len(missing), self.SAVE_INTERVAL):
+                batch = missing[start:start + self.SAVE_INTERVAL]
+                self._prepare(batch)
+                for (source, path), value in zip(batch, pool.map(compute, batch)):
+                    if value is not None:
+                        self._add(path, file_stamp(path), value)
+                if generation != self._generation:
+                    return
+                self._batch_done()
+                self.save()
+        logging.info(f'Computed {self.description} of {len(missing)} images')
+        self._finished()
+
+    def _load_extra(self, index: dict[str, Any]) -> None:
+        pass
+
+    def _save_extra(self) -> dict[str, Any]:
+        return {}
+
+    def _load(self) -> None:
+        self._loaded = True
+        if self.index_path is None:
+            return
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            entries = [(path, stamp, self._from_json(data)) for path, (stamp, data) in index['entries'].items()]
+            self._load_extra(index)
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+        for path, stamp, value in entries:
+            self._add(path, stamp, value)
+
+    def save(self) -> None:
+        if self.index_path is None:
+            return
+        with self._lock:
+            entries = {path: [stamp, self._to_json(value)] for path, (stamp, value) in self._entries.items()}
+            index = {'entries': entries, **self._save_extra()}
+        tmp_path = self.index_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except IOError:
+            logging.warning(f'Could not write index {self.index_path}')
@@ -0,0 +1,280 @@
+import logging
+import math
+import random
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import PIL.Image as Image
+from PIL import ImageStat
+
+from .backgroundindex import BackgroundIndex
+from .colorthief import ColorThief
+from .imageeditor import RGB, DecodeBudget
+from .imagesource import ImageSource
+from .renderer import analysis_thumbnail
+
+Lab = tuple[float, float, float]
+
+PALETTE_SIZE = 5
+# Palettes are computed from a thumbnail, so a reduced decode is enough
+ANALYSIS_BUDGET = DecodeBudget(max_pixels=512 * 512)
+
+
+@dataclass(frozen=True)
+class ImageColors:
+    palette: tuple[RGB, ...]
+    # Mean and standard deviation of the gray values, from 0 to 1
+    luminance: float
+    contrast: float
+
+
+def analyse_colors(thumbnail: Image.Image) -> ImageColors:
+    stat = ImageStat.Stat(thumbnail.convert('L'))
+    return ImageColors(tuple(ColorThief(thumbnail).get_palette(PALETTE_SIZE)), stat.mean[0] / 255, stat.stddev[0] / 255)
+
+
+def _linear(c: float) -> float:
+    c /= 255
+    return c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+
+
+def rgb_to_lab(rgb: RGB) -> Lab:
+    """CIE L*a*b* coordinates of an sRGB color, for the D65 white point."""
+    r, g, b = (_linear(c) for c in rgb)
+    x = (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047
+    y = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    z = (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883
+
+    def f(t: float) -> float:
+        return t ** (1 / 3) if t > 0.008856 else 7.787 * t + 16 / 116
+
+    fx, fy, fz = f(x), f(y), f(z)
+    return 116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)
+
+
+def _distance2(a: Lab, b: Lab) -> float:
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class KDTree:
+    """Static, balanced 3-d tree over keyed points."""
+
+    def __init__(self, points: list[tuple[Lab, str]]) -> None:
+        # point, key, axis, left child, right child; -1 for no child
+        self._nodes: list[tuple[Lab, str, int, int, int]] = []
+        self._root = self._build(points, 0)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def _build(self, points: list[tuple[Lab, str]], depth: int) -> int:
+        if len(points) == 0:
+            return -1
+        axis = depth % 3
+        points = sorted(points, key=lambda p: p[0][axis])
+        median = len(points) // 2
+        left = self._build(points[:median], depth + 1)
+        right = self._build(points[median + 1:], depth + 1)
+        self._nodes.append((points[median][0], points[median][1], axis, left, right))
+        return len(self._nodes) - 1
+
+    def nearest(self, query: Lab, exclude: Callable[[str], bool]) -> Optional[tuple[str, float]]:
+        """The key closest to `query` for which `exclude` is false, with its squared distance."""
+        best: list = [None, math.inf]
+        nodes = self._nodes
+
+        def search(i: int) -> None:
+            point, key, axis, left, right = nodes[i]
+            d = _distance2(point, query)
+            if d < best[1] and not exclude(key):
+                best[0], best[1] = key, d
+            diff = query[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            if near >= 0:
+                search(near)
+            if far >= 0 and diff * diff < best[1]:
+                search(far)
+
+        if self._root >= 0:
+            search(self._root)
+        return (best[0], best[1]) if best[0] is not None else None
+
+
+class LuminanceIndex:
+    """
+    Images bucketed by luminance, with a Fenwick tree over the bucket sizes, so that a uniformly random
+    image within a luminance range is found in O(log n).
+    """
+    BUCKETS = 256
+
+    def __init__(self) -> None:
+        self._buckets: list[list[str]] = [[] for _ in range(self.BUCKETS)]
+        # key -> (bucket, position in the bucket)
+        self._positions: dict[str, tuple[int, int]] = {}
+        self._tree = [0] * (self.BUCKETS + 1)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def add(self, key: str, luminance: float) -> None:
+        self.remove(key)
+        bucket = self._bucket(luminance)
+        self._positions[key] = (bucket, len(self._buckets[bucket]))
+        self._buckets[bucket].append(key)
+        self._update(bucket, 1)
+
+    def remove(self, key: str) -> None:
+        position = self._positions.pop(key, None)
+        if position is None:
+            return
+        bucket, i = position
+        # Move the last key of the bucket into the hole
+        keys = self._buckets[bucket]
+        last = keys.pop()
+        if last != key:
+            keys[i] = last
+            self._positions[last] = (bucket, i)
+        self._update(bucket, -1)
+
+    def count(self, low: float, high: float) -> int:
+        return self._prefix(self._bucket(high) + 1) - self._prefix(self._bucket(low))
+
+    def pick(self, low: float, high: float) -> Optional[str]:
+        """A random key with a luminance between `low` and `high`."""
+        start = self._prefix(self._bucket(low))
+        total = self._prefix(self._bucket(high) + 1) - start
+        if total <= 0:
+            return None
+        k = start + random.randrange(total)
+        bucket = self._find(k)
+        return self._buckets[bucket][k - self._prefix(bucket)]
+
+    def _bucket(self, luminance: float) -> int:
+        return min(self.BUCKETS - 1, max(0, int(luminance * self.BUCKETS)))
+
+    def _update(self, bucket: int, delta: int) -> None:
+        i = bucket + 1
+        while i <= self.BUCKETS:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket: int) -> int:
+        """Number of keys in the buckets before `bucket`."""
+        res = 0
+        i = bucket
+        while i > 0:
+            res += self._tree[i]
+            i -= i & -i
+        return res
+
+    def _find(self, k: int) -> int:
+        """The bucket that holds the key with index `k` in luminance order."""
+        pos = 0
+        step = 1 << self.BUCKETS.bit_length()
+        while step > 0:
+            if pos + step <= self.BUCKETS and self._tree[pos + step] <= k:
+                pos += step
+                k -= self._tree[pos]
+            step >>= 1
+        return pos
+
+
+class ColorIndex(BackgroundIndex[ImageColors]):
+    """
+    Palettes, luminance and contrast of the scanned images. A KD-tree over the dominant colors in Lab
+    space answers nearest color queries; images added since the tree was built are searched linearly
+    until the next rebuild, which happens in the background. A luminance index draws images by brightness.
+    """
+    WORKERS = 2
+    REBUILD_PENDING = 512
+    description = 'color palettes'
+
+    def __init__(self, index_path: Optional[str]) -> None:
+        super().__init__(index_path)
+        self._tree = KDTree([])
+        self._tree_keys: set[str] = set()
+        # Dominant colors of the images that are not in the tree (yet)
+        self._pending: dict[str, Lab] = {}
+        self._rebuild_lock = threading.Lock()
+        self._luminance = LuminanceIndex()
+
+    def dominant_color(self, path: str) -> Optional[RGB]:
+        colors = self.value(path)
+        return colors.palette[0] if colors is not None and len(colors.palette) > 0 else None
+
+    def count_luminance(self, low: float, high: float) -> int:
+        with self._lock:
+            return self._luminance.count(low, high)
+
+    def pick_luminance(self, low: float, high: float, exclude: Callable[[tuple[ImageSource, str]], bool] = None,
+                       tries: int = 50) -> Optional[tuple[ImageSource, str]]:
+        """A random scanned image with a mean luminance between `low` and `high` that is not excluded."""
+        for _ in range(tries):
+            with self._lock:
+                path = self._luminance.pick(low, high)
+                file_id = self._file_ids.get(path) if path is not None else None
+            if path is None:
+                return None
+            if file_id is not None and (exclude is None or not exclude(file_id)):
+                return file_id
+        return None
+
+    def nearest(self, color: RGB, exclude: Callable[[tuple[ImageSource, str]], bool] = None) \
+            -> Optional[tuple[ImageSource, str]]:
+        """The scanned image whose dominant color is closest to `color`, skipping those that are excluded."""
+        query = rgb_to_lab(color)
+        with self._lock:
+            tree, pending, file_ids = self._tree, dict(self._pending), self._file_ids
+
+        def excluded(path: str) -> bool:
+            if path not in file_ids or path not in self._entries:
+                return True
+            return exclude is not None and exclude(file_ids[path])
+
+        best = tree.nearest(query, lambda path: path in pending or excluded(path))
+        for path, lab in pending.items():
+            d = _distance2(lab, query)
+            if (best is None or d < best[1]) and not excluded(path):
+                best = (path, d)
+        return file_ids[best[0]] if best is not None else None
+
+    def rebuild(self) -> None:
+        """Build the KD-tree over all palettes that are known."""
+        with self._rebuild_lock:
+            with self._lock:
+                points = [(rgb_to_lab(colors.palette[0]), path) for path, (stamp, colors) in self._entries.items()
+                          if len(colors.palette) > 0]
+            tree = KDTree(points)
+            with self._lock:
+                self._tree = tree
+                self._tree_keys = {path for lab, path in points}
+                self._pending = {path: lab for path, lab in self._pending.items() if path not in self._tree_keys}
+            logging.debug(f'Built color tree over {len(points)} images')
+
+    def _compute(self, source: ImageSource, path: str) -> Optional[ImageColors]:
+        return analyse_colors(analysis_thumbnail(source.read_image(path, ANALYSIS_BUDGET)))
+
+    def _added(self, path: str, colors: ImageColors) -> None:
+        if len(colors.palette) > 0:
+            self._pending[path] = rgb_to_lab(colors.palette[0])
+        self._luminance.add(path, colors.luminance)
+
+    def _removed(self, path: str, colors: ImageColors) -> None:
+        self._pending.pop(path, None)
+        # Removed images stay in the tree until the next rebuild, but are no longer in the entries
+        self._luminance.remove(path)
+
+    def _batch_done(self) -> None:
+        if len(self._pending) >= self.REBUILD_PENDING:
+            self.rebuild()
+
+    def _finished(self) -> None:
+        if len(self._pending) > 0:
+            self.rebuild()
+
+    def _to_json(self, colors: ImageColors) -> Any:
+        return {'palette': colors.palette, 'luminance': colors.luminance, 'contrast': colors.contrast}
+
+    def _from_json(self, data: Any) -> ImageColors:
+        return ImageColors(tuple((r, g, b) for r, g, b in data['palette']), data['luminance'], data['contrast'])
@@ -1,9 +1,16 @@
+import hashlib
 import logging
+import os
+import tempfile
 from configparser import ConfigParser, SectionProxy
 from configparser import Error as ConfigParserError
+from dataclasses import dataclass, replace
 from enum import Enum, unique, auto
-from typing import Any
+from types import MappingProxyType
+from typing import Any, Callable, Mapping, Optional
 
+from handler.archivesource import ArchiveSource
+from handler.httpsource import HttpSource
 from handler.imagesource import DirectorySource
 
 
@@ -17,6 +24,28 @@ class ConfigField(Enum):
     BOTTOM_LABEL_MARGIN = auto()
     CHANGE_TIME = auto()
     WIDGET_SCALE = auto()
+    CONTROL_HOST = auto()
+    CONTROL_PORT = auto()
+    PROFILE_TRANSITIONS = auto()
+    MONITOR_MODE = auto()
+    PER_SCREEN_IMAGES = auto()
+    MAX_PIXELS = auto()
+    MAX_DECODE_MEGABYTES = auto()
+    RESAMPLING_QUALITY = auto()
+    LATENCY_BUDGET = auto()
+    DUPLICATE_DISTANCE = auto()
+    FINGERPRINT_MODE = auto()
+    ASPECT_MODE = auto()
+    ASPECT_TOLERANCE = auto()
+    PLAYLIST = auto()
+    PLAYLIST_COLOR = auto()
+    LUMINANCE_SCHEDULE = auto()
+    LAYOUT = auto()
+    COLLAGE_IMAGES = auto()
+    RENDER_PROCESS = auto()
+    RENDER_PROCESS_MEGABYTES = auto()
+    DELETE_TO_TRASH = auto()
+    UNDO_DELETE_SECONDS = auto()
 
 
 class ConfigError(Exception):
@@ -31,6 +60,84 @@ class MissingOptionError(ConfigError):
         self.option = option
 
 
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """Immutable set of configuration values. Sources are kept as a tuple."""
+    values: Mapping[ConfigField, Any]
+
+    def __post_init__(self) -> None:
+        values = {field: tuple(value) if isinstance(value, list) else value for field, value in self.values.items()}
+        object.__setattr__(self, 'values', MappingProxyType(values))
+
+    def __getitem__(self, field: ConfigField) -> Any:
+        return self.values[field]
+
+    def get(self, field: ConfigField) -> Any:
+        return self.values.get(field)
+
+    def with_value(self, field: ConfigField, value: Any) -> 'ConfigSnapshot':
+        return replace(self, values={**self.values, field: value})
+
+    def changes_from(self, old: 'ConfigSnapshot') -> dict[ConfigField, Any]:
+        """The fields whose value differs from `old`, with their new value, in declaration order."""
+        return {field: self.get(field) for field in ConfigField if self.get(field) != old.get(field)}
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if value.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError(f'Not a boolean: {value}')
+
+
+def parse_choice(*choices: str) -> Callable[[str], str]:
+    def parse(value: str) -> str:
+        if value not in choices:
+            raise ValueError(f'Expected one of {", ".join(choices)}')
+        return value
+    return parse
+
+
+def parse_color(value: str) -> tuple[int, int, int]:
+    value = value.strip().lstrip('#')
+    if len(value) != 6:
+        raise ValueError(f'Not a color: {value}')
+    return int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16)
+
+
+def format_color(color: tuple[int, int, int]) -> str:
+    return '#{:02x}{:02x}{:02x}'.format(*color)
+
+
+# Mean luminance ranges, from 0 to 1, that the luminance schedule can ask for
+LUMINANCE_BANDS = {
+    'dark': (0.0, 0.3),
+    'dim': (0.2, 0.5),
+    'medium': (0.35, 0.65),
+    'bright': (0.55, 1.0),
+}
+
+
+def parse_schedule(value: str) -> tuple[tuple[int, str], ...]:
+    """Comma-separated `HH:MM=band` entries, as (minute of the day, band) sorted by time."""
+    res = []
+    for entry in filter(None, (e.strip() for e in value.split(','))):
+        time, sep, band = entry.partition('=')
+        hours, sep2, minutes = time.strip().partition(':')
+        if not sep or not sep2 or band.strip() not in LUMINANCE_BANDS:
+            raise ValueError(f'Expected HH:MM=band with band one of {", ".join(LUMINANCE_BANDS)}, got {entry}')
+        minute = int(hours) * 60 + int(minutes)
+        if not 0 <= minute < 24 * 60:
+            raise ValueError(f'Not a time of the day: {time}')
+        res.append((minute, band.strip()))
+    return tuple(sorted(res))
+
+
+def format_schedule(schedule: tuple[tuple[int, str], ...]) -> str:
+    return ', '.join(f'{minute // 60:02d}:{minute % 60:02d}={band}' for minute, band in schedule)
+
+
 def parse_directory_source(sect: SectionProxy) -> DirectorySource:
     root_folder = sect.get('root_folder')
     if root_folder is None:
@@ -42,6 +149,35 @@ def write_directory_source(sect: SectionProxy, s: DirectorySource) -> None:
     sect['root_folder'] = s.root_folder
 
 
+def parse_archive_source(sect: SectionProxy) -> ArchiveSource:
+    archive = sect.get('archive')
+    if archive is None:
+        raise MissingOptionError(sect.name, 'archive')
+    return ArchiveSource(sect.name, archive)
+
+
+def write_archive_source(sect: SectionProxy, s: ArchiveSource) -> None:
+    sect['archive'] = s.archive_path
+
+
+def parse_http_source(sect: SectionProxy) -> HttpSource:
+    index_url = sect.get('index_url')
+    if index_url is None:
+        raise MissingOptionError(sect.name, 'index_url')
+    cache_folder = sect.get('cache_folder', os.path.join(tempfile.gettempdir(), 'wallpaper-http', sect.name))
+    try:
+        cache_megabytes = sect.getint('cache_megabytes', 512)
+    except ValueError as e:
+        raise ConfigError(f'Option "cache_megabytes" in section "{sect.name}" has an invalid format') from e
+    return HttpSource(sect.name, index_url, cache_folder, cache_megabytes * 1024 * 1024)
+
+
+def write_http_source(sect: SectionProxy, s: HttpSource) -> None:
+    sect['index_url'] = s.index_url
+    sect['cache_folder'] = s.cache_folder
+    sect['cache_megabytes'] = str(s.cache_bytes // (1024 * 1024))
+
+
 class ConfigManager:
     basic_fields_title = 'config'
     basic_field_names = {
@@ -52,6 +188,28 @@ class ConfigManager:
         ConfigField.BOTTOM_LABEL_MARGIN: 'bottom_label_margin_pixels',
         ConfigField.CHANGE_TIME: 'seconds_per_transition',
         ConfigField.WIDGET_SCALE: 'widget_scale',
+        ConfigField.CONTROL_HOST: 'control_host',
+        ConfigField.CONTROL_PORT: 'control_port',
+        ConfigField.PROFILE_TRANSITIONS: 'profile_transitions',
+        ConfigField.MONITOR_MODE: 'monitor_mode',
+        ConfigField.PER_SCREEN_IMAGES: 'per_screen_images',
+        ConfigField.MAX_PIXELS: 'max_pixels',
+        ConfigField.MAX_DECODE_MEGABYTES: 'max_decode_megabytes',
+        ConfigField.RESAMPLING_QUALITY: 'resampling_quality',
+        ConfigField.LATENCY_BUDGET: 'latency_budget_seconds',
+        ConfigField.DUPLICATE_DISTANCE: 'duplicate_distance',
+        ConfigField.FINGERPRINT_MODE: 'fingerprint_mode',
+        ConfigField.ASPECT_MODE: 'aspect_mode',
+        ConfigField.ASPECT_TOLERANCE: 'aspect_tolerance_percent',
+        ConfigField.PLAYLIST: 'playlist',
+        ConfigField.PLAYLIST_COLOR: 'playlist_color',
+        ConfigField.LUMINANCE_SCHEDULE: 'luminance_schedule',
+        ConfigField.LAYOUT: 'layout',
+        ConfigField.COLLAGE_IMAGES: 'collage_images',
+        ConfigField.RENDER_PROCESS: 'render_process',
+        ConfigField.RENDER_PROCESS_MEGABYTES: 'render_process_megabytes',
+        ConfigField.DELETE_TO_TRASH: 'delete_to_trash',
+        ConfigField.UNDO_DELETE_SECONDS: 'undo_delete_seconds',
     }
     basic_field_parsers = {
         ConfigField.HOR_RESOLUTION: int,
@@ -61,6 +219,28 @@ class ConfigManager:
         ConfigField.BOTTOM_LABEL_MARGIN: int,
         ConfigField.CHANGE_TIME: float,
         ConfigField.WIDGET_SCALE: float,
+        ConfigField.CONTROL_HOST: str,
+        ConfigField.CONTROL_PORT: int,
+        ConfigField.PROFILE_TRANSITIONS: int,
+        ConfigField.MONITOR_MODE: parse_choice('single', 'span'),
+        ConfigField.PER_SCREEN_IMAGES: parse_bool,
+        ConfigField.MAX_PIXELS: int,
+        ConfigField.MAX_DECODE_MEGABYTES: int,
+        ConfigField.RESAMPLING_QUALITY: parse_choice('high', 'balanced', 'fast', 'preview', 'adaptive'),
+        ConfigField.LATENCY_BUDGET: float,
+        ConfigField.DUPLICATE_DISTANCE: int,
+        ConfigField.FINGERPRINT_MODE: parse_choice('sampled', 'full'),
+        ConfigField.ASPECT_MODE: parse_choice('off', 'prefer', 'restrict'),
+        ConfigField.ASPECT_TOLERANCE: float,
+        ConfigField.PLAYLIST: parse_choice('random', 'color', 'hue_walk'),
+        ConfigField.PLAYLIST_COLOR: parse_color,
+        ConfigField.LUMINANCE_SCHEDULE: parse_schedule,
+        ConfigField.LAYOUT: parse_choice('single', 'grid', 'justified'),
+        ConfigField.COLLAGE_IMAGES: int,
+        ConfigField.RENDER_PROCESS: parse_bool,
+        ConfigField.RENDER_PROCESS_MEGABYTES: int,
+        ConfigField.DELETE_TO_TRASH: parse_bool,
+        ConfigField.UNDO_DELETE_SECONDS: float,
     }
     basic_field_serializers = {
         ConfigField.HOR_RESOLUTION: str,
@@ -70,17 +250,68 @@ class ConfigManager:
         ConfigField.BOTTOM_LABEL_MARGIN: str,
         ConfigField.CHANGE_TIME: str,
         ConfigField.WIDGET_SCALE: str,
+        ConfigField.CONTROL_HOST: str,
+        ConfigField.CONTROL_PORT: str,
+        ConfigField.PROFILE_TRANSITIONS: str,
+        ConfigField.MONITOR_MODE: str,
+        ConfigField.PER_SCREEN_IMAGES: str,
+        ConfigField.MAX_PIXELS: str,
+        ConfigField.MAX_DECODE_MEGABYTES: str,
+        ConfigField.RESAMPLING_QUALITY: str,
+        ConfigField.LATENCY_BUDGET: str,
+        ConfigField.DUPLICATE_DISTANCE: str,
+        ConfigField.FINGERPRINT_MODE: str,
+        ConfigField.ASPECT_MODE: str,
+        ConfigField.ASPECT_TOLERANCE: str,
+        ConfigField.PLAYLIST: str,
+        ConfigField.PLAYLIST_COLOR: format_color,
+        ConfigField.LUMINANCE_SCHEDULE: format_schedule,
+        ConfigField.LAYOUT: str,
+        ConfigField.COLLAGE_IMAGES: str,
+        ConfigField.RENDER_PROCESS: str,
+        ConfigField.RENDER_PROCESS_MEGABYTES: str,
+        ConfigField.DELETE_TO_TRASH: str,
+        ConfigField.UNDO_DELETE_SECONDS: str,
+    }
+    # Fields that may be missing from older config files; they keep their default value
+    optional_fields = {
+        ConfigField.CONTROL_HOST,
+        ConfigField.CONTROL_PORT,
+        ConfigField.PROFILE_TRANSITIONS,
+        ConfigField.MONITOR_MODE,
+        ConfigField.PER_SCREEN_IMAGES,
+        ConfigField.MAX_PIXELS,
+        ConfigField.MAX_DECODE_MEGABYTES,
+        ConfigField.RESAMPLING_QUALITY,
+        ConfigField.LATENCY_BUDGET,
+        ConfigField.DUPLICATE_DISTANCE,
+        ConfigField.FINGERPRINT_MODE,
+        ConfigField.ASPECT_MODE,
+        ConfigField.ASPECT_TOLERANCE,
+        ConfigField.PLAYLIST,
+        ConfigField.PLAYLIST_COLOR,
+        ConfigField.LUMINANCE_SCHEDULE,
+        ConfigField.LAYOUT,
+        ConfigField.COLLAGE_IMAGES,
+        ConfigField.RENDER_PROCESS,
+        ConfigField.RENDER_PROCESS_MEGABYTES,
+        ConfigField.DELETE_TO_TRASH,
+        ConfigField.UNDO_DELETE_SECONDS,
     }
     source_parsers = {
-        DirectorySource.type_name: parse_directory_source
+        DirectorySource.type_name: parse_directory_source,
+        ArchiveSource.type_name: parse_archive_source,
+        HttpSource.type_name: parse_http_source,
     }
     source_writers = {
-        DirectorySource.type_name: write_directory_source
+        DirectorySource.type_name: write_directory_source,
+        ArchiveSource.type_name: write_archive_source,
+        HttpSource.type_name: write_http_source,
     }
 
     def __init__(self) -> None:
         # Set defaults:
-        self._values = {
+        self._snapshot = ConfigSnapshot({
             ConfigField.SOURCES: [],
             ConfigField.HOR_RESOLUTION: 1920,
             ConfigField.VER_RESOLUTION: 1080,
@@ -89,29 +320,76 @@ class ConfigManager:
             ConfigField.BOTTOM_LABEL_MARGIN: 60,
             ConfigField.CHANGE_TIME: 30.0,
             ConfigField.WIDGET_SCALE: 1.0,
-        }
+            ConfigField.CONTROL_HOST: '127.0.0.1',
+            ConfigField.CONTROL_PORT: 0,
+            ConfigField.PROFILE_TRANSITIONS: 0,
+            ConfigField.MONITOR_MODE: 'single',
+            ConfigField.PER_SCREEN_IMAGES: False,
+            ConfigField.MAX_PIXELS: 24000000,
+            ConfigField.MAX_DECODE_MEGABYTES: 1024,
+            ConfigField.RESAMPLING_QUALITY: 'high',
+            ConfigField.LATENCY_BUDGET: 2.0,
+            ConfigField.DUPLICATE_DISTANCE: 6,
+            ConfigField.FINGERPRINT_MODE: 'sampled',
+            ConfigField.ASPECT_MODE: 'off',
+            ConfigField.ASPECT_TOLERANCE: 10.0,
+            ConfigField.PLAYLIST: 'random',
+            ConfigField.PLAYLIST_COLOR: (42, 130, 218),
+            ConfigField.LUMINANCE_SCHEDULE: (),
+            ConfigField.LAYOUT: 'single',
+            ConfigField.COLLAGE_IMAGES: 6,
+            ConfigField.RENDER_PROCESS: False,
+            ConfigField.RENDER_PROCESS_MEGABYTES: 1024,
+            ConfigField.DELETE_TO_TRASH: False,
+            ConfigField.UNDO_DELETE_SECONDS: 10.0,
+        })
+        self._defaults = self._snapshot
+        # Hash of the contents of the configuration file that was read last
+        self._content_hash: Optional[str] = None
+
+    @property
+    def snapshot(self) -> ConfigSnapshot:
+        return self._snapshot
 
     def get_value(self, field: ConfigField) -> Any:
-        return self._values.get(field)
+        return self._snapshot.get(field)
 
     def set_value(self, field: ConfigField, value: Any) -> None:
-        self._values[field] = value
+        self._snapshot = self._snapshot.with_value(field, value)
 
     def read(self, config_path: str) -> list[ConfigField]:
-        changed = []
-
-        # Read config file
-        config = ConfigParser()
+        """
+        Read the configuration file and return the fields that changed. The file is only parsed when its
+        contents changed since the last read, and the new values are only applied when all of them are valid.
+        """
         try:
-            with open(config_path, 'r') as configfile:
-                try:
-                    config.read_file(configfile)
-                except ConfigParserError as e:
-                    raise ConfigError('Invalid configuration format') from e
+            with open(config_path, 'rb') as configfile:
+                content = configfile.read()
         except IOError:
             logging.info(f'No configuration file found at {config_path}. Creating a new one.')
             self.write(config_path)
-            return changed
+            return []
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == self._content_hash:
+            logging.debug(f'Configuration file {config_path} is unchanged')
+            return []
+        snapshot = self.parse(content.decode('utf-8'))
+        # Keep the sources that did not change, with their scan state and background work
+        old_sources = self._snapshot[ConfigField.SOURCES]
+        snapshot = snapshot.with_value(ConfigField.SOURCES, [next((o for o in old_sources if o == s), s)
+                                                             for s in snapshot[ConfigField.SOURCES]])
+        self._content_hash = content_hash
+        changed = list(snapshot.changes_from(self._snapshot))
+        self._snapshot = snapshot
+        return changed
+
+    def parse(self, content: str) -> ConfigSnapshot:
+        values = {}
+        config = ConfigParser()
+        try:
+            config.read_string(content)
+        except ConfigParserError as e:
+            raise ConfigError('Invalid configuration format') from e
 
         # Read basic fields
         if self.basic_fields_title not in config:
@@ -119,16 +397,16 @@ class ConfigManager:
         sec = config[self.basic_fields_title]
         for field, name in self.basic_field_names.items():
             if name not in sec:
-                raise MissingOptionError(self.basic_fields_title, name)
-            try:
-                new = self.basic_field_parsers[field](sec[name])
-            except ValueError as e:
-                raise ConfigError(
-                    f'Option "{name}" in section "{self.basic_fields_title}" has an invalid format') from e
-            old = self.get_value(field)
-            self._values[field] = new
-            if old != new:
-                changed.append(field)
+                if field not in self.optional_fields:
+                    raise MissingOptionError(self.basic_fields_title, name)
+                new = self._defaults[field]
+            else:
+                try:
+                    new = self.basic_field_parsers[field](sec[name])
+                except ValueError as e:
+                    raise ConfigError(
+                        f'Option "{name}" in section "{self.basic_fields_title}" has an invalid format') from e
+            values[field] = new
 
         # Read sources
         new_sources = []
@@ -143,11 +421,10 @@ class ConfigManager:
                 raise ConfigError(f'Invalid source type "{t}" in section "{sec_title}". '
                                   f'Possible types are {", ".join(self.source_parsers.keys())}')
             new_sources.append(self.source_parsers[t](sec))
-        old_sources = self.get_value(ConfigField.SOURCES)
-        self._values[ConfigField.SOURCES] = new_sources
-        if new_sources != old_sources:
-            changed.append(ConfigField.SOURCES)
-        return changed
+        if len(new_sources) == 0:
+            raise ConfigError('Invalid configuration: no image sources provided')
+        values[ConfigField.SOURCES] = new_sources
+        return ConfigSnapshot(values)
 
     def write(self, config_path: str) -> None:
         config = ConfigParser()
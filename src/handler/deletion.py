@@ -0,0 +1,111 @@
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .imagesource import ImageSource, ReadOnlySourceError
+
+
+@dataclass
+class PendingDeletion:
+    file_id: tuple[ImageSource, str]
+    to_trash: bool
+    # time.monotonic() at which the next attempt is due
+    due: float
+    attempts: int = 0
+
+
+class DeletionQueue:
+    """
+    Deletes images on a background thread, so that the wallpaper changes without waiting for the file system.
+    A deletion waits for its undo window before the first attempt, and failed attempts are retried after
+    RETRY_SECONDS. `on_deleted` is called on the background thread with every image that is gone, and
+    `on_failed` with every image that could not be deleted after all.
+    """
+    RETRY_SECONDS = (2.0, 10.0, 60.0)
+
+    def __init__(self, on_deleted: Callable[[tuple[ImageSource, str]], None] = None,
+                 on_failed: Callable[[tuple[ImageSource, str]], None] = None) -> None:
+        self.on_deleted = on_deleted
+        self.on_failed = on_failed
+        self._condition = threading.Condition()
+        # Ordered by the time they were queued, so the last one is the one to undo
+        self._pending: list[PendingDeletion] = []
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    @property
+    def pending_count(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def delete(self, file_id: tuple[ImageSource, str], to_trash: bool = False, undo_seconds: float = 0.0) -> None:
+        with self._condition:
+            self._pending.append(PendingDeletion(file_id, to_trash, time.monotonic() + max(0.0, undo_seconds)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='deletion', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def undo(self) -> Optional[tuple[ImageSource, str]]:
+        """Cancel the last deletion that is not due yet, and return its image."""
+        with self._condition:
+            now = time.monotonic()
+            for i in range(len(self._pending) - 1, -1, -1):
+                # One that is due may be taken by the background thread any moment now. One that waits for a
+                # retry can still be taken back, since its file is still there.
+                if self._pending[i].due > now:
+                    return self._pending.pop(i).file_id
+        return None
+
+    def flush(self) -> None:
+        """Delete everything that is queued now, without waiting for undo windows or retries."""
+        with self._condition:
+            pending, self._pending = self._pending, []
+        for deletion in pending:
+            self._attempt(deletion)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    deletion = min(self._pending, key=lambda d: d.due, default=None)
+                    wait = deletion.due - time.monotonic() if deletion is not None else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                self._pending.remove(deletion)
+            if not self._attempt(deletion):
+                with self._condition:
+                    deletion.due = time.monotonic() + self.RETRY_SECONDS[deletion.attempts - 1]
+                    self._pending.append(deletion)
+
+    def _attempt(self, deletion: PendingDeletion) -> bool:
+        """Try to delete the image once. Returns False if it should be tried again."""
+        source, path = deletion.file_id
+        deletion.attempts += 1
+        try:
+            source.delete_image(path, deletion.to_trash)
+        except FileNotFoundError:
+            pass
+        except ReadOnlySourceError as e:
+            logging.warning(f'Not deleting {path}: {e}')
+            self._failed(deletion)
+            return True
+        except OSError as e:
+            if deletion.attempts > len(self.RETRY_SECONDS):
+                logging.error(f'Gave up deleting {path} after {deletion.attempts} attempts: {e}')
+                self._failed(deletion)
+                return True
+            logging.warning(f'Could not delete {path}, trying again later: {e}')
+            return False
+        logging.info(f'Moved {path} to the trash' if deletion.to_trash else f'Deleted {path}')
+        if self.on_deleted is not None:
+            self.on_deleted(deletion.file_id)
+        return True
+
+    def _failed(self, deletion: PendingDeletion) -> None:
+        if self.on_failed is not None:
+            self.on_failed(deletion.file_id)
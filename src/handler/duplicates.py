@@ -0,0 +1,156 @@
+import logging
+from collections import deque
+from typing import Any, Optional
+
+import PIL.Image as Image
+
+from .backgroundindex import BackgroundIndex
+from .imageeditor import DecodeBudget
+from .imagesource import ImageSource
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# Decoding at a fraction of the size is enough for a 9x8 thumbnail, and lets JPEGs be decoded in draft mode
+HASH_BUDGET = DecodeBudget(max_pixels=256 * 256)
+
+
+def dhash(img: Image.Image) -> int:
+    """64 bit difference hash: whether each pixel of a 9x8 grayscale thumbnail is brighter than its right neighbour."""
+    small = img.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR, reducing_gap=2.0).convert('L')
+    pixels = list(small.getdata())
+    res = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            i = row * (HASH_SIZE + 1) + col
+            res = res << 1 | (pixels[i] > pixels[i + 1])
+    return res
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex:
+    """
+    Multi-index hashing: hashes are split in `max_distance + 1` chunks, each with its own table. Two hashes
+    within `max_distance` of each other are equal in at least one chunk, so a lookup only compares against
+    the hashes that share a chunk with the query.
+    """
+
+    def __init__(self, max_distance: int) -> None:
+        self.max_distance = max_distance
+        count = min(max(max_distance, 0) + 1, HASH_BITS)
+        bounds = [HASH_BITS * i // count for i in range(count + 1)]
+        self._chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables: list[dict[int, set[int]]] = [{} for _ in self._chunks]
+        self._keys: dict[int, set[str]] = {}
+
+    def add(self, key: str, h: int) -> None:
+        if h not in self._keys:
+            self._keys[h] = set()
+            for (shift, mask), table in zip(self._chunks, self._tables):
+                table.setdefault(h >> shift & mask, set()).add(h)
+        self._keys[h].add(key)
+
+    def remove(self, key: str, h: int) -> None:
+        keys = self._keys.get(h)
+        if keys is None:
+            return
+        keys.discard(key)
+        if len(keys) == 0:
+            del self._keys[h]
+            for (shift, mask), table in zip(self._chunks, self._tables):
+                table[h >> shift & mask].discard(h)
+
+    def near(self, h: int) -> set[str]:
+        """The keys of all hashes within `max_distance` of `h`."""
+        if self.max_distance < 0:
+            return set()
+        candidates = set()
+        for (shift, mask), table in zip(self._chunks, self._tables):
+            candidates.update(table.get(h >> shift & mask, ()))
+        res = set()
+        for candidate in candidates:
+            if hamming_distance(h, candidate) <= self.max_distance:
+                res.update(self._keys[candidate])
+        return res
+
+
+class DuplicateIndex(BackgroundIndex[int]):
+    """
+    Perceptual hashes of the scanned images. Images that look like one of the last `RECENT` shown images
+    are reported as recent duplicates. A negative `max_distance` disables the detection.
+    """
+    RECENT = 20
+    WORKERS = 2
+    description = 'perceptual hashes'
+
+    def __init__(self, index_path: Optional[str], max_distance: int) -> None:
+        super().__init__(index_path)
+        # content fingerprint -> hash, so that moved and copied images are not decoded again
+        self._by_fingerprint: dict[str, int] = {}
+        self._lookup = HammingIndex(max_distance)
+        self._recent: deque[set[str]] = deque(maxlen=self.RECENT)
+        # Fingerprints of the batch that is being computed
+        self._batch_fingerprints: dict[str, Optional[str]] = {}
+
+    @property
+    def max_distance(self) -> int:
+        return self._lookup.max_distance
+
+    @max_distance.setter
+    def max_distance(self, max_distance: int) -> None:
+        with self._lock:
+            self._lookup = HammingIndex(max_distance)
+            for path, (stamp, h) in self._entries.items():
+                self._lookup.add(path, h)
+            self._recent.clear()
+
+    def is_recent_duplicate(self, path: str) -> bool:
+        return any(path in near for near in self._recent)
+
+    def mark_shown(self, path: str, img: Image.Image = None) -> None:
+        """Remember that `path` is shown. Its hash is computed from `img` if it was not hashed yet."""
+        h = self.value(path)
+        if h is None:
+            if img is None:
+                return
+            h = dhash(img)
+            self.record(path, h)
+        with self._lock:
+            self._recent.append(self._lookup.near(h))
+
+    def _prepare(self, batch: list[tuple[ImageSource, str]]) -> None:
+        # Fingerprint every source's part of the batch at once, which a directory source does in parallel
+        by_source: dict[int, tuple[ImageSource, list[str]]] = {}
+        for source, path in batch:
+            by_source.setdefault(id(source), (source, []))[1].append(path)
+        fingerprints = {}
+        for source, paths in by_source.values():
+            try:
+                fingerprints.update(source.fingerprint_all(paths))
+            except Exception as e:
+                # Left to _compute, one image at a time
+                logging.debug(f'Cannot fingerprint the images of {source.name}: {e}')
+        self._batch_fingerprints = fingerprints
+
+    def _compute(self, source: ImageSource, path: str) -> Optional[int]:
+        fingerprint = self._batch_fingerprints.get(path) or source.fingerprint(path)
+        h = self._by_fingerprint.get(fingerprint)
+        if h is None:
+            h = dhash(source.read_image(path, HASH_BUDGET))
+            with self._lock:
+                self._by_fingerprint[fingerprint] = h
+        return h
+
+    def _added(self, path: str, h: int) -> None:
+        self._lookup.add(path, h)
+
+    def _removed(self, path: str, h: int) -> None:
+        self._lookup.remove(path, h)
+
+    def _load_extra(self, index: dict[str, Any]) -> None:
+        self._by_fingerprint.update(index['fingerprints'])
+
+    def _save_extra(self) -> dict[str, Any]:
+        return {'fingerprints': dict(self._by_fingerprint)}
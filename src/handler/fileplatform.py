@@ -0,0 +1,39 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from .platform import Platform
+
+
+@dataclass(frozen=True)
+class AppliedWallpaper:
+    path: str
+    time: float  # time.perf_counter() at which the wallpaper was applied
+
+
+class FilePlatform(Platform):
+    """Headless platform that doesn't touch any desktop but records which wallpapers were applied."""
+    name = 'file'
+
+    def __init__(self) -> None:
+        self.applied: list[AppliedWallpaper] = []
+        self.trashed: list[str] = []
+
+    def open_file_in_explorer(self, path: str) -> None:
+        logging.info(f'Not showing {path}: running headless')
+
+    def open_file(self, path: str) -> None:
+        logging.info(f'Not opening {path}: running headless')
+
+    def set_wallpaper(self, path: str) -> None:
+        self.applied.append(AppliedWallpaper(path, time.perf_counter()))
+
+    def move_to_trash(self, path: str) -> None:
+        # There is no desktop trash: delete the file, but remember it was meant for the trash
+        os.remove(path)
+        self.trashed.append(path)
+
+
+def create_platform() -> Platform:
+    return FilePlatform()
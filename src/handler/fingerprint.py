@@ -0,0 +1,141 @@
+import hashlib
+import itertools
+import json
+import logging
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional
+
+CHUNK_SIZE = 1024 * 1024
+# Bytes read from both ends of a file in sampled mode
+SAMPLE_SIZE = 64 * 1024
+
+
+def hash_buffer(data: memoryview, sample_size: int = None) -> str:
+    """
+    Hex digest of `data`, hashed in chunks. With `sample_size`, only the size and the first and last
+    `sample_size` bytes are hashed.
+    """
+    size = len(data)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(size.to_bytes(8, 'little'))
+    if sample_size is not None and size > 2 * sample_size:
+        ranges = [(0, sample_size), (size - sample_size, size)]
+    else:
+        ranges = [(0, size)]
+    for start, end in ranges:
+        for offset in range(start, end, CHUNK_SIZE):
+            digest.update(data[offset:min(offset + CHUNK_SIZE, end)])
+    return digest.hexdigest()
+
+
+def hash_file(path: str, sample_size: int = None) -> str:
+    """`hash_buffer` of the contents of `path`, read through a memory map."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hash_buffer(memoryview(b''))
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                return hash_buffer(view, sample_size)
+            finally:
+                view.release()
+
+
+class FingerprintService:
+    """
+    Content fingerprints of files, hashed on a thread pool. Results are cached by device, inode, size and
+    modification time, so a file is only read again when it changed, and renames within a file system
+    keep their fingerprint. The cache can be persisted in a JSON file with `open_cache`.
+    It keeps the MAX_ENTRIES most recently used fingerprints, so that files that changed or are gone drop out.
+    """
+    WORKERS = 4
+    # New fingerprints after which the cache is saved
+    SAVE_INTERVAL = 1000
+    MAX_ENTRIES = 100_000
+
+    def __init__(self, sampled: bool = True) -> None:
+        self.sampled = sampled
+        self.cache_path: Optional[str] = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._cache: dict[str, str] = {}
+        self._unsaved = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def open_cache(self, path: str) -> None:
+        self.cache_path = path
+        try:
+            with open(path, 'r') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return
+        with self._lock:
+            # Entries are saved from least to most recently used
+            self._cache.update(cache)
+            self._trim()
+
+    def save(self) -> None:
+        if self.cache_path is None or self._unsaved == 0:
+            return
+        with self._lock:
+            cache = dict(self._cache)
+            self._unsaved = 0
+        tmp_path = self.cache_path + '.tmp'
+        try:
+            with self._save_lock:
+                with open(tmp_path, 'w') as f:
+                    json.dump(cache, f)
+                os.replace(tmp_path, self.cache_path)
+        except IOError:
+            logging.warning(f'Could not write fingerprint cache {self.cache_path}')
+
+    def fingerprint(self, path: str) -> str:
+        stat = os.stat(path)
+        mode = 'sampled' if self.sampled else 'full'
+        key = f'{mode}:{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}'
+        with self._lock:
+            # Move a hit to the end, since dicts keep their insertion order
+            res = self._cache.pop(key, None)
+            if res is not None:
+                self._cache[key] = res
+                return res
+        res = hash_file(path, SAMPLE_SIZE if self.sampled else None)
+        with self._lock:
+            self._cache[key] = res
+            self._unsaved += 1
+            self._trim()
+        if self._unsaved >= self.SAVE_INTERVAL:
+            self.save()
+        return res
+
+    def _trim(self) -> None:
+        """Drop the least recently used fingerprints over MAX_ENTRIES. Called with the lock held."""
+        excess = len(self._cache) - self.MAX_ENTRIES
+        if excess > 0:
+            for key in list(itertools.islice(self._cache, excess)):
+                del self._cache[key]
+
+    def submit(self, path: str) -> 'Future[str]':
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='fingerprint')
+        return self._pool.submit(self.fingerprint, path)
+
+    def fingerprint_all(self, paths: list[str]) -> dict[str, Optional[str]]:
+        """Fingerprints of `paths` in parallel. Files that cannot be read get None."""
+        futures = [self.submit(path) for path in paths]
+        res = {}
+        for path, future in zip(paths, futures):
+            try:
+                res[path] = future.result()
+            except OSError as e:
+                logging.debug(f'Cannot fingerprint {path}: {e}')
+                res[path] = None
+        self.save()
+        return res
+
+
+fingerprints = FingerprintService()
@@ -0,0 +1,413 @@
+import hashlib
+import http.client
+import json
+import logging
+import os
+import posixpath
+import random
+import shutil
+import threading
+import time
+import webbrowser
+from collections import deque
+from dataclasses import dataclass, asdict
+from html.parser import HTMLParser
+from typing import Optional, BinaryIO
+from urllib.parse import urljoin, urlsplit, unquote
+
+import PIL.Image as Image
+
+from .imageeditor import image_from_file, image_size, DecodeBudget
+from .imagesource import ImageSource, ImageUnavailableError, ReadOnlySourceError, EXTS
+
+# status, response headers
+Response = tuple[int, dict[str, str]]
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections, reused per host."""
+
+    def __init__(self, max_idle: int = 4, timeout: float = 30.0) -> None:
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle: dict[tuple[str, str], list[http.client.HTTPConnection]] = {}
+
+    def request(self, method: str, url: str, headers: dict[str, str] = None, sink: BinaryIO = None) -> Response:
+        """Send a request and read the whole response, into `sink` if the request succeeded."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+        conn, reused = self._acquire(key)
+        try:
+            try:
+                conn.request(method, target, headers=headers or {})
+                resp = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection: retry once on a new one
+                conn, reused = self._connect(key), False
+                conn.request(method, target, headers=headers or {})
+                resp = conn.getresponse()
+            if sink is not None and 200 <= resp.status < 300:
+                shutil.copyfileobj(resp, sink)
+            else:
+                resp.read()
+        except BaseException:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return resp.status, {k.lower(): v for k, v in resp.getheaders()}
+
+    def close(self) -> None:
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+    def _acquire(self, key: tuple[str, str]) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            conns = self._idle.get(key)
+            if conns:
+                return conns.pop(), True
+        return self._connect(key), False
+
+    def _connect(self, key: tuple[str, str]) -> http.client.HTTPConnection:
+        scheme, netloc = key
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, key: tuple[str, str], conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.links: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        if tag == 'a':
+            self.links.extend(value for name, value in attrs if name == 'href' and value)
+
+
+def parse_index(content: str, content_type: str) -> list[str]:
+    """Image links of an index: the links of an HTML page, such as a directory listing, or one URL per line."""
+    if 'html' in content_type:
+        parser = _LinkParser()
+        parser.feed(content)
+        links = parser.links
+    else:
+        links = [line.strip() for line in content.splitlines()]
+    return [link for link in links if link and urlsplit(link).path.lower().endswith(EXTS)]
+
+
+@dataclass
+class CacheEntry:
+    file: str
+    size: int
+    etag: Optional[str]
+    last_modified: Optional[str] = None
+    # Time the image was last shown, 0 if it was not shown since it was downloaded
+    shown: float = 0.0
+    # Whether it has to be revalidated with the server
+    stale: bool = False
+
+
+class HttpSource(ImageSource):
+    """
+    Images listed by an index on an HTTP server: an HTML page such as a directory listing, or a text file
+    with one URL per line. Images are downloaded in the background into a cache of at most `cache_bytes`,
+    and only cached images can be read, so rendering never waits for the network. Images that were shown
+    make room for new ones first. Cached images and the index are revalidated with conditional requests on every scan.
+    """
+    type_name = 'http'
+    read_only = True
+    WORKERS = 2
+    RETRY_SECONDS = 60.0
+    FIRST_DOWNLOAD_SECONDS = 30.0
+    CACHE_INDEX_NAME = 'cache.json'
+
+    def __init__(self, name: str, index_url: str, cache_folder: str, cache_bytes: int) -> None:
+        super().__init__(name)
+        self.index_url = index_url
+        self.cache_folder = cache_folder
+        self.cache_bytes = cache_bytes
+        self._pool = ConnectionPool(max_idle=self.WORKERS + 1)
+        self._cond = threading.Condition()
+        self._urls: list[str] = []
+        self._index_etag: Optional[str] = None
+        self._entries: dict[str, CacheEntry] = {}
+        self._urgent: deque[str] = deque()
+        self._in_flight: set[str] = set()
+        self._retry_after: dict[str, float] = {}
+        self._workers: list[threading.Thread] = []
+        self._loaded = False
+
+    @property
+    def cached_bytes(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def get_label(self, path: str) -> str:
+        base = self.index_url.rsplit('/', 1)[0] + '/'
+        rel = path[len(base):] if path.startswith(base) else urlsplit(path).path.lstrip('/')
+        return posixpath.splitext(unquote(rel))[0]
+
+    def scan(self) -> list[str]:
+        if not self._loaded:
+            self._load()
+        headers = {'If-None-Match': self._index_etag} if self._index_etag else {}
+        try:
+            with _TempFile(self.cache_folder) as tmp:
+                status, resp_headers = self._pool.request('GET', self.index_url, headers, tmp.file)
+                if status == 200:
+                    tmp.file.seek(0)
+                    content = tmp.file.read().decode('utf-8', errors='replace')
+                    urls = parse_index(content, resp_headers.get('content-type', ''))
+                    self._set_index([urljoin(self.index_url, url) for url in urls], resp_headers.get('etag'))
+                elif status != 304:
+                    logging.warning(f'Index {self.index_url} returned HTTP {status}: using the cached index')
+        except (http.client.HTTPException, OSError) as e:
+            logging.warning(f'Cannot read index {self.index_url}: {e}. Using the cached index.')
+        with self._cond:
+            for entry in self._entries.values():
+                entry.stale = True
+            self._cond.notify_all()
+        self._start_workers()
+        with self._cond:
+            # Images can only be shown once they are cached
+            self._cond.wait_for(lambda: len(self._entries) > 0 or len(self._urls) == 0,
+                                self.FIRST_DOWNLOAD_SECONDS)
+            return list(self._urls) if len(self._entries) > 0 else []
+
+    def read_image(self, path: str, budget: DecodeBudget = None) -> Image.Image:
+        try:
+            return image_from_file(self._cached_file(path), budget)
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            raise ImageUnavailableError(path)
+
+    def image_size(self, path: str) -> tuple[int, int]:
+        try:
+            return image_size(self._cached_file(path))
+        except FileNotFoundError:
+            raise ImageUnavailableError(path)
+
+    def fingerprint(self, path: str) -> str:
+        entry = self._entries.get(path)
+        if entry is None:
+            raise ImageUnavailableError(path)
+        if entry.etag is not None:
+            # An ETag only identifies a version of one resource, e.g. nginx makes them from mtime and size
+            return f'etag:{path}:{entry.etag}'
+        try:
+            with open(os.path.join(self.cache_folder, entry.file), 'rb') as f:
+                return hashlib.blake2b(f.read(), digest_size=20).hexdigest()
+        except FileNotFoundError:
+            raise ImageUnavailableError(path)
+
+    def is_available(self, path: str) -> bool:
+        return path in self._entries
+
+    def on_shown(self, path: str) -> None:
+        with self._cond:
+            entry = self._entries.get(path)
+            if entry is not None:
+                entry.shown = time.time()
+                self._cond.notify()
+
+    def write_image(self, path: str, img: Image.Image) -> None:
+        raise ReadOnlySourceError(self, 'write')
+
+    def delete_image(self, path: str, to_trash: bool = False) -> None:
+        raise ReadOnlySourceError(self, 'delete')
+
+    def show_source(self, path: str) -> None:
+        webbrowser.open(path)
+
+    def close(self) -> None:
+        with self._cond:
+            workers, self._workers = self._workers, []
+            self._cond.notify_all()
+        for worker in workers:
+            worker.join()
+        self._pool.close()
+
+    def _cached_file(self, path: str) -> str:
+        with self._cond:
+            entry = self._entries.get(path)
+            if entry is None:
+                if path not in self._urgent:
+                    self._urgent.append(path)
+                    self._cond.notify()
+                raise ImageUnavailableError(path)
+            return os.path.join(self.cache_folder, entry.file)
+
+    def _set_index(self, urls: list[str], etag: Optional[str]) -> None:
+        with self._cond:
+            self._urls = urls
+            self._index_etag = etag
+            known = set(urls)
+            for url in [url for url in self._entries if url not in known]:
+                self._evict(url)
+            self._save()
+
+    def _start_workers(self) -> None:
+        with self._cond:
+            while len(self._workers) < self.WORKERS:
+                worker = threading.Thread(target=self._work, name=f'http-{self.name}', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _work(self) -> None:
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                url = self._next_download()
+                while url is None and me in self._workers:
+                    self._cond.wait(self.RETRY_SECONDS)
+                    url = self._next_download()
+                if me not in self._workers:
+                    return
+                self._in_flight.add(url)
+            try:
+                self._download(url)
+            except (http.client.HTTPException, OSError) as e:
+                logging.warning(f'Cannot download {url}: {e}')
+                with self._cond:
+                    self._retry_after[url] = time.monotonic() + self.RETRY_SECONDS
+            finally:
+                with self._cond:
+                    self._in_flight.discard(url)
+
+    def _next_download(self) -> Optional[str]:
+        """Urgent requests first, then revalidations, then new images while the cache has room."""
+        now = time.monotonic()
+
+        def available(url: str) -> bool:
+            return url not in self._in_flight and self._retry_after.get(url, 0.0) <= now
+
+        while len(self._urgent) > 0:
+            url = self._urgent.popleft()
+            if url not in self._entries and available(url):
+                return url
+        for url, entry in self._entries.items():
+            if entry.stale and available(url):
+                return url
+        # Only prefetch while an image of average size still fits, or the cache would keep evicting what it fetched
+        cached_bytes = self.cached_bytes
+        mean_bytes = cached_bytes / len(self._entries) if len(self._entries) > 0 else 0
+        has_room = cached_bytes + mean_bytes <= self.cache_bytes or any(e.shown > 0 for e in self._entries.values())
+        if not has_room or len(self._entries) >= len(self._urls):
+            return None
+        for _ in range(20):
+            url = random.choice(self._urls)
+            if url not in self._entries and available(url):
+                return url
+        missing = [url for url in self._urls if url not in self._entries and available(url)]
+        return random.choice(missing) if len(missing) > 0 else None
+
+    def _download(self, url: str) -> None:
+        entry = self._entries.get(url)
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        elif entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        with _TempFile(self.cache_folder) as tmp:
+            status, resp_headers = self._pool.request('GET', url, headers, tmp.file)
+            if status == 304 and entry is not None:
+                with self._cond:
+                    entry.stale = False
+                return
+            if status != 200:
+                raise OSError(f'HTTP {status}')
+            ext = posixpath.splitext(urlsplit(url).path)[1].lower()
+            file = hashlib.sha1(url.encode('utf-8')).hexdigest() + ext
+            tmp.commit(os.path.join(self.cache_folder, file))
+        with self._cond:
+            self._entries[url] = CacheEntry(file, os.path.getsize(os.path.join(self.cache_folder, file)),
+                                            resp_headers.get('etag'), resp_headers.get('last-modified'))
+            self._shrink(keep=url)
+            self._save()
+            self._cond.notify_all()
+
+    def _shrink(self, keep: str) -> None:
+        """Evict shown images, longest shown first, then the oldest downloads, until the cache fits."""
+        order = sorted((url for url in self._entries if url != keep),
+                       key=lambda url: (self._entries[url].shown == 0, self._entries[url].shown))
+        for url in order:
+            if self.cached_bytes <= self.cache_bytes:
+                break
+            self._evict(url)
+
+    def _evict(self, url: str) -> None:
+        entry = self._entries.pop(url)
+        try:
+            os.remove(os.path.join(self.cache_folder, entry.file))
+        except OSError:
+            pass
+
+    def _load(self) -> None:
+        self._loaded = True
+        os.makedirs(self.cache_folder, exist_ok=True)
+        try:
+            with open(os.path.join(self.cache_folder, self.CACHE_INDEX_NAME), 'r') as f:
+                cache = json.load(f)
+            entries = {url: CacheEntry(**entry) for url, entry in cache['entries'].items()}
+            self._urls = cache['urls']
+            self._index_etag = cache['etag']
+        except (IOError, ValueError, KeyError, TypeError):
+            return
+        self._entries = {url: entry for url, entry in entries.items()
+                         if os.path.exists(os.path.join(self.cache_folder, entry.file))}
+
+    def _save(self) -> None:
+        cache = {'etag': self._index_etag, 'urls': self._urls,
+                 'entries': {url: asdict(entry) for url, entry in self._entries.items()}}
+        path = os.path.join(self.cache_folder, self.CACHE_INDEX_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.replace(path + '.tmp', path)
+
+    def __eq__(self, other):
+        if isinstance(other, HttpSource):
+            return (self.index_url, self.cache_folder, self.cache_bytes) == \
+                (other.index_url, other.cache_folder, other.cache_bytes)
+        return False
+
+
+class _TempFile:
+    """A temporary file in `folder` that is removed on exit unless it was moved into place with `commit`."""
+
+    def __init__(self, folder: str) -> None:
+        self.path = os.path.join(folder, f'.download-{threading.get_ident()}-{time.monotonic_ns()}')
+        self.file: Optional[BinaryIO] = None
+
+    def __enter__(self) -> '_TempFile':
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'w+b')
+        return self
+
+    def commit(self, path: str) -> None:
+        self.file.close()
+        os.replace(self.path, path)
+
+    def __exit__(self, *exc_info) -> None:
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
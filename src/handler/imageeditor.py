@@ -1,14 +1,135 @@
 from PIL import Image
 from PIL import ImageFont
 from PIL import ImageDraw
+from dataclasses import dataclass
+from enum import Enum, unique
+from typing import Optional, BinaryIO
+import math
 import os
 
 
 RGB = tuple[int, int, int]
 
+# Bytes per pixel of raw modes whose stride can be derived from the width
+RAW_PIXEL_SIZES = {'L': 1, 'RGB': 3, 'BGR': 3, 'RGBX': 4, 'RGBA': 4, 'BGRX': 4, 'BGRA': 4}
+BAND_BYTES = 16 * 1024 * 1024
 
-def image_from_file(path: str) -> Image.Image:
-    return Image.open(path).convert('RGB')
+
+@unique
+class Quality(Enum):
+    HIGH = 'high'
+    BALANCED = 'balanced'
+    FAST = 'fast'
+    PREVIEW = 'preview'
+
+
+# Quality -> (resampling filter, reducing gap). With a reducing gap, the image is first reduced with a box
+# filter by an integer factor, to no less than `gap` times the target size, before the filter is applied.
+RESAMPLING = {
+    Quality.HIGH: (Image.LANCZOS, None),
+    Quality.BALANCED: (Image.LANCZOS, 2.0),
+    Quality.FAST: (Image.BICUBIC, 1.5),
+    Quality.PREVIEW: (Image.BILINEAR, 1.0),
+}
+
+
+@dataclass(frozen=True)
+class DecodeBudget:
+    """
+    Limits for decoding one image: images with more than `max_pixels` pixels are reduced while they
+    are decoded where the format allows it, and afterwards otherwise. Images that would need more
+    than `max_bytes` bytes of decoded pixel data at once are refused.
+    """
+    max_pixels: Optional[int] = None
+    max_bytes: Optional[int] = None
+
+
+class ImageTooLargeError(Exception):
+    def __init__(self, path: str, size: tuple[int, int], required_bytes: int):
+        super().__init__(f'Decoding {size[0]}x{size[1]} image {path} needs {required_bytes} bytes')
+        self.path = path
+        self.size = size
+        self.required_bytes = required_bytes
+
+
+def image_size(path: str, fp: BinaryIO = None) -> tuple[int, int]:
+    """Size of an image, read from its header only."""
+    with Image.open(fp if fp is not None else path) as img:
+        return img.size
+
+
+def image_from_file(path: str, budget: DecodeBudget = None, fp: BinaryIO = None) -> Image.Image:
+    """Decode the image at `path`, or from the seekable file `fp` if given, in which case `path` is only its name."""
+    img = Image.open(fp if fp is not None else path)
+    width, height = img.size
+    if budget is None or budget.max_pixels is None or width * height <= budget.max_pixels:
+        _check_decode_bytes(path, img, budget)
+        return img.convert('RGB')
+
+    factor = math.ceil(math.sqrt(width * height / budget.max_pixels))
+    if img.format == 'JPEG':
+        # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft('RGB', (width // factor, height // factor))
+    elif _supports_bands(img):
+        if fp is not None:
+            res = _reduce_in_bands(fp, img, factor)
+        else:
+            with open(path, 'rb') as f:
+                res = _reduce_in_bands(f, img, factor)
+    else:
+        res = None
+    if img.format == 'JPEG' or res is None:
+        _check_decode_bytes(path, img, budget)
+        res = img.convert('RGB')
+        w, h = res.size
+        if w * h > budget.max_pixels:
+            res = res.reduce(math.ceil(math.sqrt(w * h / budget.max_pixels)))
+    res.info['original_size'] = (width, height)
+    return res
+
+
+def _check_decode_bytes(path: str, img: Image.Image, budget: Optional[DecodeBudget]) -> None:
+    required = img.width * img.height * max(3, len(img.getbands()))
+    if budget is not None and budget.max_bytes is not None and required > budget.max_bytes:
+        raise ImageTooLargeError(path, img.size, required)
+
+
+def _raw_layout(img: Image.Image) -> Optional[tuple[int, str, int, int]]:
+    """(offset, raw mode, stride, orientation) of an image stored as uncompressed rows, if it is."""
+    if len(img.tile) != 1:
+        return None
+    decoder, box, offset, args = img.tile[0]
+    if decoder != 'raw' or box != (0, 0) + img.size or not isinstance(args, tuple):
+        return None
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+    if stride == 0:
+        if rawmode not in RAW_PIXEL_SIZES:
+            return None
+        stride = img.width * RAW_PIXEL_SIZES[rawmode]
+    return offset, rawmode, stride, orientation
+
+
+def _supports_bands(img: Image.Image) -> bool:
+    return img.mode in ('L', 'RGB', 'RGBA', 'RGBX') and _raw_layout(img) is not None
+
+
+def _reduce_in_bands(f: BinaryIO, img: Image.Image, factor: int) -> Image.Image:
+    """Decode an uncompressed image from `f` a band of rows at a time, reducing every band by `factor`."""
+    offset, rawmode, stride, orientation = _raw_layout(img)
+    width, height = img.size
+    band_rows = max(factor, BAND_BYTES // stride // factor * factor)
+    res = Image.new('RGB', (math.ceil(width / factor), math.ceil(height / factor)))
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        # Bottom-up images store the last row first
+        first_stored_row = top if orientation > 0 else height - top - rows
+        f.seek(offset + first_stored_row * stride)
+        data = f.read(rows * stride)
+        band = Image.frombytes(img.mode, (width, rows), data, 'raw', rawmode, stride, orientation)
+        res.paste(band.convert('RGB').reduce(factor), (0, top // factor))
+    return res
 
 
 def rotate_left(img: Image.Image) -> Image.Image:
@@ -19,8 +140,29 @@ def rotate_right(img: Image.Image) -> Image.Image:
     return img.transpose(Image.ROTATE_270)
 
 
-def resize_and_center(img: Image.Image, width: int, height: int, background: RGB) -> Image.Image:
+def resize_and_center(img: Image.Image, width: int, height: int, background: RGB,
+                      quality: Quality = Quality.HIGH) -> Image.Image:
+    res = Image.new('RGB', (width, height), background)
+    paste_fitted(res, img, (0, 0, width, height), quality)
+    return res
+
+
+def paste_fitted(canvas: Image.Image, img: Image.Image, box: tuple[int, int, int, int],
+                 quality: Quality = Quality.HIGH, cover: bool = False) -> None:
+    """
+    Resize `img` into the (left, top, right, bottom) `box` of `canvas`: centered and as large as fits, or
+    centered and cropped to cover the whole box. Only the resized image is allocated on the way.
+    """
+    left, top, right, bottom = box
+    width, height = right - left, bottom - top
     currw, currh = img.size
+    resample, reducing_gap = RESAMPLING[quality]
+    if cover:
+        f = max(width/currw, height/currh)
+        cropw, croph = min(currw, width/f), min(currh, height/f)
+        region = ((currw - cropw)/2, (currh - croph)/2, (currw + cropw)/2, (currh + croph)/2)
+        canvas.paste(img.resize((width, height), resample, box=region, reducing_gap=reducing_gap), (left, top))
+        return
     if width/currw <= height/currh:
         f = width/currw
         innerw = width
@@ -32,23 +174,22 @@ def resize_and_center(img: Image.Image, width: int, height: int, background: RGB
         innerh = height
         offset = ((width - innerw)//2, 0)
 
-    res = Image.new('RGB', (width, height), background)
-    img = img.resize((innerw, innerh), Image.LANCZOS)
-    res.paste(img, offset)
-
-    return res
+    img = img.resize((innerw, innerh), resample, reducing_gap=reducing_gap)
+    canvas.paste(img, (left + offset[0], top + offset[1]))
 
 
 def write_label(img: Image.Image, text: str, font_path: str, preferred_font_size: float,
-                right_margin: int, bottom_margin: int) -> None:
+                right_margin: int, bottom_margin: int, box: tuple[int, int, int, int] = None) -> None:
+    """Write `text` in the bottom right corner of `img`, or of the (left, top, right, bottom) `box` in it."""
     font_path = os.path.normpath(font_path)
-    width, height = img.size
+    left, top, right, bottom = box if box is not None else (0, 0, *img.size)
+    width = right - left
     draw = ImageDraw.Draw(img, 'RGBA')
     font = ImageFont.truetype(font_path, int(preferred_font_size))
     text_w, text_h = draw.textsize(text, font)
     if text_w > width - 2 * right_margin:
         font = ImageFont.truetype(font_path, int(preferred_font_size * (width - 2 * right_margin) / text_w))
         text_w, text_h = draw.textsize(text, font)
-    text_x, text_y = (width - text_w - right_margin, height - text_h - bottom_margin)
+    text_x, text_y = (right - text_w - right_margin, bottom - text_h - bottom_margin)
     draw.rectangle([(text_x, text_y), (text_x + text_w, text_y + text_h)], fill=(0, 0, 0, 100))
     draw.text((text_x, text_y), text, fill=(255, 255, 255, 255), font=font)
@@ -1,8 +1,10 @@
 import os
 
-from .imageeditor import image_from_file
+from .fingerprint import fingerprints
+from .imageeditor import image_from_file, image_size, DecodeBudget
 from .platform import platform
 from abc import ABC, abstractmethod
+from typing import Optional
 
 import PIL.Image as Image
 
@@ -10,7 +12,24 @@ import PIL.Image as Image
 EXTS = ('png', 'bmp', 'jpg', 'jpeg')
 
 
+class ReadOnlySourceError(Exception):
+    def __init__(self, source: 'ImageSource', operation: str):
+        super().__init__(f'Cannot {operation} images of read-only source "{source.name}"')
+        self.source = source
+
+
+class ImageUnavailableError(IOError):
+    def __init__(self, path: str):
+        super().__init__(f'Image {path} is not available yet')
+        self.path = path
+
+
 class ImageSource(ABC):
+    # Whether a pickled copy of the source can read its images in another process
+    process_safe = False
+    # Whether write_image and delete_image always raise ReadOnlySourceError
+    read_only = False
+
     def __init__(self, name: str) -> None:
         self.name = name
 
@@ -28,7 +47,35 @@ class ImageSource(ABC):
         pass
 
     @abstractmethod
-    def read_image(self, path: str) -> Image.Image:
+    def read_image(self, path: str, budget: DecodeBudget = None) -> Image.Image:
+        pass
+
+    @abstractmethod
+    def image_size(self, path: str) -> tuple[int, int]:
+        """Size of the image at `path`, read from its header without decoding it."""
+        pass
+
+    @abstractmethod
+    def fingerprint(self, path: str) -> str:
+        """Identity of the contents of the image at `path`, which does not change when it is moved or renamed."""
+        pass
+
+    def fingerprint_all(self, paths: list[str]) -> dict[str, Optional[str]]:
+        """Fingerprints of `paths`, or None for images that cannot be read."""
+        res = {}
+        for path in paths:
+            try:
+                res[path] = self.fingerprint(path)
+            except OSError:
+                res[path] = None
+        return res
+
+    def is_available(self, path: str) -> bool:
+        """Whether the image at `path` can be read right away, without waiting for the network."""
+        return True
+
+    def on_shown(self, path: str) -> None:
+        """Called when the image at `path` became the wallpaper."""
         pass
 
     @abstractmethod
@@ -36,13 +83,17 @@ class ImageSource(ABC):
         pass
 
     @abstractmethod
-    def delete_image(self, path: str) -> None:
+    def delete_image(self, path: str, to_trash: bool = False) -> None:
         pass
 
     @abstractmethod
     def show_source(self, path: str) -> None:
         pass
 
+    def close(self) -> None:
+        """Stop background work and release resources; called when the source is no longer configured."""
+        pass
+
     @abstractmethod
     def __eq__(self, other):
         pass
@@ -50,6 +101,7 @@ class ImageSource(ABC):
 
 class DirectorySource(ImageSource):
     type_name = 'directory'
+    process_safe = True
 
     def __init__(self, name: str, root_folder: str) -> None:
         super().__init__(name)
@@ -64,14 +116,26 @@ class DirectorySource(ImageSource):
                 for filename in files
                 if filename.lower().endswith(EXTS)]
 
-    def read_image(self, path: str) -> Image.Image:
-        return image_from_file(path)
+    def read_image(self, path: str, budget: DecodeBudget = None) -> Image.Image:
+        return image_from_file(path, budget)
+
+    def image_size(self, path: str) -> tuple[int, int]:
+        return image_size(path)
+
+    def fingerprint(self, path: str) -> str:
+        return fingerprints.fingerprint(path)
+
+    def fingerprint_all(self, paths: list[str]) -> dict[str, Optional[str]]:
+        return fingerprints.fingerprint_all(paths)
 
     def write_image(self, path: str, img: Image.Image) -> None:
         img.save(path)
 
-    def delete_image(self, path: str) -> None:
-        os.remove(path)
+    def delete_image(self, path: str, to_trash: bool = False) -> None:
+        if to_trash:
+            platform.move_to_trash(path)
+        else:
+            os.remove(path)
 
     def show_source(self, path: str) -> None:
         platform.open_file_in_explorer(path)
@@ -0,0 +1,144 @@
+import logging
+import os
+import subprocess
+import pathlib
+import re
+import shutil
+import time
+import urllib.parse
+from typing import Optional
+
+from .platform import Platform, cached_detection
+from .wallpapersetter import create_setter, create_subprocess_setter, SetterError, SubprocessSetter, WallpaperSetter
+
+SUPPORTED_DESKTOPS = ['cinnamon', 'gnome', 'unity', 'mate', 'gnome2']
+# Environment variables that determine the outcome of desktop detection
+DETECTION_ENV = ['DESKTOP_SESSION', 'KDE_FULL_SESSION', 'GNOME_DESKTOP_SESSION_ID', 'XDG_SESSION_ID', 'DISPLAY']
+
+
+def _process_list() -> str:
+    # From http://www.bloggerpolis.com/2011/05/how-to-check-if-a-process-is-running-using-python/
+    # and http://richarddingwall.name/2009/06/18/windows-equivalents-of-ps-and-kill-commands/
+    try:  # Linux/Unix
+        s = subprocess.run(["ps", "axw"], stdout=subprocess.PIPE, text=True)
+    except (OSError, subprocess.SubprocessError):  # Windows
+        s = subprocess.run(["tasklist", "/v"], stdout=subprocess.PIPE, text=True)
+    return s.stdout
+
+
+def detect_desktop_session() -> Optional[str]:
+    # Detect the desktop session in use: https://stackoverflow.com/a/21213358/3083982
+    desktop_session = os.environ.get("DESKTOP_SESSION")
+    if desktop_session is not None:  # easier to match if we doesn't have  to deal with caracter cases
+        desktop_session = desktop_session.lower()
+        if desktop_session not in ["gnome", "unity", "cinnamon", "mate", "xfce4", "lxde", "fluxbox",
+                                   "blackbox", "openbox", "icewm", "jwm", "afterstep", "trinity", "kde"]:
+            # Special cases #
+            # Canonical sets $DESKTOP_SESSION to Lubuntu rather than LXDE if using LXDE.
+            # There is no guarantee that they will not do the same with the other desktop environments.
+            if "xfce" in desktop_session or desktop_session.startswith("xubuntu"):
+                desktop_session = "xfce4"
+            elif desktop_session.startswith("ubuntu"):
+                desktop_session = "unity"
+            elif desktop_session.startswith("lubuntu"):
+                desktop_session = "lxde"
+            elif desktop_session.startswith("kubuntu"):
+                desktop_session = "kde"
+            elif desktop_session.startswith("razor"):  # e.g. razorkwin
+                desktop_session = "razor-qt"
+            elif desktop_session.startswith("wmaker"):  # e.g. wmaker-common
+                desktop_session = "windowmaker"
+        return desktop_session
+    if os.environ.get('KDE_FULL_SESSION') == 'true':
+        return "kde"
+    if os.environ.get('GNOME_DESKTOP_SESSION_ID'):
+        if "deprecated" not in os.environ.get('GNOME_DESKTOP_SESSION_ID'):
+            return "gnome2"
+        return None
+    # From http://ubuntuforums.org/showthread.php?t=652320
+    processes = _process_list()
+    if re.search("xfce-mcs-manage", processes):
+        return "xfce4"
+    if re.search("ksmserver", processes):
+        return "kde"
+    return None
+
+
+def move_to_home_trash(path: str) -> None:
+    """Move `path` to the trash in the home folder, as described by the freedesktop trash specification."""
+    trash = os.path.join(os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'Trash')
+    files_dir, info_dir = os.path.join(trash, 'files'), os.path.join(trash, 'info')
+    os.makedirs(files_dir, mode=0o700, exist_ok=True)
+    os.makedirs(info_dir, mode=0o700, exist_ok=True)
+    base, ext = os.path.splitext(os.path.basename(path))
+    name, i = base + ext, 1
+    # Creating the info file claims the name in the trash
+    while True:
+        info_path = os.path.join(info_dir, name + '.trashinfo')
+        try:
+            fd = os.open(info_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            break
+        except FileExistsError:
+            i += 1
+            name = f'{base}.{i}{ext}'
+    with os.fdopen(fd, 'w') as f:
+        f.write('[Trash Info]\n'
+                f'Path={urllib.parse.quote(os.path.abspath(path))}\n'
+                f'DeletionDate={time.strftime("%Y-%m-%dT%H:%M:%S")}\n')
+    try:
+        # Files on other devices are copied into the trash
+        shutil.move(path, os.path.join(files_dir, name))
+    except OSError:
+        os.remove(info_path)
+        raise
+
+
+class Linux(Platform):
+    name = 'Linux'
+
+    def __init__(self, desktop_session: str) -> None:
+        self.desktop_session = desktop_session
+        self._setter: Optional[WallpaperSetter] = None
+
+    @property
+    def setter(self) -> WallpaperSetter:
+        if self._setter is None:
+            self._setter = create_setter(self.desktop_session)
+            logging.info(f'Using the {self._setter.name} wallpaper setter')
+        return self._setter
+
+    def open_file_in_explorer(self, path: str) -> None:
+        path = os.path.dirname(os.path.normpath(path))
+        subprocess.Popen(["xdg-open", path])
+
+    def open_file(self, path: str) -> None:
+        path = os.path.normpath(path)
+        subprocess.run(['xdg-open', path])
+
+    def set_wallpaper(self, image_path: str) -> None:
+        p = pathlib.Path(image_path).as_uri()
+        start = time.perf_counter()
+        try:
+            self.setter.apply(p)
+        except SetterError as e:
+            if isinstance(self._setter, SubprocessSetter):
+                raise
+            logging.warning(f'The {self._setter.name} wallpaper setter failed, falling back to subprocesses: {e}')
+            self._setter.close()
+            self._setter = create_subprocess_setter(self.desktop_session)
+            self._setter.apply(p)
+        logging.info('Applied wallpaper with the %s setter in %.1f ms', self._setter.name,
+                     (time.perf_counter() - start) * 1000)
+
+    def move_to_trash(self, path: str) -> None:
+        move_to_home_trash(path)
+
+
+def create_platform() -> Platform:
+    signature = {name: os.environ.get(name) for name in DETECTION_ENV}
+    desktop_session = cached_detection('desktop_session', signature, detect_desktop_session)
+    logging.info(f'Detected desktop session: {desktop_session}')
+    if desktop_session not in SUPPORTED_DESKTOPS:
+        logging.error(f"Unsupported desktop: {desktop_session}. Set WALLPAPER_PLATFORM=file to run headless.")
+        raise SystemExit()
+    return Linux(desktop_session)
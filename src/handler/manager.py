@@ -1,18 +1,35 @@
+import dataclasses
+import functools
 import logging
 import os
 import random
+import threading
 import time
-from typing import Tuple, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, Any, Optional, Callable
 
 import PIL.Image as Image
-from .colorthief import ColorThief
-from watchdog.events import PatternMatchingEventHandler
+from watchdog.events import FileSystemEventHandler, FileSystemEvent, EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, \
+    EVENT_TYPE_MOVED
 from watchdog.observers import Observer
 
-from .configmanager import ConfigManager, ConfigField, ConfigError
-from .imageeditor import resize_and_center, RGB, write_label, image_from_file, rotate_left, rotate_right
-from .imagesource import ImageSource
+from .colorindex import ColorIndex, analyse_colors
+from .configmanager import ConfigManager, ConfigField, ConfigError, LUMINANCE_BANDS
+from .deletion import DeletionQueue
+from .duplicates import DuplicateIndex
+from .fingerprint import fingerprints
+from .metadata import MetadataIndex
+from .imageeditor import image_from_file, rotate_left, rotate_right, DecodeBudget, ImageTooLargeError, RGB
+from .imagesource import ImageSource, ReadOnlySourceError, ImageUnavailableError
+from .metrics import Metrics
+from .profiler import TransitionProfiler
+from .quality import AdaptiveQuality
+from .thumbnails import ThumbnailCache, default_thumbnail_folder
+from .renderworker import RenderWorker, RenderWorkerError, RenderedFrame
+from .renderer import RenderSettings, Screen, render_wallpaper, analysis_thumbnail, stitch, \
+    decode_budget_from_config, grid_layout, justified_layout, tile_budget, render_tile, TILE_ASPECT
 from .platform import platform
+from timer.scheduler import Scheduler
 
 FileId = Tuple[ImageSource, str]
 
@@ -22,31 +39,114 @@ class EmptySourceError(Exception):
         super().__init__(f'Tried to read {tries} times from image source "{source.name}": no images found')
 
 
+# Fields that only change how the current image is rendered
+RENDER_FIELDS = {
+    ConfigField.HOR_RESOLUTION,
+    ConfigField.VER_RESOLUTION,
+    ConfigField.LABEL_SIZE,
+    ConfigField.RIGHT_LABEL_MARGIN,
+    ConfigField.BOTTOM_LABEL_MARGIN,
+    ConfigField.MONITOR_MODE,
+    ConfigField.PER_SCREEN_IMAGES,
+    ConfigField.RESAMPLING_QUALITY,
+    ConfigField.LAYOUT,
+    ConfigField.COLLAGE_IMAGES,
+}
+# Fields that decide whether the palettes of all scanned images are needed
+COLOR_INDEX_FIELDS = {
+    ConfigField.PLAYLIST,
+    ConfigField.LUMINANCE_SCHEDULE,
+    ConfigField.LAYOUT,
+}
+
+
 class WallpaperObserver:
     def on_config_change(self, field: ConfigField, value: Any) -> None:
         pass
 
+    def on_config_changes(self, changes: dict[ConfigField, Any]) -> None:
+        """Called once per configuration reload with all changed fields and their new values."""
+        for field, value in changes.items():
+            self.on_config_change(field, value)
+
     def on_wallpaper_change(self, file_id: FileId) -> None:
         pass
 
 
-class WallpaperManager(PatternMatchingEventHandler):
+def _synchronized(method: Callable) -> Callable:
+    """Run a method of the manager while holding its lock."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class WallpaperManager(FileSystemEventHandler):
     MAX_SCAN_TRIES = 3
     SCAN_FAIL_WAIT_SECONDS = 1.0
+    # Editors write a file in several steps: reload once the config file has been quiet for this long
+    CONFIG_DEBOUNCE_SECONDS = 0.3
     TEMP_SOURCE_NAME = 'source.jpg'
     TEMP_WALLPAPER_NAME = 'wallpaper.jpg'
     MIN_SIZE = 100
-
-    def __init__(self, config_path: str, temp_dir: str, font_path: str) -> None:
-        super().__init__(patterns=[config_path])
+    # Random picks that may be spent on avoiding near-duplicates of recently shown images
+    MAX_DUPLICATE_SKIPS = 20
+    MAX_RANDOM_PICKS = 50
+    # Threads that decode and draw the tiles of a collage
+    MAX_TILE_WORKERS = 4
+    # Render worker failures in a row after which wallpapers are rendered in-process
+    MAX_RENDER_WORKER_FAILURES = 3
+    # Chance to draw from the images that suit the screen when aspect_mode is prefer
+    PREFER_ASPECT_PROBABILITY = 0.8
+    DUPLICATE_INDEX_NAME = 'duplicates.json'
+    METADATA_INDEX_NAME = 'metadata.json'
+    COLOR_INDEX_NAME = 'colors.json'
+
+    def __init__(self, config_path: str, temp_dir: str, font_path: str, scheduler: Scheduler = None) -> None:
+        super().__init__()
+        # Held while the wallpaper or the configuration changes: the GUI, the scheduler, the control server and
+        # the deletion queue all call in from their own threads
+        self._lock = threading.RLock()
         self._config_path = config_path
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        # Restarted by every change of the config file, so that a burst of changes is read once
+        self._reload_job = self.scheduler.schedule(self.CONFIG_DEBOUNCE_SECONDS, self._reload_config,
+                                                   name='config reload', start=False, repeat=False)
         self._temp_dir = temp_dir
         self._font_path = font_path
         self._current_index = -1
         self._history: list[FileId] = []
+        # Images for the other screens, per history entry, when every screen shows its own image
+        self._companions: list[list[FileId]] = []
+        self._screens: list[Screen] = []
+        self._screen_pool: Optional[ThreadPoolExecutor] = None
+        self._tile_pool: Optional[ThreadPoolExecutor] = None
+        # Whether the image of the current wallpaper was reduced to fit the decode budget
+        self._current_reduced = False
         self._config = ConfigManager()
         self._scanned_files: list[FileId] = []
+        # Position of every scanned path in _scanned_files, so that a deleted image is dropped in O(1)
+        self._scanned_positions: dict[str, int] = {}
+        # What was dropped from the indexes for the images whose deletion can still be undone
+        self._forgotten: dict[str, tuple] = {}
         self._observers: list[WallpaperObserver] = []
+        self.metrics = Metrics()
+        self.profiler = TransitionProfiler(temp_dir)
+        self.adaptive_quality = AdaptiveQuality(self._config.get_value(ConfigField.LATENCY_BUDGET))
+        self.metrics.subscribe(self.adaptive_quality)
+        self.duplicates = DuplicateIndex(os.path.join(temp_dir, self.DUPLICATE_INDEX_NAME),
+                                         self._config.get_value(ConfigField.DUPLICATE_DISTANCE))
+        self.metadata = MetadataIndex(os.path.join(temp_dir, self.METADATA_INDEX_NAME))
+        self.colors = ColorIndex(os.path.join(temp_dir, self.COLOR_INDEX_NAME))
+        # Whether the color index was given the current scan
+        self._colors_indexed = False
+        # Images shown since the color playlist started
+        self._played: set[str] = set()
+        self.render_worker: Optional[RenderWorker] = None
+        self._render_worker_failures = 0
+        self.thumbnails = ThumbnailCache(default_thumbnail_folder(temp_dir))
+        self.deletions = DeletionQueue(self._on_deleted, self._on_delete_failed)
 
     @property
     def current_source(self) -> ImageSource:
@@ -56,51 +156,247 @@ class WallpaperManager(PatternMatchingEventHandler):
     def current_path(self) -> str:
         return self._history[self._current_index][1]
 
+    @property
+    def scanned_count(self) -> int:
+        return len(self._scanned_files)
+
+    @property
+    def history_size(self) -> int:
+        return len(self._history)
+
+    @property
+    def history(self) -> list[FileId]:
+        return list(self._history)
+
+    @property
+    def current_index(self) -> int:
+        return self._current_index
+
+    @property
+    def decode_budget(self) -> DecodeBudget:
+        return decode_budget_from_config(self._config)
+
+    @property
+    def render_settings(self) -> RenderSettings:
+        return RenderSettings.from_config(self._config, self._font_path, self.adaptive_quality.tier)
+
+    @_synchronized
+    def set_screens(self, screens: list[Screen]) -> None:
+        """Set the monitor geometry used when the wallpaper spans all screens."""
+        # The pool has a thread per screen. No spanned render is using it while the lock is held.
+        if self._screen_pool is not None and len(screens) != len(self._screens):
+            self._screen_pool.shutdown(wait=False)
+            self._screen_pool = None
+        self._screens = list(screens)
+
     def subscribe(self, observer: WallpaperObserver) -> None:
         self._observers.append(observer)
 
     def unsubscribe(self, observer: WallpaperObserver) -> None:
         self._observers.remove(observer)
 
-    def next(self) -> None:
-        last_id = self._history[-1] if len(self._history) > 0 else None
-        self._current_index += 1
-        while self._current_index >= len(self._history):
-            file_id = random.choice(self._scanned_files)
-            if len(self._scanned_files) > 1:
-                while file_id == last_id or file_id[1].endswith(self.TEMP_WALLPAPER_NAME):
-                    file_id = random.choice(self._scanned_files)
-            self._history.append(file_id)
-        file_id = self._history[self._current_index]
-        source_img = file_id[0].read_image(file_id[1])
-        width, height = source_img.size
-        while width < self.MIN_SIZE or height < self.MIN_SIZE:
-            file_id = random.choice(self._scanned_files)
-            self._history[self._current_index] = file_id
-            source_img = file_id[0].read_image(file_id[1])
-            width, height = source_img.size
+    @_synchronized
+    def next(self, luminance_band: Optional[str] = None) -> None:
+        """Show the next image of the history, or a new one, preferably in `luminance_band` if one is given."""
+        with self.profiler.profile(), self.metrics.transition():
+            with self.metrics.span('select'):
+                last_id = self._history[-1] if len(self._history) > 0 else None
+                self._current_index += 1
+                if self._current_index < len(self._history):
+                    self.metrics.increment('history_hits')
+                while self._current_index >= len(self._history):
+                    file_id = self._pick_random(last_id, luminance_band)
+                    for _ in range(self.MAX_DUPLICATE_SKIPS):
+                        if not self.duplicates.is_recent_duplicate(file_id[1]):
+                            break
+                        self.metrics.increment('skipped_duplicates')
+                        file_id = self._pick_random(last_id, luminance_band)
+                    self._history.append(file_id)
+                    self._companions.append([])
+                file_id = self._history[self._current_index]
+            while not self._show_candidate(file_id):
+                self.metrics.increment('rejected_candidates')
+                file_id = self._pick_random(last_id, luminance_band)
+                self._history[self._current_index] = file_id
+
+    def _show_candidate(self, file_id: FileId) -> bool:
+        """Show `file_id` as the wallpaper, unless it cannot be read or is too small."""
+        if self._uses_render_worker(file_id):
+            shown = self._show_rendered_candidate(file_id)
+            if shown is not None:
+                return shown
+        source_img = self._read_candidate(file_id)
+        if source_img is None or min(source_img.size) < self.MIN_SIZE:
+            return False
         self._set_wallpaper(file_id, source_img)
-
+        return True
+
+    def _show_rendered_candidate(self, file_id: FileId) -> Optional[bool]:
+        """Like `_show_candidate`, with the render worker. Returns None when the worker was given up on."""
+        try:
+            with self.metrics.span('render_process'):
+                frame = self.render_worker.render(file_id[0], file_id[1], self.render_settings,
+                                                  self.decode_budget, self.MIN_SIZE, self._source_path)
+        except ImageTooLargeError as e:
+            logging.warning(f'Skipping {file_id[1]}: {e}')
+            self.metrics.increment('skipped_too_large')
+            return False
+        except ImageUnavailableError as e:
+            logging.info(f'Skipping {file_id[1]}: {e}')
+            self.metrics.increment('skipped_unavailable')
+            return False
+        except RenderWorkerError as e:
+            self.metrics.increment('render_worker_failures')
+            self._render_worker_failures += 1
+            if e.systemic or self._render_worker_failures >= self.MAX_RENDER_WORKER_FAILURES:
+                # Another image would fail the same way: stop retrying and render in this process
+                logging.error(f'Rendering in-process from now on, the render worker failed: {e}')
+                self.render_worker.close()
+                self.render_worker = None
+                return None
+            logging.error(f'Skipping {file_id[1]}: {e}')
+            return False
+        self._render_worker_failures = 0
+        if frame is None:
+            return False
+        self._set_rendered_wallpaper(file_id, frame)
+        return True
+
+    def _uses_render_worker(self, file_id: FileId) -> bool:
+        return self.render_worker is not None and self.render_worker.can_render(file_id[0]) \
+            and self._config.get_value(ConfigField.LAYOUT) == 'single' and not self._spans_screens()
+
+    def _pick_random(self, last_id: Optional[FileId], luminance_band: Optional[str] = None) -> FileId:
+        """The next image of the playlist, other than `last_id` and readable right away if there is one."""
+        if len(self._scanned_files) == 1:
+            return self._scanned_files[0]
+        if luminance_band is not None:
+            file_id = self._pick_by_luminance(luminance_band, last_id)
+            if file_id is not None:
+                return file_id
+            self.metrics.increment('no_luminance_match')
+        playlist = self._config.get_value(ConfigField.PLAYLIST)
+        if playlist != 'random':
+            file_id = self._pick_by_color(playlist, last_id)
+            if file_id is not None:
+                return file_id
+        mode = self._config.get_value(ConfigField.ASPECT_MODE)
+        if mode == 'restrict' or (mode == 'prefer' and random.random() < self.PREFER_ASPECT_PROBABILITY):
+            for _ in range(self.MAX_RANDOM_PICKS):
+                file_id = self._pick_suitable()
+                if file_id is None:
+                    self.metrics.increment('no_suitable_images')
+                    break
+                if self._is_acceptable(file_id, last_id):
+                    return file_id
+        for _ in range(self.MAX_RANDOM_PICKS):
+            file_id = random.choice(self._scanned_files)
+            if self._is_acceptable(file_id, last_id):
+                return file_id
+        candidates = [file_id for file_id in self._scanned_files if self._is_acceptable(file_id, last_id)]
+        return random.choice(candidates if len(candidates) > 0 else self._scanned_files)
+
+    def _is_acceptable(self, file_id: FileId, last_id: Optional[FileId]) -> bool:
+        return file_id != last_id and not file_id[1].endswith(self.TEMP_WALLPAPER_NAME) \
+            and file_id[0].is_available(file_id[1])
+
+    def _pick_by_color(self, playlist: str, last_id: Optional[FileId]) -> Optional[FileId]:
+        """
+        The unplayed image whose dominant color is closest to the configured color, or for a hue walk, to
+        that of the last image. Starts over when every image with a known palette was played.
+        """
+        color = self._config.get_value(ConfigField.PLAYLIST_COLOR)
+        if playlist == 'hue_walk' and last_id is not None:
+            color = self.colors.dominant_color(last_id[1]) or color
+
+        def exclude(file_id: FileId) -> bool:
+            return file_id[1] in self._played or self.duplicates.is_recent_duplicate(file_id[1]) \
+                or not self._is_acceptable(file_id, last_id)
+
+        with self.metrics.span('color_query'):
+            file_id = self.colors.nearest(color, exclude)
+            if file_id is None and len(self._played) > 0:
+                self._played.clear()
+                file_id = self.colors.nearest(color, exclude)
+        return file_id
+
+    def _pick_by_luminance(self, band: str, last_id: Optional[FileId]) -> Optional[FileId]:
+        """A random unplayed image with a mean luminance in `band`, or a played one if there is none."""
+        low, high = LUMINANCE_BANDS[band]
+
+        def exclude(file_id: FileId) -> bool:
+            return self.duplicates.is_recent_duplicate(file_id[1]) or not self._is_acceptable(file_id, last_id)
+
+        with self.metrics.span('luminance_query'):
+            file_id = self.colors.pick_luminance(low, high, lambda f: f[1] in self._played or exclude(f),
+                                                 self.MAX_RANDOM_PICKS)
+            if file_id is None:
+                file_id = self.colors.pick_luminance(low, high, exclude, self.MAX_RANDOM_PICKS)
+        return file_id
+
+    def _pick_suitable(self) -> Optional[FileId]:
+        """A random image with about the aspect ratio of the screen and at least as many pixels, if one is known."""
+        width = self._config.get_value(ConfigField.HOR_RESOLUTION)
+        height = self._config.get_value(ConfigField.VER_RESOLUTION)
+        tolerance = self._config.get_value(ConfigField.ASPECT_TOLERANCE) / 100
+        return self.metadata.pick(width / height, tolerance, width * height)
+
+    @_synchronized
     def previous(self) -> None:
         if self._current_index > 0:
-            self._current_index -= 1
-            file_id = self._history[self._current_index]
-            source_img = file_id[0].read_image(file_id[1])
+            self.go_to(self._current_index - 1)
+
+    @_synchronized
+    def go_to(self, index: int) -> None:
+        """Show the wallpaper at `index` in the history again."""
+        if not 0 <= index < len(self._history) or index == self._current_index:
+            return
+        with self.metrics.transition():
+            file_id = self._history[index]
+            try:
+                source_img = self._read_image(file_id)
+            except ImageUnavailableError as e:
+                logging.warning(f'Cannot go back to {file_id[1]}: {e}')
+                return
+            self._current_index = index
+            self.metrics.increment('history_hits')
             self._set_wallpaper(file_id, source_img)
 
+    @_synchronized
     def rotate_current_left(self) -> None:
-        source, path = file_id = self._history[self._current_index]
-        source_img = image_from_file(self._source_path)
-        source_img = rotate_left(source_img)
-        self._set_wallpaper(file_id, source_img)
-        source.write_image(path, source_img)
+        self._rotate_current(rotate_left)
 
+    @_synchronized
     def rotate_current_right(self) -> None:
-        source, path = file_id = self._history[self._current_index]
-        source_img = image_from_file(self._source_path)
-        source_img = rotate_right(source_img)
-        self._set_wallpaper(file_id, source_img)
-        source.write_image(path, source_img)
+        self._rotate_current(rotate_right)
+
+    def _rotate_current(self, rotate: Callable[[Image.Image], Image.Image]) -> None:
+        with self.metrics.transition():
+            source, path = file_id = self._history[self._current_index]
+            reduced = self._current_reduced
+            with self.metrics.span('decode'):
+                source_img = image_from_file(self._source_path)
+            with self.metrics.span('rotate'):
+                source_img = rotate(source_img)
+            self._set_wallpaper(file_id, source_img)
+            self._current_reduced = reduced
+            with self.metrics.span('write_source'):
+                if reduced:
+                    # The temporary copy was reduced: rotate the original instead of overwriting it with less pixels
+                    try:
+                        original = source.read_image(path, DecodeBudget(max_bytes=self.decode_budget.max_bytes))
+                    except ImageTooLargeError as e:
+                        logging.warning(f'Not saving the rotation of {path}: {e}')
+                        return
+                    self._write_image(file_id, rotate(original))
+                else:
+                    self._write_image(file_id, source_img)
+
+    def _write_image(self, file_id: FileId, img: Image.Image) -> None:
+        try:
+            file_id[0].write_image(file_id[1], img)
+        except ReadOnlySourceError as e:
+            logging.warning(f'Not saving {file_id[1]}: {e}')
 
     def show_source_of_current(self) -> None:
         source, path = self._history[self._current_index]
@@ -109,13 +405,93 @@ class WallpaperManager(PatternMatchingEventHandler):
     def open_config(self) -> None:
         platform.open_file(self._config_path)
 
+    @_synchronized
     def delete_current(self) -> None:
+        """
+        Drop the current image and show the next one. The file is deleted in the background once the undo
+        window of undo_delete_seconds has passed.
+        """
         source, path = file_id = self._history[self._current_index]
-        source.delete_image(path)
-        self._scanned_files.remove(file_id)
-        del self._history[self._current_index]
-        self._current_index -= 1
+        if source.read_only:
+            logging.warning(f'Not deleting {path}: {ReadOnlySourceError(source, "delete")}')
+            return
+        if len(self._scanned_files) <= 1:
+            logging.warning(f'Not deleting {path}: it is the last image')
+            return
+        with self.metrics.transition():
+            with self.metrics.span('forget'):
+                self._forget(file_id)
+            self.deletions.delete(file_id, self._config.get_value(ConfigField.DELETE_TO_TRASH),
+                                  self._config.get_value(ConfigField.UNDO_DELETE_SECONDS))
+            self.metrics.increment('deleted_images')
+            self.next()
+
+    @_synchronized
+    def undo_delete(self) -> bool:
+        """Take back the last deletion and show its image again, if its file was not deleted yet."""
+        file_id = self.deletions.undo()
+        if file_id is None:
+            return False
+        self._restore(file_id)
+        self._history.insert(self._current_index + 1, file_id)
+        self._companions.insert(self._current_index + 1, [])
+        self.metrics.increment('undone_deletions')
         self.next()
+        return True
+
+    def _forget(self, file_id: FileId) -> None:
+        """Drop an image from the scan, the history and the indexes, so that it is never picked again."""
+        path = file_id[1]
+        self._remove_scanned(path)
+        # Keep the entry after the current one up next
+        before = sum(1 for f in self._history[:self._current_index] if f[1] == path)
+        kept = [i for i, f in enumerate(self._history) if f[1] != path]
+        self._history = [self._history[i] for i in kept]
+        self._companions = [[f for f in self._companions[i] if f[1] != path] for i in kept]
+        self._current_index -= before + 1
+        self._played.discard(path)
+        self._forgotten[path] = tuple(index.forget(path) for index in (self.duplicates, self.metadata, self.colors))
+
+    def _restore(self, file_id: FileId) -> None:
+        """Undo `_forget`, apart from the history."""
+        entries = self._forgotten.pop(file_id[1], (None, None, None))
+        for index, entry in zip((self.duplicates, self.metadata, self.colors), entries):
+            index.restore(file_id, entry)
+        self._add_scanned(file_id)
+
+    @_synchronized
+    def _on_deleted(self, file_id: FileId) -> None:
+        """Called by the deletion queue once the file of an image is gone."""
+        self._forgotten.pop(file_id[1], None)
+        self.thumbnails.purge(file_id[1])
+
+    @_synchronized
+    def _on_delete_failed(self, file_id: FileId) -> None:
+        """Called by the deletion queue when it gave up deleting an image: it can be picked again."""
+        if any(file_id[0] is s for s in self._config.get_value(ConfigField.SOURCES)):
+            self._restore(file_id)
+        else:
+            self._forgotten.pop(file_id[1], None)
+
+    def _add_scanned(self, file_id: FileId) -> None:
+        if file_id[1] not in self._scanned_positions:
+            self._scanned_positions[file_id[1]] = len(self._scanned_files)
+            self._scanned_files.append(file_id)
+
+    def _remove_scanned(self, path: str) -> None:
+        i = self._scanned_positions.pop(path, None)
+        if i is None:
+            return
+        # Move the last file into the hole
+        last = self._scanned_files.pop()
+        if last[1] != path:
+            self._scanned_files[i] = last
+            self._scanned_positions[last[1]] = i
+
+    def dump_metrics(self) -> str:
+        dump = self.metrics.dump()
+        logging.info("Pipeline metrics:\n%s", dump)
+        return dump
 
     def get_config(self, field: ConfigField) -> Any:
         return self._config.get_value(field)
@@ -125,10 +501,13 @@ class WallpaperManager(PatternMatchingEventHandler):
         self.refresh_config()
         self.next()
 
+    @_synchronized
     def invalidate_history_and_scan_sources(self) -> None:
         self._history = []
+        self._companions = []
         self._current_index = -1
         self._scanned_files = []
+        self._scanned_positions = {}
         for s in self._config.get_value(ConfigField.SOURCES):
             scan = s.scan()
             failed = 0
@@ -142,39 +521,281 @@ class WallpaperManager(PatternMatchingEventHandler):
                 scan = s.scan()
             logging.info("Found %d images", len(scan))
             for path in scan:
-                self._scanned_files.append((s, path))
-
+                # Images waiting to be deleted stay dropped
+                if path not in self._forgotten:
+                    self._add_scanned((s, path))
+        self.duplicates.update(self._scanned_files)
+        self.metadata.update(self._scanned_files)
+        self._colors_indexed = False
+        self._update_color_index()
+        self._played.clear()
+
+    def _needs_color_index(self) -> bool:
+        """Whether a setting draws on the palettes of images that were not shown yet."""
+        return self._config.get_value(ConfigField.PLAYLIST) != 'random' \
+            or len(self._config.get_value(ConfigField.LUMINANCE_SCHEDULE)) > 0 \
+            or self._config.get_value(ConfigField.LAYOUT) != 'single'
+
+    def _update_color_index(self) -> None:
+        """Compute the palettes of the scanned images in the background, once per scan and only if needed."""
+        if not self._colors_indexed and self._needs_color_index():
+            self._colors_indexed = True
+            self.colors.update(self._scanned_files)
+
+    @_synchronized
     def refresh_config(self) -> None:
         logging.info("Reading config")
-        changed = self._config.read(self._config_path)
-        if len(self._config.get_value(ConfigField.SOURCES)) == 0:
+        old = self._config.snapshot
+        # An invalid file is rejected as a whole, before any of its values are applied
+        self._config.read(self._config_path)
+        config = self._config.snapshot
+        if len(config[ConfigField.SOURCES]) == 0:
+            # Only the defaults, for a config file that was just created, have no sources
             raise ConfigError('Invalid configuration: no image sources provided')
-        if ConfigField.SOURCES in changed:
+        changes = config.changes_from(old)
+        if len(changes) == 0:
+            return
+        logging.info("Changed config fields: %s", ', '.join(field.name for field in changes))
+        if ConfigField.LATENCY_BUDGET in changes:
+            self.adaptive_quality.latency_budget = config[ConfigField.LATENCY_BUDGET]
+        if ConfigField.FINGERPRINT_MODE in changes:
+            fingerprints.sampled = config[ConfigField.FINGERPRINT_MODE] == 'sampled'
+        if ConfigField.PLAYLIST in changes or ConfigField.PLAYLIST_COLOR in changes:
+            self._played.clear()
+        if ConfigField.DUPLICATE_DISTANCE in changes:
+            self.duplicates.max_distance = config[ConfigField.DUPLICATE_DISTANCE]
+        if ConfigField.RENDER_PROCESS in changes or ConfigField.RENDER_PROCESS_MEGABYTES in changes:
+            self._configure_render_worker()
+        if ConfigField.PROFILE_TRANSITIONS in changes:
+            self.profiler.arm(config[ConfigField.PROFILE_TRANSITIONS])
+        if ConfigField.SOURCES not in changes and not COLOR_INDEX_FIELDS.isdisjoint(changes):
+            self._update_color_index()
+        if ConfigField.SOURCES in changes:
+            # Stop the replaced sources first, since a new source may share their cache
+            for s in old[ConfigField.SOURCES]:
+                if not any(s is new for new in config[ConfigField.SOURCES]):
+                    s.close()
             self.invalidate_history_and_scan_sources()
             self.next()
+        elif self._current_index >= 0 and not RENDER_FIELDS.isdisjoint(changes):
+            try:
+                self._render_current()
+            except (OSError, ImageTooLargeError) as e:
+                # Also when the current image was removed, which a folder source reports as a plain OSError
+                logging.warning(f'Cannot show the current wallpaper with the new configuration: {e}')
         for observer in self._observers:
-            for change in changed:
-                observer.on_config_change(change, self._config.get_value(change))
+            observer.on_config_changes(changes)
+
+    def _configure_render_worker(self) -> None:
+        if self.render_worker is not None:
+            self.render_worker.close()
+            self.render_worker = None
+        if self._config.get_value(ConfigField.RENDER_PROCESS):
+            megabytes = self._config.get_value(ConfigField.RENDER_PROCESS_MEGABYTES)
+            self.render_worker = RenderWorker(megabytes * 1024 * 1024)
+            self._render_worker_failures = 0
+
+    def _render_current(self) -> None:
+        with self.metrics.transition():
+            file_id = self._history[self._current_index]
+            self._set_wallpaper(file_id, self._read_image(file_id))
 
     def _set_wallpaper(self, file_id: FileId, source_img: Image.Image) -> None:
         logging.info("Setting background to %s", file_id[1])
+        self._current_reduced = 'original_size' in source_img.info
         self._create_wallpaper(file_id, source_img)
-        platform.set_wallpaper(self._wallpaper_path)
+        with self.metrics.span('set_wallpaper'):
+            platform.set_wallpaper(self._wallpaper_path)
+        with self.metrics.span('dedup'):
+            self.duplicates.mark_shown(file_id[1], source_img)
+        self._wallpaper_shown(file_id)
+
+    def _set_rendered_wallpaper(self, file_id: FileId, frame: RenderedFrame) -> None:
+        """Show a wallpaper that the render worker made; it already saved the source image."""
+        logging.info("Setting background to %s", file_id[1])
+        self._current_reduced = frame.original_size is not None
+        width, height = frame.source_size
+        self.metrics.increment('bytes_decoded', width * height * 3)
+        if self._current_reduced:
+            self.metrics.increment('reduced_on_decode')
+        self.metadata.record(file_id[1], frame.original_size or frame.source_size)
+        with self.metrics.span('save'):
+            frame.image.save(self._wallpaper_path)
+        with self.metrics.span('set_wallpaper'):
+            platform.set_wallpaper(self._wallpaper_path)
+        if self.duplicates.value(file_id[1]) is None:
+            self.duplicates.record(file_id[1], frame.dhash)
+        self.colors.record(file_id[1], frame.colors)
+        self.duplicates.mark_shown(file_id[1])
+        self._wallpaper_shown(file_id)
+
+    def _wallpaper_shown(self, file_id: FileId) -> None:
+        file_id[0].on_shown(file_id[1])
+        self._played.add(file_id[1])
+        self.metrics.increment('transitions')
         for observer in self._observers:
             observer.on_wallpaper_change(file_id)
 
     def _create_wallpaper(self, file_id: FileId, source_img: Image.Image) -> None:
         source, path = file_id
-        source_img.save(self._source_path)
-        background = self._find_matching_background(source_img)
-        wallpaper = resize_and_center(source_img, self._config.get_value(ConfigField.HOR_RESOLUTION),
-                                      self._config.get_value(ConfigField.VER_RESOLUTION), background)
-        lbl = source.get_label(path)
-        write_label(wallpaper, lbl, self._font_path,
-                    self._config.get_value(ConfigField.LABEL_SIZE),
-                    self._config.get_value(ConfigField.RIGHT_LABEL_MARGIN),
-                    self._config.get_value(ConfigField.BOTTOM_LABEL_MARGIN))
-        wallpaper.save(self._wallpaper_path)
+        with self.metrics.span('save_source'):
+            source_img.save(self._source_path)
+        if self._config.get_value(ConfigField.LAYOUT) != 'single':
+            wallpaper = self._render_collage(file_id, source_img)
+        elif self._spans_screens():
+            wallpaper = self._render_spanned(file_id, source_img)
+        else:
+            wallpaper = render_wallpaper(source_img, source.get_label(path), self.render_settings, self.metrics,
+                                         self._background(file_id, source_img))
+        with self.metrics.span('save'):
+            wallpaper.save(self._wallpaper_path)
+        # Largest amount of pixel data held at once: the source image plus the rendered wallpaper
+        w, h = source_img.size
+        self.metrics.set_gauge('transition_image_bytes', w * h * 3 + wallpaper.width * wallpaper.height * 3)
+
+    def _spans_screens(self) -> bool:
+        return self._config.get_value(ConfigField.MONITOR_MODE) == 'span' and len(self._screens) > 1
+
+    def _companions_of_current(self, count: int) -> list[FileId]:
+        companions = self._companions[self._current_index]
+        current = self._history[self._current_index]
+        while len(companions) < count:
+            companions.append(self._pick_companion(current, companions))
+        return companions[:count]
+
+    def _pick_companion(self, current: FileId, taken: list[FileId]) -> FileId:
+        """An image to show next to `current`, readable right away; `current` itself if none is found."""
+        for _ in range(self.MAX_RANDOM_PICKS):
+            file_id = random.choice(self._scanned_files)
+            # Avoid showing an image twice at once while there are enough others
+            if file_id in taken or not self._is_acceptable(file_id, current):
+                continue
+            size = self.metadata.value(file_id[1])
+            if size is None or min(size) >= self.MIN_SIZE:
+                return file_id
+        return current
+
+    def _render_spanned(self, file_id: FileId, source_img: Image.Image) -> Image.Image:
+        screens = self._screens
+        settings = self.render_settings
+        if self._config.get_value(ConfigField.PER_SCREEN_IMAGES):
+            companions = self._companions[self._current_index]
+            file_ids = [file_id] + self._companions_of_current(len(screens) - 1)
+            background = None
+        else:
+            companions = []
+            file_ids = [file_id] * len(screens)
+            background = self._background(file_id, source_img)
+        picking = threading.Lock()
+
+        def read(i: int) -> tuple[FileId, Image.Image]:
+            """The image of screen `i`; a companion that cannot be shown is swapped for another one."""
+            for _ in range(self.MAX_RANDOM_PICKS):
+                fid = file_ids[i]
+                if fid == file_id:
+                    break
+                img = self._read_candidate(fid)
+                if img is not None and min(img.size) >= self.MIN_SIZE:
+                    return fid, img
+                self.metrics.increment('rejected_candidates')
+                with picking:
+                    file_ids[i] = companions[i - 1] = self._pick_companion(file_id, file_ids)
+            return file_id, source_img
+
+        def render(i: int) -> Image.Image:
+            fid, img = read(i)
+            screen_settings = dataclasses.replace(settings, width=screens[i].width, height=screens[i].height)
+            return render_wallpaper(img, fid[0].get_label(fid[1]), screen_settings, self.metrics,
+                                    background if background is not None else self._background(fid, img))
+
+        if self._screen_pool is None:
+            self._screen_pool = ThreadPoolExecutor(max_workers=len(screens), thread_name_prefix='screen')
+        pool = self._screen_pool
+        with self.metrics.span('render_screens'):
+            renders = list(pool.map(render, range(len(screens))))
+        with self.metrics.span('stitch'):
+            return stitch(renders, screens)
+
+    def _render_collage(self, file_id: FileId, source_img: Image.Image) -> Image.Image:
+        """
+        Tile the current image and its companions over the screen. The tiles are decoded, reduced while
+        decoding to about their size, and drawn into one canvas in parallel.
+        """
+        settings = self.render_settings
+        cover = self._config.get_value(ConfigField.LAYOUT) == 'justified'
+        count = max(1, self._config.get_value(ConfigField.COLLAGE_IMAGES))
+        file_ids = [file_id] + self._companions_of_current(count - 1)
+        if self._tile_pool is None:
+            self._tile_pool = ThreadPoolExecutor(max_workers=min(self.MAX_TILE_WORKERS, os.cpu_count() or 1),
+                                                 thread_name_prefix='tile')
+
+        def size(fid: FileId) -> Optional[tuple[int, int]]:
+            if fid == file_id:
+                return source_img.info.get('original_size', source_img.size)
+            known = self.metadata.value(fid[1])
+            if known is not None or not cover:
+                return known
+            try:
+                return fid[0].image_size(fid[1])
+            except (IOError, ValueError):
+                return None
+
+        with self.metrics.span('layout'):
+            sizes = list(self._tile_pool.map(size, file_ids))
+            if cover:
+                boxes = justified_layout([s[0] / s[1] if s else TILE_ASPECT for s in sizes],
+                                         settings.width, settings.height)
+            else:
+                boxes = grid_layout(len(file_ids), settings.width, settings.height)
+        background = self._background(file_id, source_img)
+        canvas = Image.new('RGB', (settings.width, settings.height), background or (0, 0, 0))
+
+        def render(i: int) -> None:
+            fid = file_ids[i]
+            if fid == file_id:
+                img, tile_background = source_img, background
+            else:
+                img = self._read_candidate(fid, tile_budget(sizes[i], boxes[i], cover, self.decode_budget))
+                if img is None:
+                    return
+                tile_background = None if cover else self.colors.dominant_color(fid[1]) or self._background(fid, img)
+            render_tile(canvas, img, fid[0].get_label(fid[1]), boxes[i], settings, cover, tile_background)
+
+        with self.metrics.span('render_tiles'):
+            list(self._tile_pool.map(render, range(len(file_ids))))
+        return canvas
+
+    def _background(self, file_id: FileId, img: Image.Image) -> Optional[RGB]:
+        """
+        The dominant color of `img`, as the background of its wallpaper. Its palette comes from the same
+        thumbnail and is kept in the color index, so shown images need no analysis pass of their own.
+        """
+        with self.metrics.span('background'):
+            colors = analyse_colors(analysis_thumbnail(img))
+        self.colors.record(file_id[1], colors)
+        return colors.palette[0] if len(colors.palette) > 0 else None
+
+    def _read_image(self, file_id: FileId, budget: DecodeBudget = None) -> Image.Image:
+        with self.metrics.span('decode'):
+            img = file_id[0].read_image(file_id[1], budget if budget is not None else self.decode_budget)
+        width, height = img.size
+        self.metrics.increment('bytes_decoded', width * height * len(img.getbands()))
+        self.metadata.record(file_id[1], img.info.get('original_size', img.size))
+        if 'original_size' in img.info:
+            self.metrics.increment('reduced_on_decode')
+        return img
+
+    def _read_candidate(self, file_id: FileId, budget: DecodeBudget = None) -> Optional[Image.Image]:
+        try:
+            return self._read_image(file_id, budget)
+        except ImageTooLargeError as e:
+            logging.warning(f'Skipping {file_id[1]}: {e}')
+            self.metrics.increment('skipped_too_large')
+            return None
+        except ImageUnavailableError as e:
+            logging.info(f'Skipping {file_id[1]}: {e}')
+            self.metrics.increment('skipped_unavailable')
+            return None
 
     @property
     def _wallpaper_path(self) -> str:
@@ -184,19 +805,32 @@ class WallpaperManager(PatternMatchingEventHandler):
     def _source_path(self) -> str:
         return os.path.join(self._temp_dir, self.TEMP_SOURCE_NAME)
 
-    def _find_matching_background(self, img: Image.Image) -> RGB:
-        w, h = img.size
-        f = w*h/200/200
-        if f > 1:
-            img = img.resize((int(w/f), int(h/f)), Image.NEAREST)
-        thief = ColorThief(img)
-        return thief.get_color()
-
     def _watch_config_file(self):
         observer = Observer()
         observer.schedule(self, os.path.dirname(self._config_path), recursive=False)
         observer.daemon = False
         observer.start()
-
-    def on_modified(self, event):
-        self.refresh_config()
+        self.scheduler.start()
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        # Newer watchdog versions also report opening and closing the file, which reading it does
+        if event.is_directory or event.event_type not in (EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED):
+            return
+        # Editors that save through a temporary file end with a move onto the config file
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        if not any(self._is_config_path(path) for path in paths):
+            return
+        self._reload_job.restart()
+
+    def _is_config_path(self, path: Any) -> bool:
+        if not path:
+            return False
+        if isinstance(path, bytes):
+            path = os.fsdecode(path)
+        return os.path.normcase(os.path.realpath(path)) == os.path.normcase(os.path.realpath(self._config_path))
+
+    def _reload_config(self) -> None:
+        try:
+            self.refresh_config()
+        except ConfigError as e:
+            logging.error(f'Not applying the changed configuration: {e}')
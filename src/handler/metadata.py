@@ -0,0 +1,105 @@
+import math
+import random
+from bisect import bisect_left, bisect_right, insort
+from typing import Optional
+
+from .backgroundindex import BackgroundIndex
+from .imagesource import ImageSource
+
+# Width of an aspect ratio bucket, in natural log units: about 1%
+ASPECT_BUCKET_WIDTH = 0.01
+
+
+def aspect_bucket(aspect: float) -> int:
+    return math.floor(math.log(aspect) / ASPECT_BUCKET_WIDTH)
+
+
+class SizeIndex:
+    """
+    Images bucketed by aspect ratio, every bucket sorted by pixel count, so that a random image within an
+    aspect ratio range and above a pixel count is drawn with a binary search per bucket.
+    """
+
+    def __init__(self) -> None:
+        self._keys: list[int] = []
+        self._buckets: dict[int, list[tuple[int, str]]] = {}
+
+    def add(self, key: str, width: int, height: int) -> None:
+        bucket = aspect_bucket(width / height)
+        if bucket not in self._buckets:
+            insort(self._keys, bucket)
+            self._buckets[bucket] = []
+        insort(self._buckets[bucket], (width * height, key))
+
+    def remove(self, key: str, width: int, height: int) -> None:
+        entries = self._buckets.get(aspect_bucket(width / height))
+        if entries is None:
+            return
+        i = bisect_left(entries, (width * height, key))
+        if i < len(entries) and entries[i] == (width * height, key):
+            del entries[i]
+
+    def count(self, aspect: float, tolerance: float, min_pixels: int) -> int:
+        return sum(count for bucket, count in self._matches(aspect, tolerance, min_pixels))
+
+    def pick(self, aspect: float, tolerance: float, min_pixels: int) -> Optional[str]:
+        """A random image with an aspect ratio within `tolerance` (relative) of `aspect` and at least `min_pixels`."""
+        matches = list(self._matches(aspect, tolerance, min_pixels))
+        total = sum(count for bucket, count in matches)
+        if total == 0:
+            return None
+        r = random.randrange(total)
+        for bucket, count in matches:
+            if r < count:
+                entries = self._buckets[bucket]
+                return entries[len(entries) - count + r][1]
+            r -= count
+
+    def _matches(self, aspect: float, tolerance: float, min_pixels: int):
+        """(bucket, number of images in it with at least `min_pixels`) for the buckets in the aspect ratio range."""
+        lo = bisect_left(self._keys, aspect_bucket(aspect / (1 + tolerance)))
+        hi = bisect_right(self._keys, aspect_bucket(aspect * (1 + tolerance)))
+        for bucket in self._keys[lo:hi]:
+            entries = self._buckets[bucket]
+            count = len(entries) - bisect_left(entries, (min_pixels, ''))
+            if count > 0:
+                yield bucket, count
+
+
+class MetadataIndex(BackgroundIndex[tuple[int, int]]):
+    """
+    Width and height of the scanned images, probed from their headers. Images that are decoded anyway are
+    recorded on the way.
+    """
+    description = 'sizes'
+
+    def __init__(self, index_path: Optional[str]) -> None:
+        super().__init__(index_path)
+        self._sizes = SizeIndex()
+
+    def record(self, path: str, size: tuple[int, int]) -> None:
+        if self.value(path) != size:
+            super().record(path, size)
+
+    def pick(self, aspect: float, tolerance: float, min_pixels: int) -> Optional[tuple[ImageSource, str]]:
+        with self._lock:
+            path = self._sizes.pick(aspect, tolerance, min_pixels)
+            return self._file_ids.get(path) if path is not None else None
+
+    def count(self, aspect: float, tolerance: float, min_pixels: int) -> int:
+        with self._lock:
+            return self._sizes.count(aspect, tolerance, min_pixels)
+
+    def _compute(self, source: ImageSource, path: str) -> Optional[tuple[int, int]]:
+        width, height = source.image_size(path)
+        return (width, height) if width > 0 and height > 0 else None
+
+    def _added(self, path: str, size: tuple[int, int]) -> None:
+        self._sizes.add(path, *size)
+
+    def _removed(self, path: str, size: tuple[int, int]) -> None:
+        self._sizes.remove(path, *size)
+
+    def _from_json(self, data: list[int]) -> tuple[int, int]:
+        width, height = data
+        return width, height
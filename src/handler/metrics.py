@@ -0,0 +1,159 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds (in seconds) of the cumulative histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def resident_memory_bytes(pid: int = None) -> Optional[int]:
+    """Resident memory of this process, or of the process `pid`, if the platform tells."""
+    try:
+        with open(f'/proc/{pid if pid is not None else "self"}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, IndexError, ValueError, AttributeError):
+        return None
+
+
+def peak_resident_memory_bytes() -> Optional[int]:
+    """The largest resident memory this process has had, if the platform tells."""
+    if resource is None:
+        return None
+    # Reported in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Histogram:
+    """Lifetime bucket counts plus a rolling window of the most recent samples for percentiles."""
+
+    def __init__(self, window: int) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.bucket_counts[bisect_left(BUCKETS, value)] += 1
+        self.recent.append(value)
+
+    def percentile(self, p: float) -> float:
+        if len(self.recent) == 0:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def copy(self) -> 'Histogram':
+        res = Histogram(self.recent.maxlen)
+        res.count = self.count
+        res.total = self.total
+        res.bucket_counts = list(self.bucket_counts)
+        res.recent.extend(self.recent)
+        return res
+
+
+class MetricsObserver:
+    def on_span(self, stage: str, seconds: float) -> None:
+        pass
+
+    def on_transition(self, spans: dict[str, float]) -> None:
+        pass
+
+
+class Metrics:
+    """Timing spans and counters of the render pipeline."""
+
+    def __init__(self, window: int = 256) -> None:
+        self._window = window
+        self._lock = threading.Lock()
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: dict[str, int] = {}
+        self._gauges: dict[str, float] = {}
+        self._observers: list[MetricsObserver] = []
+        self._local = threading.local()
+
+    def subscribe(self, observer: MetricsObserver) -> None:
+        self._observers.append(observer)
+
+    def unsubscribe(self, observer: MetricsObserver) -> None:
+        self._observers.remove(observer)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    @contextmanager
+    def transition(self) -> Iterator[None]:
+        """
+        Group the spans recorded on this thread into one transition, reported to observers as a whole.
+        Nested transitions are merged into the outermost one.
+        """
+        if getattr(self._local, 'spans', None) is not None:
+            yield
+            return
+        self._local.spans = spans = {}
+        try:
+            with self.span('transition'):
+                yield
+        finally:
+            self._local.spans = None
+        for observer in self._observers:
+            observer.on_transition(spans)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._histograms:
+                self._histograms[stage] = Histogram(self._window)
+            self._histograms[stage].observe(seconds)
+        spans: Optional[dict[str, float]] = getattr(self._local, 'spans', None)
+        if spans is not None:
+            spans[stage] = spans.get(stage, 0.0) + seconds
+        for observer in self._observers:
+            observer.on_span(stage, seconds)
+
+    def increment(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge: str, value: float) -> None:
+        with self._lock:
+            self._gauges[gauge] = value
+
+    def histograms(self) -> dict[str, Histogram]:
+        with self._lock:
+            return {stage: h.copy() for stage, h in self._histograms.items()}
+
+    def counters(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def gauges(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._gauges)
+
+    def dump(self) -> str:
+        lines = [f'{"stage":<24}{"count":>8}{"mean":>10}{"p50":>10}{"p95":>10}{"p99":>10}   (ms, last {self._window})']
+        for stage, h in sorted(self.histograms().items()):
+            lines.append(f'{stage:<24}{h.count:>8}{h.total / h.count * 1000:>10.1f}{h.percentile(50) * 1000:>10.1f}'
+                         f'{h.percentile(95) * 1000:>10.1f}{h.percentile(99) * 1000:>10.1f}')
+        for counter, value in sorted(self.counters().items()):
+            lines.append(f'{counter:<24}{value:>8}')
+        for gauge, value in sorted(self.gauges().items()):
+            lines.append(f'{gauge:<24}{value:>8}')
+        return '\n'.join(lines)
@@ -1,6 +1,11 @@
+import importlib
+import json
+import logging
+import os
 import platform as plat
+import threading
 from abc import ABC, abstractmethod
-import logging
+from typing import Any, Callable, Optional
 
 
 class Platform(ABC):
@@ -21,226 +26,115 @@ class Platform(ABC):
     def set_wallpaper(self, path: str) -> None:
         pass
 
+    @abstractmethod
+    def move_to_trash(self, path: str) -> None:
+        """Move the file at `path` to where the desktop keeps deleted files; raises OSError on failure."""
+        pass
 
-platform: Platform
-
-pname = plat.system()
-logging.info(f'Detected platform: {pname}')
-if pname == 'Windows':
-    import os
-    import subprocess
-    import ctypes
-    from ctypes import wintypes
-    from collections import namedtuple
-    import pythoncom
-    import pywintypes
-    import win32gui
-    from win32com.shell import shell, shellcon
-    from typing import Callable
-
-    # Setup user32: taken from https://stackoverflow.com/a/37503441/3083982
-    user32 = ctypes.WinDLL('user32', use_last_error=True)
 
+# Platform name -> module (relative to this package) that provides `create_platform() -> Platform`.
+# Backend modules are only imported once the platform is first used.
+_backends: dict[str, str] = {}
+_resolved: Optional[Platform] = None
+_lock = threading.Lock()
+_detection_cache_path: Optional[str] = None
+_selected_backend: Optional[str] = None
 
-    def check_zero(result, func, args):
-        if not result:
-            err = ctypes.get_last_error()
-            if err:
-                raise ctypes.WinError(err)
-        return args
 
+def register_backend(name: str, module: str) -> None:
+    _backends[name] = module
 
-    WindowInfo = namedtuple('WindowInfo', 'pid title')
 
-    WNDENUMPROC = ctypes.WINFUNCTYPE(
-        wintypes.BOOL,
-        wintypes.HWND,  # _In_ hWnd
-        wintypes.LPARAM, )  # _In_ lParam
+register_backend('Windows', '.windowsplatform')
+register_backend('Linux', '.linuxplatform')
+register_backend('file', '.fileplatform')
 
-    user32.EnumWindows.errcheck = check_zero
-    user32.EnumWindows.argtypes = (
-        WNDENUMPROC,  # _In_ lpEnumFunc
-        wintypes.LPARAM,)  # _In_ lParam
+# Environment variable that selects a backend by name instead of detecting it, e.g. `file` to run headless
+BACKEND_ENV = 'WALLPAPER_PLATFORM'
 
-    user32.IsWindowVisible.argtypes = (
-        wintypes.HWND,)  # _In_ hWnd
 
-    user32.GetWindowThreadProcessId.restype = wintypes.DWORD
-    user32.GetWindowThreadProcessId.argtypes = (
-        wintypes.HWND,  # _In_      hWnd
-        wintypes.LPDWORD,)  # _Out_opt_ lpdwProcessId
+def select_backend(name: str) -> None:
+    """Use the backend registered as `name` instead of the one for the detected platform."""
+    global _selected_backend, _resolved
+    if name not in _backends:
+        raise ValueError(f'Unknown platform backend "{name}". Possible backends are {", ".join(_backends.keys())}')
+    with _lock:
+        _selected_backend = name
+        _resolved = None
 
-    user32.GetWindowTextLengthW.errcheck = check_zero
-    user32.GetWindowTextLengthW.argtypes = (
-        wintypes.HWND,)  # _In_ hWnd
 
-    user32.GetWindowTextW.errcheck = check_zero
-    user32.GetWindowTextW.argtypes = (
-        wintypes.HWND,  # _In_  hWnd
-        wintypes.LPWSTR,  # _Out_ lpString
-        ctypes.c_int,)  # _In_  nMaxCount
+def set_detection_cache(path: str) -> None:
+    """Persist the results of slow platform detection steps in the JSON file at `path`."""
+    global _detection_cache_path
+    _detection_cache_path = path
 
-    # Continue
-    FILEBROWSER_PATH = os.path.join(os.getenv('WINDIR'), 'explorer.exe')
 
+def _read_detection_cache() -> dict[str, Any]:
+    if _detection_cache_path is None:
+        return {}
+    try:
+        with open(_detection_cache_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
 
-    def _make_filter(class_name: str, title: str) -> Callable[[int, list[int]], bool]:
-        """https://docs.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-enumwindows"""
 
-        def enum_windows(handle: int, h_list: list[int]) -> bool:
-            if not (class_name or title):
-                h_list.append(handle)
-            if class_name and class_name not in win32gui.GetClassName(handle):
-                return True  # continue enumeration
-            if title and title not in win32gui.GetWindowText(handle):
-                return True  # continue enumeration
-            h_list.append(handle)
+def cached_detection(key: str, signature: dict[str, Any], detect: Callable[[], Any]) -> Any:
+    """
+    Return the result of `detect()`, reusing the value of a previous run as long as `signature`,
+    the inputs that detection depends on, is unchanged.
+    """
+    cache = _read_detection_cache()
+    entry = cache.get(key)
+    if entry is not None and entry.get('signature') == signature:
+        return entry['value']
+    value = detect()
+    if _detection_cache_path is not None:
+        cache[key] = {'signature': signature, 'value': value}
+        try:
+            os.makedirs(os.path.dirname(_detection_cache_path), exist_ok=True)
+            with open(_detection_cache_path, 'w') as f:
+                json.dump(cache, f)
+        except IOError:
+            logging.warning(f'Could not write platform detection cache {_detection_cache_path}')
+    return value
+
+
+def get_platform() -> Platform:
+    global _resolved
+    if _resolved is None:
+        with _lock:
+            if _resolved is None:
+                pname = _selected_backend or os.environ.get(BACKEND_ENV)
+                if pname is None:
+                    pname = plat.system()
+                    logging.info(f'Detected platform: {pname}')
+                if pname not in _backends:
+                    logging.error(f"Unsupported platform: {pname}. Set {BACKEND_ENV}=file to run headless.")
+                    raise SystemExit()
+                module = importlib.import_module(_backends[pname], __package__)
+                _resolved = module.create_platform()
+    return _resolved
+
+
+class _LazyPlatform(Platform):
+    """Stand-in for the real platform that resolves it on first use."""
 
-        return enum_windows
+    @property
+    def name(self) -> str:
+        return get_platform().name
 
+    def open_file_in_explorer(self, path: str) -> None:
+        get_platform().open_file_in_explorer(path)
 
-    def _find_window_handles(parent: int = None, window_class: str = None, title: str = None) -> list[int]:
-        cb = _make_filter(window_class, title)
-        try:
-            handle_list = []
-            if parent:
-                win32gui.EnumChildWindows(parent, cb, handle_list)
-            else:
-                win32gui.EnumWindows(cb, handle_list)
-            return handle_list
-        except pywintypes.error:
-            return []
+    def open_file(self, path: str) -> None:
+        get_platform().open_file(path)
 
+    def set_wallpaper(self, path: str) -> None:
+        get_platform().set_wallpaper(path)
 
-    def _force_refresh() -> None:
-        user32.UpdatePerUserSystemParameters(1)
+    def move_to_trash(self, path: str) -> None:
+        get_platform().move_to_trash(path)
 
 
-    def _enable_activedesktop() -> None:
-        """https://stackoverflow.com/a/16351170"""
-        try:
-            progman = _find_window_handles(window_class='Progman')[0]
-            cryptic_params = (0x52c, 0, 0, 0, 500, None)
-            user32.SendMessageTimeoutW(progman, *cryptic_params)
-        except IndexError as e:
-            raise WindowsError('Cannot enable Active Desktop') from e
-
-
-    _enable_activedesktop()
-    pythoncom.CoInitialize()
-    iad = pythoncom.CoCreateInstance(shell.CLSID_ActiveDesktop,
-                                     None,
-                                     pythoncom.CLSCTX_INPROC_SERVER,
-                                     shell.IID_IActiveDesktop)
-
-
-    class Windows(Platform):
-        name = 'Windows'
-
-        def open_file_in_explorer(self, path: str) -> None:
-            path = os.path.normpath(path)
-            subprocess.run([FILEBROWSER_PATH, '/select,', path])
-
-        def open_file(self, path: str) -> None:
-            path = os.path.normpath(path)
-            os.startfile(path)
-
-        def set_wallpaper(self, image_path: str) -> None:
-            iad.SetWallpaper(image_path, 0)
-            iad.ApplyChanges(shellcon.AD_APPLY_ALL)
-            _force_refresh()
-
-
-    platform = Windows()
-
-elif pname == 'Linux':
-    import os
-    import subprocess
-    import pathlib
-    import re
-
-
-    def _is_running(process):
-        # From http://www.bloggerpolis.com/2011/05/how-to-check-if-a-process-is-running-using-python/
-        # and http://richarddingwall.name/2009/06/18/windows-equivalents-of-ps-and-kill-commands/
-        try:  # Linux/Unix
-            s = subprocess.Popen(["ps", "axw"], stdout=subprocess.PIPE)
-        except subprocess.SubprocessError:  # Windows
-            s = subprocess.Popen(["tasklist", "/v"], stdout=subprocess.PIPE)
-        for x in s.stdout:
-            if re.search(process, x):
-                return True
-        return False
-
-
-    # Detect the desktop session in use: https://stackoverflow.com/a/21213358/3083982
-    desktop_session = os.environ.get("DESKTOP_SESSION")
-    if desktop_session is not None:  # easier to match if we doesn't have  to deal with caracter cases
-        desktop_session = desktop_session.lower()
-        if desktop_session not in ["gnome", "unity", "cinnamon", "mate", "xfce4", "lxde", "fluxbox",
-                                   "blackbox", "openbox", "icewm", "jwm", "afterstep", "trinity", "kde"]:
-            # Special cases #
-            # Canonical sets $DESKTOP_SESSION to Lubuntu rather than LXDE if using LXDE.
-            # There is no guarantee that they will not do the same with the other desktop environments.
-            if "xfce" in desktop_session or desktop_session.startswith("xubuntu"):
-                desktop_session = "xfce4"
-            elif desktop_session.startswith("ubuntu"):
-                desktop_session = "unity"
-            elif desktop_session.startswith("lubuntu"):
-                desktop_session = "lxde"
-            elif desktop_session.startswith("kubuntu"):
-                desktop_session = "kde"
-            elif desktop_session.startswith("razor"):  # e.g. razorkwin
-                desktop_session = "razor-qt"
-            elif desktop_session.startswith("wmaker"):  # e.g. wmaker-common
-                desktop_session = "windowmaker"
-    elif os.environ.get('KDE_FULL_SESSION') == 'true':
-        desktop_session = "kde"
-    elif os.environ.get('GNOME_DESKTOP_SESSION_ID'):
-        if "deprecated" not in os.environ.get('GNOME_DESKTOP_SESSION_ID'):
-            desktop_session = "gnome2"
-    # From http://ubuntuforums.org/showthread.php?t=652320
-    elif _is_running("xfce-mcs-manage"):
-        desktop_session = "xfce4"
-    elif _is_running("ksmserver"):
-        desktop_session = "kde"
-
-    logging.info(f'Detected desktop session: {desktop_session}')
-    supported_desktops = ['cinnamon', 'gnome', 'unity', 'mate', 'gnome2']
-    if desktop_session not in supported_desktops:
-        logging.error(f"Unsupported desktop: {desktop_session}")
-        raise SystemExit()
-
-    # partially taken from https://stackoverflow.com/a/21213504/3083982
-    if desktop_session == 'cinnamon':
-        wallpaper_command = ['gsettings', 'set', 'org.cinnamon.desktop.background', 'picture-uri']
-    elif desktop_session in ['gnome', 'unity']:
-        wallpaper_command = ['gsettings', 'set', 'org.gnome.desktop.background', 'picture-uri']
-    elif desktop_session == 'mate':
-        wallpaper_command = ["gsettings", "set", "org.mate.background", "picture-filename"]
-    elif desktop_session == 'gnome2':
-        wallpaper_command = ["gconftool-2", "-t", "string", "--set", "/desktop/gnome/background/picture_filename",
-                             "picture-filename"]
-
-
-    class Linux(Platform):
-        name = 'Linux'
-
-        def open_file_in_explorer(self, path: str) -> None:
-            path = os.path.dirname(os.path.normpath(path))
-            subprocess.Popen(["xdg-open", path])
-
-        def open_file(self, path: str) -> None:
-            path = os.path.normpath(path)
-            subprocess.run(['xdg-open', path])
-
-        def set_wallpaper(self, image_path: str) -> None:
-            p = pathlib.Path(image_path).as_uri()
-            subprocess.run(wallpaper_command + [p], check=True)
-
-
-    platform = Linux()
-
-else:
-    logging.error(f"Unsupported platform: {pname}")
-    raise SystemExit()
+platform: Platform = _LazyPlatform()
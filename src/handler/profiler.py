@@ -0,0 +1,107 @@
+import cProfile
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class TransitionProfiler:
+    """
+    Profiles the next few transitions once armed: each one is run under cProfile and written to
+    `<output_dir>/profile-<time>-<n>.pstats`, and the tracemalloc difference with the previous
+    transition is written to `<output_dir>/tracemalloc-<time>-<n>.txt`.
+    """
+    TRACEMALLOC_FRAMES = 10
+    TOP_ALLOCATIONS = 25
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._session = ''
+        self._index = 0
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        # Count that a signal handler asked to arm with, which is applied before the next transition
+        self._requested: Optional[int] = None
+
+    @property
+    def is_armed(self) -> bool:
+        return self._remaining > 0
+
+    def arm(self, count: int) -> None:
+        with self._lock:
+            self._remaining = count
+            self._session = time.strftime('%Y%m%d-%H%M%S')
+            self._index = 0
+            if count > 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.TRACEMALLOC_FRAMES)
+                self._snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(False, tracemalloc.__file__)])
+            elif count <= 0:
+                self._stop_tracing()
+        if count > 0:
+            logging.info(f'Profiling the next {count} transitions into {self.output_dir}')
+
+    def request_arm(self, count: int) -> None:
+        """Arm before the next transition. Takes no lock, so it can be called from a signal handler."""
+        self._requested = count
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        requested, self._requested = self._requested, None
+        if requested is not None:
+            self.arm(requested)
+        with self._lock:
+            if self._remaining <= 0:
+                active = False
+            else:
+                active = True
+                self._remaining -= 1
+                self._index += 1
+                name = f'{self._session}-{self._index}'
+        if not active:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            path = os.path.join(self.output_dir, f'profile-{name}.pstats')
+            profile.dump_stats(path)
+            logging.info(f'Wrote transition profile to {path}')
+            self._write_allocation_diff(name)
+
+    def _write_allocation_diff(self, name: str) -> None:
+        if not tracemalloc.is_tracing() or self._snapshot is None:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        stats = snapshot.compare_to(self._snapshot, 'lineno')[:self.TOP_ALLOCATIONS]
+        self._snapshot = snapshot
+        path = os.path.join(self.output_dir, f'tracemalloc-{name}.txt')
+        with open(path, 'w') as f:
+            current, peak = tracemalloc.get_traced_memory()
+            f.write(f'Traced memory: {current} bytes, peak {peak} bytes\n')
+            for stat in stats:
+                f.write(f'{stat}\n')
+        logging.info(f'Wrote allocation differences to {path}')
+        with self._lock:
+            if self._remaining <= 0:
+                self._stop_tracing()
+
+    def _stop_tracing(self) -> None:
+        """Stop the allocation tracing that `arm` started. Called with the lock held."""
+        if self._snapshot is not None:
+            tracemalloc.stop()
+            self._snapshot = None
+
+
+def install_signal_handler(profiler: TransitionProfiler, count: int) -> None:
+    """Arm `profiler` for the `count` transitions after a SIGUSR1, where the platform has it."""
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request_arm(count))
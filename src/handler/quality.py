@@ -0,0 +1,44 @@
+import logging
+import statistics
+from collections import deque
+
+from .imageeditor import Quality
+from .metrics import MetricsObserver
+
+TIERS = [Quality.HIGH, Quality.BALANCED, Quality.FAST, Quality.PREVIEW]
+
+
+class AdaptiveQuality(MetricsObserver):
+    """
+    Picks a resampling quality from recent transition latencies: drops a tier when the median of the
+    last few transitions exceeds the latency budget, and raises it again once transitions are
+    consistently well within budget.
+    """
+    DOWNGRADE_SAMPLES = 3
+    UPGRADE_SAMPLES = 10
+
+    def __init__(self, latency_budget: float) -> None:
+        self.latency_budget = latency_budget
+        self._index = 0
+        self._recent: deque[float] = deque(maxlen=self.UPGRADE_SAMPLES)
+
+    @property
+    def tier(self) -> Quality:
+        return TIERS[self._index]
+
+    def on_transition(self, spans: dict[str, float]) -> None:
+        if 'transition' not in spans:
+            return
+        self._recent.append(spans['transition'])
+        last = list(self._recent)[-self.DOWNGRADE_SAMPLES:]
+        if (len(last) == self.DOWNGRADE_SAMPLES and statistics.median(last) > self.latency_budget
+                and self._index < len(TIERS) - 1):
+            self._change(self._index + 1)
+        elif (len(self._recent) == self.UPGRADE_SAMPLES and max(self._recent) < self.latency_budget / 2
+              and self._index > 0):
+            self._change(self._index - 1)
+
+    def _change(self, index: int) -> None:
+        logging.info(f'Changing resampling quality from {self.tier.value} to {TIERS[index].value}')
+        self._index = index
+        self._recent.clear()
@@ -0,0 +1,193 @@
+import math
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import ContextManager, Optional
+
+import PIL.Image as Image
+
+from .colorthief import ColorThief
+from .configmanager import ConfigManager, ConfigField
+from .imageeditor import RGB, resize_and_center, paste_fitted, write_label, DecodeBudget, Quality
+from .metrics import Metrics
+
+
+@dataclass(frozen=True)
+class RenderSettings:
+    width: int
+    height: int
+    font_path: str
+    label_size: float
+    right_label_margin: int
+    bottom_label_margin: int
+    quality: Quality = Quality.HIGH
+
+    @staticmethod
+    def from_config(config: ConfigManager, font_path: str,
+                    adaptive_quality: Quality = Quality.HIGH) -> 'RenderSettings':
+        """`adaptive_quality` is used when the configured resampling quality is `adaptive`."""
+        quality = config.get_value(ConfigField.RESAMPLING_QUALITY)
+        return RenderSettings(config.get_value(ConfigField.HOR_RESOLUTION),
+                              config.get_value(ConfigField.VER_RESOLUTION),
+                              font_path,
+                              config.get_value(ConfigField.LABEL_SIZE),
+                              config.get_value(ConfigField.RIGHT_LABEL_MARGIN),
+                              config.get_value(ConfigField.BOTTOM_LABEL_MARGIN),
+                              adaptive_quality if quality == 'adaptive' else Quality(quality))
+
+
+def decode_budget_from_config(config: ConfigManager) -> DecodeBudget:
+    max_pixels = config.get_value(ConfigField.MAX_PIXELS)
+    max_megabytes = config.get_value(ConfigField.MAX_DECODE_MEGABYTES)
+    return DecodeBudget(max_pixels if max_pixels > 0 else None,
+                        max_megabytes * 1024 * 1024 if max_megabytes > 0 else None)
+
+
+# (left, top, right, bottom)
+Box = tuple[int, int, int, int]
+# Pixels between the tiles of a collage
+TILE_GAP = 4
+# Aspect ratio that grid cells aim for, that of most photos
+TILE_ASPECT = 1.5
+
+
+@dataclass(frozen=True)
+class Screen:
+    """Geometry of one monitor in physical pixels, relative to the virtual desktop."""
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def stitch(renders: list[Image.Image], screens: list[Screen]) -> Image.Image:
+    """Paste the wallpaper of every screen onto one image that spans the bounding box of all screens."""
+    left = min(s.x for s in screens)
+    top = min(s.y for s in screens)
+    right = max(s.x + s.width for s in screens)
+    bottom = max(s.y + s.height for s in screens)
+    res = Image.new('RGB', (right - left, bottom - top))
+    for img, screen in zip(renders, screens):
+        res.paste(img, (screen.x - left, screen.y - top))
+    return res
+
+
+def analysis_thumbnail(img: Image.Image) -> Image.Image:
+    """A quick reduction of `img` to about 200x200 pixels, enough to analyse its colors."""
+    w, h = img.size
+    f = w*h/200/200
+    if f > 1:
+        img = img.resize((int(w/f), int(h/f)), Image.NEAREST)
+    return img
+
+
+def find_matching_background(img: Image.Image) -> RGB:
+    thief = ColorThief(analysis_thumbnail(img))
+    return thief.get_color()
+
+
+def _split(length: int, weights: list[float], gap: int) -> list[tuple[int, int]]:
+    """(start, size) of consecutive parts of `length` in proportion to `weights`, with `gap` between them."""
+    usable = length - gap * (len(weights) - 1)
+    total = sum(weights)
+    edges = [0]
+    for w in weights:
+        edges.append(edges[-1] + w)
+    edges = [round(usable * e / total) for e in edges]
+    return [(edges[i] + gap * i, edges[i + 1] - edges[i]) for i in range(len(weights))]
+
+
+def _boxes(width: int, height: int, rows: list[list[float]], row_heights: list[float], gap: int) -> list[Box]:
+    res = []
+    for (top, h), row in zip(_split(height, row_heights, gap), rows):
+        res.extend((left, top, left + w, top + h) for left, w in _split(width, row, gap))
+    return res
+
+
+def grid_layout(count: int, width: int, height: int, gap: int = TILE_GAP) -> list[Box]:
+    """Boxes for `count` tiles in rows of equal height, with cells of about TILE_ASPECT."""
+    cols = max(1, min(count, round(math.sqrt(count * width / height / TILE_ASPECT))))
+    n_rows = math.ceil(count / cols)
+    # Spread the tiles over the rows, so that no row is much emptier than the others
+    rows = [[1.0] * (count // n_rows + (1 if i < count % n_rows else 0)) for i in range(n_rows)]
+    return _boxes(width, height, rows, [1.0] * n_rows, gap)
+
+
+def _partition(aspects: list[float], n_rows: int) -> list[list[float]]:
+    """Split `aspects` in order over `n_rows` rows with about equal sums."""
+    target = sum(aspects) / n_rows
+    res: list[list[float]] = []
+    row: list[float] = []
+    acc = 0.0
+    for i, aspect in enumerate(aspects):
+        open_rows = n_rows - len(res) - 1
+        if len(row) > 0 and open_rows > 0 and (acc + aspect / 2 > target * (len(res) + 1)
+                                               or len(aspects) - i <= open_rows):
+            res.append(row)
+            row = []
+        row.append(aspect)
+        acc += aspect
+    res.append(row)
+    return res
+
+
+def justified_layout(aspects: list[float], width: int, height: int, gap: int = TILE_GAP) -> list[Box]:
+    """
+    Boxes for tiles with the given aspect ratios, in order, in full-width rows. The number of rows is the one
+    for which the tiles need the least cropping to fill the screen.
+    """
+    best = None
+    for n_rows in range(1, len(aspects) + 1):
+        rows = _partition(aspects, n_rows)
+        # Height of every row when its tiles keep their aspect ratio and fill the width
+        row_heights = [(width - gap * (len(row) - 1)) / sum(row) for row in rows]
+        error = abs(math.log((sum(row_heights) + gap * (n_rows - 1)) / height))
+        if best is None or error < best[0]:
+            best = (error, rows, row_heights)
+    error, rows, row_heights = best
+    return _boxes(width, height, rows, row_heights, gap)
+
+
+def tile_budget(size: Optional[tuple[int, int]], box: Box, cover: bool, budget: DecodeBudget) -> DecodeBudget:
+    """A decode budget that reduces an image of `size` to about what its tile needs, within `budget`."""
+    width, height = box[2] - box[0], box[3] - box[1]
+    if size is None:
+        needed = 4 * width * height
+    else:
+        f = (max if cover else min)(width / size[0], height / size[1])
+        needed = max(width * height, math.ceil(size[0] * size[1] * f * f))
+    max_pixels = needed if budget.max_pixels is None else min(needed, budget.max_pixels)
+    return DecodeBudget(max_pixels, budget.max_bytes)
+
+
+def _span(metrics: Optional[Metrics], stage: str) -> ContextManager[None]:
+    return metrics.span(stage) if metrics is not None else nullcontext()
+
+
+def render_wallpaper(source_img: Image.Image, label: str, settings: RenderSettings,
+                     metrics: Metrics = None, background: RGB = None) -> Image.Image:
+    """Fit `source_img` on a background of its dominant color and write `label` in the bottom right corner."""
+    if background is None:
+        with _span(metrics, 'background'):
+            background = find_matching_background(source_img)
+    with _span(metrics, 'resize'):
+        wallpaper = resize_and_center(source_img, settings.width, settings.height, background, settings.quality)
+    with _span(metrics, 'label'):
+        write_label(wallpaper, label, settings.font_path, settings.label_size,
+                    settings.right_label_margin, settings.bottom_label_margin)
+    return wallpaper
+
+
+def render_tile(canvas: Image.Image, img: Image.Image, label: str, box: Box, settings: RenderSettings,
+                cover: bool = False, background: RGB = None) -> None:
+    """
+    Draw `img` in `box` of a collage: letterboxed on its dominant color, or cropped to cover the box. The label
+    shrinks with the tile.
+    """
+    if not cover:
+        if background is None:
+            background = find_matching_background(img)
+        canvas.paste(background, box)
+    paste_fitted(canvas, img, box, settings.quality, cover)
+    f = math.sqrt((box[2] - box[0]) * (box[3] - box[1]) / settings.width / settings.height)
+    write_label(canvas, label, settings.font_path, max(1.0, settings.label_size * f),
+                round(settings.right_label_margin * f), round(settings.bottom_label_margin * f), box)
@@ -0,0 +1,237 @@
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import ForkingPickler
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Optional
+
+import PIL.Image as Image
+
+from .colorindex import ImageColors, analyse_colors
+from .duplicates import dhash
+from .imageeditor import DecodeBudget, ImageTooLargeError
+from .imagesource import ImageSource, ImageUnavailableError
+from .metrics import resident_memory_bytes
+from .renderer import RenderSettings, render_wallpaper, analysis_thumbnail
+
+
+class RenderWorkerError(Exception):
+    """The worker did not render an image. A `systemic` failure would happen for any image."""
+
+    def __init__(self, msg: str, systemic: bool = False):
+        super().__init__(msg)
+        self.systemic = systemic
+
+
+# Workers that were not closed yet, closed at exit. The set is weak, so that it does not keep workers alive.
+_open_workers: 'weakref.WeakSet[RenderWorker]' = weakref.WeakSet()
+
+
+def _close_workers() -> None:
+    for worker in list(_open_workers):
+        worker.close()
+
+
+atexit.register(_close_workers)
+
+
+@dataclass(frozen=True)
+class RenderedFrame:
+    """
+    A wallpaper rendered by the worker. `image` shares the memory of the frame buffer of the worker, so it is
+    only valid until the next render.
+    """
+    image: Image.Image
+    source_size: tuple[int, int]
+    original_size: Optional[tuple[int, int]]
+    dhash: int
+    # Palette of the image, from the thumbnail its background color was found on
+    colors: ImageColors
+
+
+def _serve(conn: Connection, frame_name: str) -> None:
+    """Main loop of the worker process: render requests until the pipe is closed."""
+    frame = SharedMemory(frame_name)
+    # Sources of earlier requests, so that they can reuse what they indexed
+    sources: list[ImageSource] = []
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                return
+            if request is None:
+                return
+            conn.send(_render(sources, frame, *request))
+    finally:
+        frame.close()
+
+
+def _render(sources: list[ImageSource], frame: SharedMemory, source: ImageSource, path: str, label: str,
+            settings: RenderSettings, budget: DecodeBudget, min_size: int, source_path: str) -> tuple:
+    """
+    Render one wallpaper into `frame`. Returns the outcome as a tuple, since exceptions may not be picklable.
+    Images that cannot be read are an 'error'; failures once an image was read do not depend on the image, and
+    are 'failed'.
+    """
+    source = next((s for s in sources if s == source), None) or source
+    if source not in sources:
+        sources.append(source)
+    try:
+        img = source.read_image(path, budget)
+    except ImageTooLargeError as e:
+        return 'too_large', e.path, e.size, e.required_bytes
+    except ImageUnavailableError as e:
+        return 'unavailable', e.path
+    except Exception as e:
+        return 'error', f'Cannot read {path}: {e}'
+    if min(img.size) < min_size:
+        return 'too_small', img.size
+    try:
+        colors = analyse_colors(analysis_thumbnail(img))
+        wallpaper = render_wallpaper(img, label, settings, background=colors.palette[0] if colors.palette else None)
+        img.save(source_path)
+        data = wallpaper.tobytes()
+        frame.buf[:len(data)] = data
+        return 'ok', wallpaper.size, img.size, img.info.get('original_size'), dhash(img), colors
+    except Exception as e:
+        return 'failed', f'Cannot render {path}: {e}'
+
+
+class RenderWorker:
+    """
+    Renders wallpapers in a separate process, so that a pathological image cannot stall or crash the app.
+    Finished frames are handed over in shared memory. The process is started on demand, and started again
+    after it crashed, hung, or grew beyond `memory_budget` bytes.
+    """
+    POLL_SECONDS = 0.1
+    TIMEOUT_SECONDS = 60.0
+    # Give the frame buffer some room, so that it rarely has to grow
+    MIN_FRAME_BYTES = 3840 * 2160 * 3
+
+    def __init__(self, memory_budget: int) -> None:
+        self.memory_budget = memory_budget
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context('spawn')
+        self._process: Optional[multiprocessing.process.BaseProcess] = None
+        self._conn: Optional[Connection] = None
+        self._frame: Optional[SharedMemory] = None
+        # Whether the process grew beyond the budget while rendering the last frame, which is still in use
+        self._overrun = False
+        _open_workers.add(self)
+
+    @staticmethod
+    def can_render(source: ImageSource) -> bool:
+        return source.process_safe
+
+    def render(self, source: ImageSource, path: str, settings: RenderSettings, budget: DecodeBudget,
+               min_size: int, source_path: str) -> Optional[RenderedFrame]:
+        """
+        Render the image at `path` and save the decoded image at `source_path`. Returns None for images with a
+        side shorter than `min_size`.
+        """
+        frame_bytes = settings.width * settings.height * 3
+        with self._lock:
+            if self._process is not None and (self._overrun or not self._process.is_alive()
+                                              or self._frame.size < frame_bytes):
+                self._stop()
+            if self._process is None:
+                try:
+                    self._start(max(frame_bytes, self.MIN_FRAME_BYTES))
+                except OSError as e:
+                    raise RenderWorkerError(f'Cannot start the render worker: {e}', systemic=True)
+            request = (source, path, source.get_label(path), settings, budget, min_size, source_path)
+            try:
+                # Pickle first, so that a request that cannot be sent does not count as a crash of the worker
+                data = ForkingPickler.dumps(request)
+            except Exception as e:
+                raise RenderWorkerError(f'Cannot send the render request to the worker: {e}', systemic=True)
+            try:
+                self._conn.send_bytes(data)
+                reply = self._receive()
+            except (OSError, EOFError):
+                self._process.join(1.0)
+                code = self._process.exitcode
+                self._stop()
+                raise RenderWorkerError(f'Render worker stopped with exit code {code}')
+            memory = resident_memory_bytes(self._process.pid)
+            if memory is not None and memory > self.memory_budget:
+                logging.info(f'Render worker uses {memory} bytes: restarting it before the next render')
+                self._overrun = True
+            return self._frame_from(reply)
+
+    def close(self) -> None:
+        _open_workers.discard(self)
+        with self._lock:
+            self._stop()
+
+    def _frame_from(self, reply: tuple) -> Optional[RenderedFrame]:
+        kind, *args = reply
+        if kind == 'ok':
+            size, source_size, original_size, h, colors = args
+            image = Image.frombuffer('RGB', size, self._frame.buf, 'raw', 'RGB', 0, 1)
+            return RenderedFrame(image, source_size, original_size, h, colors)
+        if kind == 'too_small':
+            return None
+        if kind == 'too_large':
+            raise ImageTooLargeError(*args)
+        if kind == 'unavailable':
+            raise ImageUnavailableError(*args)
+        raise RenderWorkerError(*args, systemic=kind == 'failed')
+
+    def _receive(self) -> Any:
+        deadline = time.monotonic() + self.TIMEOUT_SECONDS
+        while not self._conn.poll(self.POLL_SECONDS):
+            if not self._process.is_alive():
+                code = self._process.exitcode
+                self._stop()
+                raise RenderWorkerError(f'Render worker stopped with exit code {code}')
+            memory = resident_memory_bytes(self._process.pid)
+            if memory is not None and memory > self.memory_budget:
+                self._stop()
+                raise RenderWorkerError(f'Render worker exceeded its memory budget with {memory} bytes')
+            if time.monotonic() > deadline:
+                self._stop()
+                raise RenderWorkerError(f'Render worker did not finish within {self.TIMEOUT_SECONDS} s')
+        return self._conn.recv()
+
+    def _start(self, frame_bytes: int) -> None:
+        frame = SharedMemory(create=True, size=frame_bytes)
+        try:
+            conn, child_conn = self._context.Pipe()
+            process = self._context.Process(target=_serve, args=(child_conn, frame.name),
+                                            name='render-worker', daemon=True)
+            process.start()
+        except BaseException:
+            frame.close()
+            frame.unlink()
+            raise
+        child_conn.close()
+        self._process, self._conn, self._frame = process, conn, frame
+        logging.info(f'Started render worker {self._process.pid}')
+
+    def _stop(self) -> None:
+        if self._process is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._conn.close()
+        try:
+            self._frame.close()
+        except BufferError:
+            # A frame image still refers to the buffer: it is unmapped when that image is freed
+            pass
+        self._frame.unlink()
+        self._process = self._conn = self._frame = None
+        self._overrun = False
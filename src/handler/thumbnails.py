@@ -0,0 +1,132 @@
+import hashlib
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import PIL.Image as Image
+from PIL.PngImagePlugin import PngInfo
+
+from .imageeditor import DecodeBudget
+from .imagesource import ImageSource
+
+# Largest side of the thumbnails of each size, as in the freedesktop thumbnail specification
+THUMBNAIL_SIZES = {'normal': 128, 'large': 256}
+
+
+def default_thumbnail_folder(temp_dir: str) -> str:
+    """The thumbnail folder shared with other applications where the platform has one, else one in `temp_dir`."""
+    if sys.platform.startswith('win') or sys.platform == 'darwin':
+        return os.path.join(temp_dir, 'thumbnails')
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'thumbnails')
+
+
+def image_uri(path: str) -> str:
+    return path if '://' in path else Path(os.path.abspath(path)).as_uri()
+
+
+def modification_time(path: str) -> int:
+    """Modification time of `path`, or of the archive that contains it, in whole seconds; 0 if unknown."""
+    while path:
+        try:
+            return int(os.stat(path).st_mtime)
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return 0
+
+
+class ThumbnailCache:
+    """
+    Thumbnails in the freedesktop layout: PNG files named after the MD5 of the image URI, which record that URI
+    and the modification time of the image, so a thumbnail is made again when the image changed. Missing
+    thumbnails are made in the background, with the image reduced while it is decoded.
+    """
+    WORKERS = 2
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: dict[tuple[str, str], Future] = {}
+
+    def request(self, file_id: tuple[ImageSource, str], size: str = 'normal') -> 'Future[Optional[str]]':
+        """The path of the thumbnail of `file_id`, eventually; None if the image cannot be read."""
+        key = (file_id[1], size)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.WORKERS, thread_name_prefix='thumbnail')
+                future = self._pending[key] = self._pool.submit(self._thumbnail, file_id, size)
+                future.add_done_callback(lambda f: self._done(key))
+        return future
+
+    def cached_path(self, path: str, size: str = 'normal') -> Optional[str]:
+        """The path of the thumbnail of the image at `path` if it is up to date."""
+        thumbnail_path = self._thumbnail_path(path, size)
+        try:
+            with Image.open(thumbnail_path) as thumbnail:
+                text = thumbnail.info
+                if text.get('Thumb::URI') == image_uri(path) \
+                        and text.get('Thumb::MTime') == str(modification_time(path)):
+                    return thumbnail_path
+        except (IOError, ValueError):
+            pass
+        return None
+
+    def purge(self, path: str) -> None:
+        """Remove the thumbnails of the image at `path`, which was deleted."""
+        for size in THUMBNAIL_SIZES:
+            try:
+                os.remove(self._thumbnail_path(path, size))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.debug(f'Could not remove thumbnail of {path}: {e}')
+
+    def _done(self, key: tuple[str, str]) -> None:
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def _thumbnail_path(self, path: str, size: str) -> str:
+        name = hashlib.md5(image_uri(path).encode()).hexdigest() + '.png'
+        return os.path.join(self.folder, size, name)
+
+    def _thumbnail(self, file_id: tuple[ImageSource, str], size: str) -> Optional[str]:
+        source, path = file_id
+        cached = self.cached_path(path, size)
+        if cached is not None:
+            return cached
+        if not source.is_available(path):
+            return None
+        pixels = THUMBNAIL_SIZES[size]
+        try:
+            img = source.read_image(path, DecodeBudget(max_pixels=4 * pixels * pixels))
+        except Exception as e:
+            logging.debug(f'Cannot make a thumbnail of {path}: {e}')
+            return None
+        width, height = img.info.get('original_size', img.size)
+        img.thumbnail((pixels, pixels), Image.BICUBIC)
+        info = PngInfo()
+        info.add_text('Thumb::URI', image_uri(path))
+        info.add_text('Thumb::MTime', str(modification_time(path)))
+        info.add_text('Thumb::Image::Width', str(width))
+        info.add_text('Thumb::Image::Height', str(height))
+        thumbnail_path = self._thumbnail_path(path, size)
+        tmp_path = f'{thumbnail_path}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(thumbnail_path), mode=0o700, exist_ok=True)
+            img.save(tmp_path, 'PNG', pnginfo=info)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, thumbnail_path)
+        except IOError as e:
+            logging.warning(f'Could not write thumbnail {thumbnail_path}: {e}')
+            return None
+        return thumbnail_path
@@ -0,0 +1,233 @@
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+# Desktops whose wallpaper is a single GSettings key: desktop session -> (schema, key)
+# partially taken from https://stackoverflow.com/a/21213504/3083982
+GSETTINGS_KEYS = {
+    'cinnamon': ('org.cinnamon.desktop.background', 'picture-uri'),
+    'gnome': ('org.gnome.desktop.background', 'picture-uri'),
+    'unity': ('org.gnome.desktop.background', 'picture-uri'),
+    'mate': ('org.mate.background', 'picture-filename'),
+}
+GCONF_COMMAND = ["gconftool-2", "-t", "string", "--set", "/desktop/gnome/background/picture_filename",
+                 "picture-filename"]
+
+SETTER_ENV = 'WALLPAPER_SETTER'
+HELPER_PYTHON_ENV = 'WALLPAPER_SETTER_PYTHON'
+DEFAULT_HELPER_PYTHON = '/usr/bin/python3'
+
+
+class SetterError(Exception):
+    def __init__(self, msg: str):
+        super().__init__(msg)
+
+
+class SetterUnavailableError(SetterError):
+    pass
+
+
+class WallpaperSetter(ABC):
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        pass
+
+    @abstractmethod
+    def apply(self, value: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class SubprocessSetter(WallpaperSetter):
+    name = 'subprocess'
+
+    def __init__(self, command: list[str]) -> None:
+        self.command = command
+
+    def apply(self, value: str) -> None:
+        subprocess.run(self.command + [value], check=True)
+
+
+class GioSetter(WallpaperSetter):
+    name = 'gio'
+
+    def __init__(self, schema: str, key: str) -> None:
+        try:
+            import gi
+            gi.require_version('Gio', '2.0')
+            from gi.repository import Gio
+        except (ImportError, ValueError) as e:
+            raise SetterUnavailableError('GIO bindings are not available') from e
+        source = Gio.SettingsSchemaSource.get_default()
+        if source is None or source.lookup(schema, True) is None:
+            raise SetterUnavailableError(f'GSettings schema "{schema}" is not installed')
+        self._gio = Gio
+        self._settings = Gio.Settings.new(schema)
+        self.key = key
+
+    def apply(self, value: str) -> None:
+        if not self._settings.set_string(self.key, value):
+            raise SetterError(f'Could not write GSettings key "{self.key}"')
+        self._gio.Settings.sync()
+
+
+class HelperSetter(WallpaperSetter):
+    """
+    Keeps a helper process alive and sends it one line per wallpaper change.
+
+    Protocol: the helper prints `ready` once it can accept requests, then answers every
+    `<schema>\\t<key>\\t<value>` line with either `ok` or `error <message>`.
+    A helper that does not answer in time is killed and started again.
+    """
+    name = 'helper'
+    HANDSHAKE_SECONDS = 10.0
+    REPLY_SECONDS = 5.0
+
+    def __init__(self, command: list[str], schema: str, key: str) -> None:
+        self.command = command
+        self.schema = schema
+        self.key = key
+        self._process: Optional[subprocess.Popen] = None
+        self._lines: Optional[queue.Queue] = None
+        self._start()
+
+    def _start(self) -> None:
+        try:
+            self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                             text=True, bufsize=1)
+        except OSError as e:
+            raise SetterUnavailableError(f'Cannot start wallpaper helper {self.command}') from e
+        # Lines are read on a separate thread, since a pipe read cannot time out
+        self._lines = queue.Queue()
+        threading.Thread(target=_read_lines, args=(self._process.stdout, self._lines), name='wallpaper helper',
+                         daemon=True).start()
+        handshake = self._read_line(self.HANDSHAKE_SECONDS)
+        if handshake != 'ready':
+            self._kill()
+            raise SetterUnavailableError(f'Wallpaper helper is not usable: {handshake or "no response"}')
+
+    def _read_line(self, timeout: float) -> Optional[str]:
+        """The next line from the helper, '' if it exited, or None if it did not answer within `timeout`."""
+        try:
+            return self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _request(self, value: str) -> Optional[str]:
+        try:
+            self._process.stdin.write(f'{self.schema}\t{self.key}\t{value}\n')
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            return ''
+        return self._read_line(self.REPLY_SECONDS)
+
+    def apply(self, value: str) -> None:
+        if self._process is None:
+            self._start()
+        response = self._request(value)
+        if not response:
+            # The helper died or hangs: restart it once and retry.
+            logging.warning(f'Wallpaper helper {_failure(response)}, restarting it')
+            self._kill()
+            self._start()
+            response = self._request(value)
+            if not response:
+                self._kill()
+                raise SetterError(f'Wallpaper helper {_failure(response)}')
+        if response != 'ok':
+            raise SetterError(f'Wallpaper helper failed: {response}')
+
+    def _kill(self) -> None:
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+
+    def close(self) -> None:
+        if self._process is not None:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self._process.wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+
+
+def _failure(response: Optional[str]) -> str:
+    return 'exited' if response == '' else 'did not respond'
+
+
+def _read_lines(stream, lines: queue.Queue) -> None:
+    for line in stream:
+        lines.put(line.strip())
+    lines.put('')
+
+
+def create_subprocess_setter(desktop_session: str) -> SubprocessSetter:
+    if desktop_session not in GSETTINGS_KEYS:
+        return SubprocessSetter(GCONF_COMMAND)
+    schema, key = GSETTINGS_KEYS[desktop_session]
+    return SubprocessSetter(['gsettings', 'set', schema, key])
+
+
+def create_setter(desktop_session: str) -> WallpaperSetter:
+    """
+    Return the fastest available setter for `desktop_session`: an in-process GIO binding, then a
+    persistent helper process, then one `gsettings`/`gconftool-2` subprocess per change.
+    The environment variable `WALLPAPER_SETTER` forces one of `gio`, `helper` or `subprocess`.
+    """
+    fallback = create_subprocess_setter(desktop_session)
+    if desktop_session not in GSETTINGS_KEYS:
+        return fallback
+    schema, key = GSETTINGS_KEYS[desktop_session]
+    forced = os.environ.get(SETTER_ENV)
+    if forced == SubprocessSetter.name:
+        return fallback
+    if forced in (None, GioSetter.name):
+        try:
+            return GioSetter(schema, key)
+        except SetterUnavailableError as e:
+            logging.info(f'In-process wallpaper setter unavailable: {e}')
+    if forced in (None, HelperSetter.name):
+        python = os.environ.get(HELPER_PYTHON_ENV, DEFAULT_HELPER_PYTHON)
+        try:
+            return HelperSetter([python, os.path.abspath(__file__)], schema, key)
+        except SetterUnavailableError as e:
+            logging.info(f'Wallpaper helper unavailable: {e}')
+    return fallback
+
+
+def _serve() -> None:
+    setters: dict[tuple[str, str], GioSetter] = {}
+    try:
+        import gi
+        gi.require_version('Gio', '2.0')
+        from gi.repository import Gio  # noqa: F401
+    except (ImportError, ValueError):
+        print('error GIO bindings are not available', flush=True)
+        return
+    print('ready', flush=True)
+    for line in sys.stdin:
+        try:
+            schema, key, value = line.rstrip('\n').split('\t')
+            if (schema, key) not in setters:
+                setters[schema, key] = GioSetter(schema, key)
+            setters[schema, key].apply(value)
+            print('ok', flush=True)
+        except Exception as e:
+            print(f'error {e}', flush=True)
+
+
+if __name__ == '__main__':
+    _serve()
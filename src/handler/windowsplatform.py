@@ -0,0 +1,143 @@
+import os
+import subprocess
+import ctypes
+from ctypes import wintypes
+from collections import namedtuple
+import pythoncom
+import pywintypes
+import win32gui
+from win32com.shell import shell, shellcon
+from typing import Callable, Any
+
+from .platform import Platform
+
+# Setup user32: taken from https://stackoverflow.com/a/37503441/3083982
+user32 = ctypes.WinDLL('user32', use_last_error=True)
+
+
+def check_zero(result, func, args):
+    if not result:
+        err = ctypes.get_last_error()
+        if err:
+            raise ctypes.WinError(err)
+    return args
+
+
+WindowInfo = namedtuple('WindowInfo', 'pid title')
+
+WNDENUMPROC = ctypes.WINFUNCTYPE(
+    wintypes.BOOL,
+    wintypes.HWND,  # _In_ hWnd
+    wintypes.LPARAM, )  # _In_ lParam
+
+user32.EnumWindows.errcheck = check_zero
+user32.EnumWindows.argtypes = (
+    WNDENUMPROC,  # _In_ lpEnumFunc
+    wintypes.LPARAM,)  # _In_ lParam
+
+user32.IsWindowVisible.argtypes = (
+    wintypes.HWND,)  # _In_ hWnd
+
+user32.GetWindowThreadProcessId.restype = wintypes.DWORD
+user32.GetWindowThreadProcessId.argtypes = (
+    wintypes.HWND,  # _In_      hWnd
+    wintypes.LPDWORD,)  # _Out_opt_ lpdwProcessId
+
+user32.GetWindowTextLengthW.errcheck = check_zero
+user32.GetWindowTextLengthW.argtypes = (
+    wintypes.HWND,)  # _In_ hWnd
+
+user32.GetWindowTextW.errcheck = check_zero
+user32.GetWindowTextW.argtypes = (
+    wintypes.HWND,  # _In_  hWnd
+    wintypes.LPWSTR,  # _Out_ lpString
+    ctypes.c_int,)  # _In_  nMaxCount
+
+# Continue
+FILEBROWSER_PATH = os.path.join(os.getenv('WINDIR'), 'explorer.exe')
+
+
+def _make_filter(class_name: str, title: str) -> Callable[[int, list[int]], bool]:
+    """https://docs.microsoft.com/en-us/windows/win32/api/winuser/nf-winuser-enumwindows"""
+
+    def enum_windows(handle: int, h_list: list[int]) -> bool:
+        if not (class_name or title):
+            h_list.append(handle)
+        if class_name and class_name not in win32gui.GetClassName(handle):
+            return True  # continue enumeration
+        if title and title not in win32gui.GetWindowText(handle):
+            return True  # continue enumeration
+        h_list.append(handle)
+
+    return enum_windows
+
+
+def _find_window_handles(parent: int = None, window_class: str = None, title: str = None) -> list[int]:
+    cb = _make_filter(window_class, title)
+    try:
+        handle_list = []
+        if parent:
+            win32gui.EnumChildWindows(parent, cb, handle_list)
+        else:
+            win32gui.EnumWindows(cb, handle_list)
+        return handle_list
+    except pywintypes.error:
+        return []
+
+
+def _force_refresh() -> None:
+    user32.UpdatePerUserSystemParameters(1)
+
+
+def _enable_activedesktop() -> None:
+    """https://stackoverflow.com/a/16351170"""
+    try:
+        progman = _find_window_handles(window_class='Progman')[0]
+        cryptic_params = (0x52c, 0, 0, 0, 500, None)
+        user32.SendMessageTimeoutW(progman, *cryptic_params)
+    except IndexError as e:
+        raise WindowsError('Cannot enable Active Desktop') from e
+
+
+class Windows(Platform):
+    name = 'Windows'
+
+    def __init__(self) -> None:
+        self._iad: Any = None
+
+    def _active_desktop(self) -> Any:
+        # Enabling Active Desktop and creating the COM object is slow, so it is postponed until the
+        # first wallpaper change instead of happening at startup.
+        if self._iad is None:
+            _enable_activedesktop()
+            pythoncom.CoInitialize()
+            self._iad = pythoncom.CoCreateInstance(shell.CLSID_ActiveDesktop,
+                                                   None,
+                                                   pythoncom.CLSCTX_INPROC_SERVER,
+                                                   shell.IID_IActiveDesktop)
+        return self._iad
+
+    def open_file_in_explorer(self, path: str) -> None:
+        path = os.path.normpath(path)
+        subprocess.run([FILEBROWSER_PATH, '/select,', path])
+
+    def open_file(self, path: str) -> None:
+        path = os.path.normpath(path)
+        os.startfile(path)
+
+    def set_wallpaper(self, image_path: str) -> None:
+        iad = self._active_desktop()
+        iad.SetWallpaper(image_path, 0)
+        iad.ApplyChanges(shellcon.AD_APPLY_ALL)
+        _force_refresh()
+
+    def move_to_trash(self, path: str) -> None:
+        flags = shellcon.FOF_ALLOWUNDO | shellcon.FOF_NOCONFIRMATION | shellcon.FOF_NOERRORUI | shellcon.FOF_SILENT
+        result, aborted = shell.SHFileOperation((0, shellcon.FO_DELETE, os.path.abspath(path), None, flags,
+                                                 None, None))
+        if result != 0 or aborted:
+            raise OSError(f'Cannot move {path} to the recycle bin: error {result}')
+
+
+def create_platform() -> Platform:
+    return Windows()
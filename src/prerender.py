@@ -0,0 +1,178 @@
+"""
+Render every image of the configured sources ahead of time.
+
+Usage: python src/prerender.py OUTPUT_DIR [--config CONFIG] [--workers N]
+
+Wallpapers are written to OUTPUT_DIR/<source name>/<label>.<extension>.jpg at the configured resolution,
+with their background color and label, so they can be applied as they are. Runs are resumable: a
+wallpaper is only rendered again when its source image or the render settings changed.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from typing import Iterator, Optional
+
+projectdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+config_path = os.path.join(projectdir, 'config.ini')
+font_path = os.path.join(projectdir, 'assets', 'fonts', 'Arial.ttf')
+
+from handler.configmanager import ConfigManager, ConfigField  # noqa: E402
+from handler.fingerprint import fingerprints  # noqa: E402
+from handler.imagesource import ImageSource  # noqa: E402
+from handler.imageeditor import DecodeBudget  # noqa: E402
+from handler.renderer import RenderSettings, render_wallpaper, decode_budget_from_config  # noqa: E402
+
+MANIFEST_NAME = '.prerender.json'
+FINGERPRINTS_NAME = '.fingerprints.json'
+PROGRESS_INTERVAL = 100
+
+# source, path in source, output path
+RenderTask = tuple[ImageSource, str, str]
+
+
+def output_path(output_dir: str, source: ImageSource, path: str) -> str:
+    # Keep the extension of the image, so that a.jpg and a.png in one folder get their own wallpaper
+    extension = os.path.splitext(path.split('?', 1)[0])[1]
+    return os.path.join(output_dir, source.name, source.get_label(path) + extension + '.jpg')
+
+
+def render_stamp(source: ImageSource, path: str, settings_digest: str) -> Optional[str]:
+    """
+    What a wallpaper was rendered from: the render settings and the fingerprint of its image, which every
+    source provides, unlike a modification time. None if the image cannot be fingerprinted now.
+    """
+    try:
+        return f'{settings_digest}:{source.fingerprint(path)}'
+    except OSError:
+        return None
+
+
+def render_file(task: RenderTask, settings: RenderSettings, budget: DecodeBudget) -> Optional[str]:
+    """Render one wallpaper. Returns an error message on failure, since exceptions may not be picklable."""
+    source, path, out_path = task
+    try:
+        wallpaper = render_wallpaper(source.read_image(path, budget), source.get_label(path), settings)
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = out_path + '.tmp'
+        wallpaper.save(tmp_path, 'JPEG', quality=95)
+        os.replace(tmp_path, out_path)
+        return None
+    except Exception as e:
+        return f'{path}: {e}'
+
+
+def _render_file(args: tuple[RenderTask, RenderSettings, DecodeBudget]) -> Optional[str]:
+    return render_file(*args)
+
+
+def render_all(tasks: list[RenderTask], settings: RenderSettings, budget: DecodeBudget,
+               workers: int = None) -> Iterator[Optional[str]]:
+    """
+    Render the tasks of sources that can be read from another process in a process pool, and the others in
+    this process while the pool works. Yields every task with its outcome as `render_file` returns it.
+    """
+    pooled = [task for task in tasks if task[0].process_safe]
+    local = [task for task in tasks if not task[0].process_safe]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_render_file, [(task, settings, budget) for task in pooled], chunksize=4)
+        for task in local:
+            yield task, render_file(task, settings, budget)
+        yield from zip(pooled, results)
+
+
+def settings_digest(settings: RenderSettings) -> str:
+    data = json.dumps({**asdict(settings), 'quality': settings.quality.value}, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+
+def read_manifest(output_dir: str) -> dict[str, str]:
+    """The stamp of every wallpaper in `output_dir`, by its path relative to `output_dir`."""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r') as f:
+            return dict(json.load(f)['outputs'])
+    except (IOError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def write_manifest(output_dir: str, stamps: dict[str, str]) -> None:
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'outputs': stamps}, f)
+    os.replace(path + '.tmp', path)
+
+
+def prerender(config: ConfigManager, output_dir: str, workers: int = None) -> None:
+    settings = RenderSettings.from_config(config, font_path)
+    budget = decode_budget_from_config(config)
+    digest = settings_digest(settings)
+    # Only wallpapers that were written are recorded, so an interrupted run leaves no stale entries behind
+    stamps = read_manifest(output_dir)
+
+    tasks: list[RenderTask] = []
+    task_stamps: dict[str, Optional[str]] = {}
+    skipped = 0
+    for source in config.get_value(ConfigField.SOURCES):
+        logging.info("Scanning %s for images...", source.name)
+        for path in source.scan():
+            out_path = output_path(output_dir, source, path)
+            key = os.path.relpath(out_path, output_dir)
+            stamp = render_stamp(source, path, digest)
+            if stamp is not None and stamps.get(key) == stamp and os.path.exists(out_path):
+                skipped += 1
+            else:
+                tasks.append((source, path, out_path))
+                task_stamps[key] = stamp
+    logging.info(f'{len(tasks)} wallpapers to render, {skipped} up to date')
+
+    failed = 0
+    start = time.perf_counter()
+    for done, (task, error) in enumerate(render_all(tasks, settings, budget, workers), 1):
+        key = os.path.relpath(task[2], output_dir)
+        if error is not None:
+            failed += 1
+            logging.error(f'Cannot render {error}')
+            stamps.pop(key, None)
+        elif task_stamps[key] is not None:
+            stamps[key] = task_stamps[key]
+        if done % PROGRESS_INTERVAL == 0:
+            write_manifest(output_dir, stamps)
+            elapsed = time.perf_counter() - start
+            logging.info(f'{done}/{len(tasks)} rendered ({done / elapsed:.1f} wallpapers/s)')
+    write_manifest(output_dir, stamps)
+    for source in config.get_value(ConfigField.SOURCES):
+        source.close()
+    elapsed = time.perf_counter() - start
+    rendered = len(tasks) - failed
+    throughput = rendered / elapsed if elapsed > 0 else 0.0
+    logging.info(f'Rendered {rendered} wallpapers in {elapsed:.1f} s ({throughput:.1f} wallpapers/s), '
+                 f'{skipped} up to date, {failed} failed')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('output_dir')
+    parser.add_argument('--config', default=config_path)
+    parser.add_argument('--workers', type=int, help='number of worker processes (default: number of CPUs)')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO)
+
+    if not os.path.exists(args.config):
+        logging.error(f'No configuration file found at {args.config}')
+        sys.exit(1)
+    config = ConfigManager()
+    config.read(args.config)
+    # Fingerprints tell whether an image changed since its wallpaper was rendered
+    fingerprints.open_cache(os.path.join(args.output_dir, FINGERPRINTS_NAME))
+    prerender(config, args.output_dir, args.workers)
+    fingerprints.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ import os
 import sys
 
 from PySide6 import QtWidgets
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QPalette, QColor
 
 projectdir = os.path.dirname(os.path.dirname(__file__))
@@ -11,58 +11,82 @@ tempdir = os.path.join(projectdir, 'temp')
 config_path = os.path.join(projectdir, 'config.ini')
 fontsdir = os.path.join(projectdir, 'assets', 'fonts')
 iconsdir = os.path.join(projectdir, 'assets', 'icons')
-logging.basicConfig(filename=os.path.join(projectdir, 'wallpapers.log'), format='%(asctime)s %(levelname)s %(message)s',
-                    filemode='w', level=logging.INFO)
-
 
+from control.server import ControlServer  # noqa: E402
+from handler.archivesource import set_index_folder  # noqa: E402
+from handler.fingerprint import fingerprints  # noqa: E402
 from handler.manager import WallpaperManager  # noqa: E402
+from handler.platform import set_detection_cache  # noqa: E402
+from handler.profiler import install_signal_handler  # noqa: E402
+from timer.scheduler import Scheduler  # noqa: E402
 from timer.timer import WallpaperTimer  # noqa: E402
 from widget.widget import WallpaperWidget  # noqa: E402
 
 
-manager = WallpaperManager(
-    os.path.join(projectdir, 'config.ini'),
-    tempdir,
-    os.path.join(fontsdir, 'Arial.ttf'),
-)
-timer = WallpaperTimer(manager)
+def main() -> None:
+    logging.basicConfig(filename=os.path.join(projectdir, 'wallpapers.log'),
+                        format='%(asctime)s %(levelname)s %(message)s', filemode='w', level=logging.INFO)
+    set_detection_cache(os.path.join(tempdir, 'platform.json'))
+    fingerprints.open_cache(os.path.join(tempdir, 'fingerprints.json'))
+    set_index_folder(os.path.join(tempdir, 'archives'))
+    scheduler = Scheduler()
+    manager = WallpaperManager(
+        os.path.join(projectdir, 'config.ini'),
+        tempdir,
+        os.path.join(fontsdir, 'Arial.ttf'),
+        scheduler,
+    )
+    timer = WallpaperTimer(manager, scheduler)
+    control = ControlServer(manager, timer)
+
+    install_signal_handler(manager.profiler, 5)
+    manager.start()
+    timer.start()
+    control.start()
+
+    app = QtWidgets.QApplication([])
+    app.setQuitOnLastWindowClosed(False)
+    # Force the style to be the same on all OSs:
+    app.setStyle("Fusion")
 
-manager.start()
-timer.start()
+    # Now use a palette to switch to dark colors:
+    palette = QPalette()
+    palette.setColor(QPalette.Window, QColor(53, 53, 53))
+    palette.setColor(QPalette.WindowText, Qt.white)
+    palette.setColor(QPalette.Base, QColor(25, 25, 25))
+    palette.setColor(QPalette.AlternateBase, QColor(53, 53, 53))
+    palette.setColor(QPalette.ToolTipBase, Qt.black)
+    palette.setColor(QPalette.ToolTipText, Qt.white)
+    palette.setColor(QPalette.Text, Qt.white)
+    palette.setColor(QPalette.Button, QColor(53, 53, 53))
+    palette.setColor(QPalette.ButtonText, Qt.white)
+    palette.setColor(QPalette.BrightText, Qt.red)
+    palette.setColor(QPalette.Link, QColor(42, 130, 218))
+    palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
+    palette.setColor(QPalette.HighlightedText, Qt.black)
+    app.setPalette(palette)
+    # Qt's event loop doesn't run Python code by itself, so wake up regularly to handle signals such as SIGUSR1
+    signal_timer = QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
+    widget = WallpaperWidget(manager, timer,
+                             os.path.join(iconsdir, 'previous.svg'),
+                             os.path.join(iconsdir, 'pause.svg'),
+                             os.path.join(iconsdir, 'play.svg'),
+                             os.path.join(iconsdir, 'next.svg'),
+                             os.path.join(iconsdir, 'turn_left.svg'),
+                             os.path.join(iconsdir, 'turn_right.svg'),
+                             os.path.join(iconsdir, 'delete.svg'),
+                             os.path.join(iconsdir, 'explorer.svg'),
+                             os.path.join(iconsdir, 'config.svg'),
+                             os.path.join(iconsdir, 'tools.svg'),
+                             initially_expanded=False,
+                             icon_cache_folder=os.path.join(tempdir, 'icons')
+                             )
+    widget.start()
+    sys.exit(app.exec())
 
-app = QtWidgets.QApplication([])
-app.setQuitOnLastWindowClosed(False)
-# Force the style to be the same on all OSs:
-app.setStyle("Fusion")
 
-# Now use a palette to switch to dark colors:
-palette = QPalette()
-palette.setColor(QPalette.Window, QColor(53, 53, 53))
-palette.setColor(QPalette.WindowText, Qt.white)
-palette.setColor(QPalette.Base, QColor(25, 25, 25))
-palette.setColor(QPalette.AlternateBase, QColor(53, 53, 53))
-palette.setColor(QPalette.ToolTipBase, Qt.black)
-palette.setColor(QPalette.ToolTipText, Qt.white)
-palette.setColor(QPalette.Text, Qt.white)
-palette.setColor(QPalette.Button, QColor(53, 53, 53))
-palette.setColor(QPalette.ButtonText, Qt.white)
-palette.setColor(QPalette.BrightText, Qt.red)
-palette.setColor(QPalette.Link, QColor(42, 130, 218))
-palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-palette.setColor(QPalette.HighlightedText, Qt.black)
-app.setPalette(palette)
-widget = WallpaperWidget(manager, timer,
-                         os.path.join(iconsdir, 'previous.svg'),
-                         os.path.join(iconsdir, 'pause.svg'),
-                         os.path.join(iconsdir, 'play.svg'),
-                         os.path.join(iconsdir, 'next.svg'),
-                         os.path.join(iconsdir, 'turn_left.svg'),
-                         os.path.join(iconsdir, 'turn_right.svg'),
-                         os.path.join(iconsdir, 'delete.svg'),
-                         os.path.join(iconsdir, 'explorer.svg'),
-                         os.path.join(iconsdir, 'config.svg'),
-                         os.path.join(iconsdir, 'tools.svg'),
-                         initially_expanded=False
-                         )
-widget.start()
-sys.exit(app.exec())
+# The render worker process imports this module: only start the app when it is run
+if __name__ == '__main__':
+    main()
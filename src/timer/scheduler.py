@@ -0,0 +1,153 @@
+import logging
+import time
+from threading import Condition, Thread
+from typing import Callable, Optional
+
+
+class Job:
+    def __init__(self, scheduler: 'Scheduler', callback: Callable[[], None], interval: float, name: str,
+                 repeat: bool = True) -> None:
+        self._scheduler = scheduler
+        self.callback = callback
+        self.name = name
+        self.repeat = repeat
+        self._interval = interval
+        self._due: Optional[float] = None
+        self._remaining: float = interval
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    @property
+    def is_running(self) -> bool:
+        return self._due is not None
+
+    def remaining(self) -> float:
+        with self._scheduler.condition:
+            if self._due is None:
+                return self._remaining
+            return max(0.0, self._due - self._scheduler.clock())
+
+    def restart(self) -> None:
+        with self._scheduler.condition:
+            self._due = self._scheduler.clock() + self._interval
+            self._scheduler.condition.notify()
+
+    def pause(self) -> None:
+        with self._scheduler.condition:
+            if self._due is not None:
+                self._remaining = max(0.0, self._due - self._scheduler.clock())
+                self._due = None
+
+    def resume(self) -> None:
+        with self._scheduler.condition:
+            if self._due is None:
+                self._due = self._scheduler.clock() + self._remaining
+                self._scheduler.condition.notify()
+
+    def set_interval(self, interval: float) -> None:
+        """Change the period, keeping the time that has already elapsed in the current period."""
+        with self._scheduler.condition:
+            if self._due is not None:
+                self._due += interval - self._interval
+            else:
+                self._remaining = max(0.0, self._remaining + interval - self._interval)
+            self._interval = interval
+            self._scheduler.condition.notify()
+
+    def cancel(self) -> None:
+        self._scheduler.cancel(self)
+
+    def _advance(self, now: float) -> None:
+        if not self.repeat:
+            # A one-shot job stays scheduled, stopped, until it is restarted
+            self._due = None
+            self._remaining = self._interval
+            return
+        # Step from the previous deadline instead of from `now` so periodic ticks don't drift.
+        # Periods that were missed entirely (e.g. while a callback was slow) are skipped.
+        self._due += self._interval
+        if self._due <= now:
+            self._due = now + self._interval
+
+
+class Scheduler:
+    """Runs periodic and one-shot jobs on a single long-lived thread, timed with a monotonic clock."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic) -> None:
+        self.clock = clock
+        self.condition = Condition()
+        self._jobs: list[Job] = []
+        self._thread: Optional[Thread] = None
+        self._stopped = False
+
+    def start(self) -> None:
+        with self.condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self.condition:
+            self._stopped = True
+            self.condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def schedule(self, interval: float, callback: Callable[[], None], name: str = None,
+                 start: bool = True, repeat: bool = True) -> Job:
+        """
+        Run `callback` every `interval` seconds, or once `interval` seconds after the job is (re)started if
+        `repeat` is false. Restarting a one-shot job that is due postpones it, which debounces bursts.
+        """
+        job = Job(self, callback, interval, name or getattr(callback, '__name__', 'job'), repeat)
+        with self.condition:
+            self._jobs.append(job)
+            if start:
+                job._due = self.clock() + interval
+            self.condition.notify()
+        return job
+
+    def cancel(self, job: Job) -> None:
+        with self.condition:
+            if job in self._jobs:
+                self._jobs.remove(job)
+            job._due = None
+            self.condition.notify()
+
+    def run_pending(self) -> Optional[float]:
+        """Run every job that is due and return the number of seconds until the next deadline, if any."""
+        with self.condition:
+            now = self.clock()
+            due = [j for j in self._jobs if j._due is not None and j._due <= now]
+            for job in due:
+                job._advance(now)
+        for job in due:
+            try:
+                job.callback()
+            except Exception:
+                logging.exception('Scheduled job "%s" failed', job.name)
+        with self.condition:
+            return self._time_until_next()
+
+    def _time_until_next(self) -> Optional[float]:
+        deadlines = [j._due for j in self._jobs if j._due is not None]
+        if len(deadlines) == 0:
+            return None
+        return max(0.0, min(deadlines) - self.clock())
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while not self._stopped:
+                    wait = self._time_until_next()
+                    if wait is not None and wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if self._stopped:
+                    return
+            self.run_pending()
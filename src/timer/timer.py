@@ -1,68 +1,70 @@
+import threading
 import time
-from threading import Timer
-from typing import Any
+from typing import Any, Optional
 
 from handler.configmanager import ConfigField
 from handler.manager import WallpaperManager, WallpaperObserver, FileId
+from timer.scheduler import Scheduler, Job
+
+
+def scheduled_band(schedule: tuple[tuple[int, str], ...], minute: int) -> Optional[str]:
+    """The luminance band of the last schedule entry at or before `minute`, wrapping around midnight."""
+    if len(schedule) == 0:
+        return None
+    band = schedule[-1][1]
+    for start, entry_band in schedule:
+        if start > minute:
+            break
+        band = entry_band
+    return band
 
 
 class WallpaperTimer(WallpaperObserver):
-    def __init__(self, manager: WallpaperManager) -> None:
+    def __init__(self, manager: WallpaperManager, scheduler: Scheduler = None) -> None:
         self.manager = manager
-        self.thread = None
-        self.start_time = -1
-        self.cancel_time = -1
-        self.is_running = False
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.job: Optional[Job] = None
+        # Thread on which the job itself changes the wallpaper, which must not restart the period
+        self._changing_thread: Optional[int] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.job is not None and self.job.is_running
 
     def _on_time(self) -> None:
-        self.manager.next()
+        now = time.localtime()
+        schedule = self.manager.get_config(ConfigField.LUMINANCE_SCHEDULE)
+        self._changing_thread = threading.get_ident()
+        try:
+            self.manager.next(scheduled_band(schedule, now.tm_hour * 60 + now.tm_min))
+        finally:
+            self._changing_thread = None
 
     def start(self) -> None:
         self.manager.subscribe(self)
-        self.thread = Timer(self.manager.get_config(ConfigField.CHANGE_TIME), self._on_time)
-        self.start_time = time.time()
-        self.is_running = True
-        self.thread.start()
+        self.scheduler.start()
+        self.job = self.scheduler.schedule(self.manager.get_config(ConfigField.CHANGE_TIME), self._on_time,
+                                           name='wallpaper')
 
     def restart(self) -> None:
-        self.thread.cancel()
-        t = self.manager.get_config(ConfigField.CHANGE_TIME)
-        self.thread = Timer(t, self._on_time)
-        self.start_time = time.time()
-        self.is_running = True
-        self.thread.start()
+        self.job.restart()
 
     def pause(self) -> None:
-        if self.is_running:
-            self.cancel_time = time.time()
-            self.is_running = False
-            self.thread.cancel()
+        self.job.pause()
 
     def resume(self) -> None:
-        if not self.is_running:
-            t = self.manager.get_config(ConfigField.CHANGE_TIME) - (self.cancel_time - self.start_time)
-            self.thread = Timer(t, self._on_time)
-            self.start_time = time.time()
-            self.is_running = True
-            self.thread.start()
+        self.job.resume()
 
     def _recalculate_time(self) -> None:
-        if self.is_running:
-            self.thread.cancel()
-            current_time = time.time()
-            t = self.manager.get_config(ConfigField.CHANGE_TIME) - (current_time - self.start_time)
-            self.thread = Timer(t, self._on_time)
-            self.is_running = True
-            self.thread.start()
-
-    def _create_thread(self, t: int) -> None:
-        self.thread = Timer(t, self._on_time)
-        self.thread.daemon = False
+        self.job.set_interval(self.manager.get_config(ConfigField.CHANGE_TIME))
 
     def on_config_change(self, field: ConfigField, value: Any) -> None:
-        if field == ConfigField.CHANGE_TIME:
+        if field == ConfigField.CHANGE_TIME and self.job is not None:
             self._recalculate_time()
 
     def on_wallpaper_change(self, file_id: FileId) -> None:
-        if self.is_running:
+        # A manual change starts a new full period; the job's own changes keep their drift-free deadlines
+        # Observers are called on the thread that changed the wallpaper, and a manual change from another thread
+        # may happen while the job waits for the manager
+        if self.is_running and self._changing_thread != threading.get_ident():
             self.restart()
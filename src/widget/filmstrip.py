@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Optional
+
+from PySide6 import QtCore, QtWidgets
+from PySide6.QtCore import QModelIndex, QSize, Qt
+from PySide6.QtGui import QImage, QPixmap
+
+from handler.manager import WallpaperManager, FileId
+from handler.thumbnails import THUMBNAIL_SIZES
+
+
+class HistoryModel(QtCore.QAbstractListModel):
+    """
+    The wallpaper history as a list of thumbnails. A thumbnail is only requested when its cell is drawn, and at
+    most MAX_PIXMAPS of them are kept, the least recently drawn are dropped first.
+    """
+    MAX_PIXMAPS = 48
+    # Time after which a thumbnail that could not be made is requested again, e.g. once an image was downloaded
+    RETRY_SECONDS = 30
+    # Emitted from the thumbnail threads with the path of the image and its thumbnail
+    _thumbnail_loaded = QtCore.Signal(str, QImage)
+
+    def __init__(self, manager: WallpaperManager, parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self.manager = manager
+        self.thumbnail_size = 'normal'
+        self._file_ids: list[FileId] = []
+        self._pixmaps: OrderedDict[str, QPixmap] = OrderedDict()
+        # Thumbnails that are being made, or that could not be made and wait for a retry
+        self._requested: set[str] = set()
+        self._thumbnail_loaded.connect(self._on_thumbnail_loaded)
+
+    def refresh(self) -> None:
+        self.beginResetModel()
+        self._file_ids = self.manager.history
+        self.endResetModel()
+
+    def set_thumbnail_size(self, size: str) -> None:
+        if size != self.thumbnail_size:
+            self.thumbnail_size = size
+            self._pixmaps.clear()
+            self._requested.clear()
+            self.refresh()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._file_ids)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        if not index.isValid() or index.row() >= len(self._file_ids):
+            return None
+        source, path = self._file_ids[index.row()]
+        if role == Qt.ToolTipRole:
+            return source.get_label(path)
+        if role == Qt.DecorationRole:
+            pixmap = self._pixmaps.get(path)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(path)
+                return pixmap
+            self._request((source, path))
+        return None
+
+    def _request(self, file_id: FileId) -> None:
+        path = file_id[1]
+        if path in self._requested:
+            return
+        self._requested.add(path)
+        future = self.manager.thumbnails.request(file_id, self.thumbnail_size)
+        future.add_done_callback(lambda f: self._load(path, f))
+
+    def _load(self, path: str, future: 'Future[Optional[str]]') -> None:
+        """Read the finished thumbnail on the thread that made it; pixmaps can only be made on the GUI thread."""
+        thumbnail_path = future.result() if future.exception() is None else None
+        self._thumbnail_loaded.emit(path, QImage(thumbnail_path) if thumbnail_path is not None else QImage())
+
+    @QtCore.Slot(str, QImage)
+    def _on_thumbnail_loaded(self, path: str, image: QImage) -> None:
+        if image.isNull():
+            QtCore.QTimer.singleShot(self.RETRY_SECONDS * 1000, self, lambda: self._retry(path))
+            return
+        self._requested.discard(path)
+        self._pixmaps[path] = QPixmap.fromImage(image)
+        while len(self._pixmaps) > self.MAX_PIXMAPS:
+            self._pixmaps.popitem(last=False)
+        self._changed(path)
+
+    def _retry(self, path: str) -> None:
+        """Let the view ask for a thumbnail that could not be made again."""
+        if path in self._requested and path not in self._pixmaps:
+            self._requested.discard(path)
+            self._changed(path)
+
+    def _changed(self, path: str) -> None:
+        for row, (source, p) in enumerate(self._file_ids):
+            if p == path:
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class Filmstrip(QtWidgets.QListView):
+    """A horizontal strip of the recent and upcoming wallpapers; clicking one shows it again."""
+    # Logical size of a cell at a widget scale of 1
+    thumbnail_width = 96
+    thumbnail_height = 54
+    spacing = 4
+
+    def __init__(self, manager: WallpaperManager, parent: QtWidgets.QWidget = None) -> None:
+        super().__init__(parent)
+        self.manager = manager
+        self.history_model = HistoryModel(manager, self)
+        self.setModel(self.history_model)
+        self.setViewMode(QtWidgets.QListView.IconMode)
+        self.setFlow(QtWidgets.QListView.LeftToRight)
+        self.setWrapping(False)
+        self.setMovement(QtWidgets.QListView.Static)
+        self.setUniformItemSizes(True)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setHorizontalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        self.clicked.connect(self._handle_clicked)
+
+    def set_scale(self, scale: float, device_pixel_ratio: float) -> None:
+        size = QSize(round(self.thumbnail_width * scale), round(self.thumbnail_height * scale))
+        self.setIconSize(size)
+        self.setGridSize(size + QSize(self.spacing, self.spacing))
+        self.setFixedHeight(size.height() + self.spacing + self.horizontalScrollBar().sizeHint().height()
+                            + 2 * self.frameWidth())
+        pixels = max(size.width(), size.height()) * device_pixel_ratio
+        self.history_model.set_thumbnail_size('normal' if pixels <= THUMBNAIL_SIZES['normal'] else 'large')
+
+    def refresh(self) -> None:
+        self.history_model.refresh()
+        index = self.history_model.index(self.manager.current_index)
+        if index.isValid():
+            self.setCurrentIndex(index)
+            self.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtCenter)
+
+    @QtCore.Slot(QModelIndex)
+    def _handle_clicked(self, index: QModelIndex) -> None:
+        self.manager.go_to(index.row())
@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import os
+from typing import Optional
+
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QColor, Qt, QIcon, QPixmap
+
+
+class IconCache:
+    """
+    Tinted icons, rasterized from their SVG at the size they are shown at. Pixmaps are kept in memory and, if a
+    folder is given, as PNG files keyed by the SVG file, its modification time, the color and the size, so
+    that the SVGs are only rendered again when one of those changes.
+    """
+
+    def __init__(self, color: QColor, folder: Optional[str] = None) -> None:
+        self.color = color
+        self.folder = folder
+        self._icons: dict[str, QIcon] = {}
+
+    def icon(self, svg_path: str, size: int, device_pixel_ratio: float = 1.0) -> QIcon:
+        """The icon at `svg_path` for a `size` by `size` button, in logical pixels."""
+        pixels = max(1, round(size * device_pixel_ratio))
+        key = self._key(svg_path, pixels)
+        icon = self._icons.get(key)
+        if icon is None:
+            pixmap = self._load(key)
+            if pixmap is None:
+                pixmap = self._tint(svg_path, pixels)
+                self._save(key, pixmap)
+            pixmap.setDevicePixelRatio(device_pixel_ratio)
+            icon = self._icons[key] = QIcon(pixmap)
+        return icon
+
+    def _key(self, svg_path: str, pixels: int) -> str:
+        try:
+            mtime = os.stat(svg_path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        key = f'{os.path.abspath(svg_path)}:{mtime}:{self.color.name(QColor.HexArgb)}:{pixels}'
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _tint(self, svg_path: str, pixels: int) -> QPixmap:
+        pixmap = QIcon(svg_path).pixmap(QSize(pixels, pixels))
+        mask = pixmap.createMaskFromColor(QColor('black'), Qt.MaskOutColor)
+        pixmap.fill(self.color)
+        pixmap.setMask(mask)
+        return pixmap
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key + '.png')
+
+    def _load(self, key: str) -> Optional[QPixmap]:
+        if self.folder is None:
+            return None
+        pixmap = QPixmap()
+        return pixmap if pixmap.load(self._path(key), 'PNG') else None
+
+    def _save(self, key: str, pixmap: QPixmap) -> None:
+        if self.folder is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            if not pixmap.save(path + '.tmp', 'PNG'):
+                raise IOError(f'Cannot write {path}')
+            os.replace(path + '.tmp', path)
+        except IOError as e:
+            logging.warning(f'Could not cache icon: {e}')
@@ -1,18 +1,27 @@
+import logging
+import time
 from typing import Any
 
 from PySide6 import QtCore, QtWidgets
 from PySide6.QtCore import QSize
-from PySide6.QtGui import QColor, Qt, QIcon, QScreen
+from PySide6.QtGui import QColor, Qt, QScreen
 from PySide6.QtWidgets import QApplication, QMessageBox, QDialog
 
 from handler.configmanager import ConfigField
-from handler.manager import WallpaperManager, WallpaperObserver
+from handler.manager import WallpaperManager, WallpaperObserver, FileId
+from handler.renderer import Screen
 from timer.timer import WallpaperTimer
+from widget.filmstrip import Filmstrip
+from widget.iconcache import IconCache
 
 
 class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
     icon_color = QColor(150, 210, 255, 255)
     default_button_size = 30
+    # Emitted from any thread when the wallpaper changed
+    wallpaper_changed = QtCore.Signal()
+    # Emitted from any thread, such as the one that reloads the config file, with a changed field and its value
+    config_changed = QtCore.Signal(object, object)
 
     def __init__(self, manager: WallpaperManager, timer: WallpaperTimer,
                  previous_icon: str,
@@ -25,7 +34,9 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
                  explorer_icon: str,
                  config_icon: str,
                  tools_icon: str,
-                 initially_expanded: bool = False):
+                 initially_expanded: bool = False,
+                 icon_cache_folder: str = None):
+        created_at = time.perf_counter()
         super().__init__(f=QtCore.Qt.WindowStaysOnBottomHint
                          | QtCore.Qt.CustomizeWindowHint
                          | QtCore.Qt.FramelessWindowHint
@@ -33,34 +44,51 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
                          | QtCore.Qt.Tool
                          )
 
+        self._created_at = created_at
         self.manager = manager
         self.timer = timer
 
-        self.pause_icon = self._create_icon(pause_icon)
-        self.play_icon = self._create_icon(play_icon)
-
-        self.previous = self._create_button(self._create_icon(previous_icon))
-        self.play_or_pause = self._create_button(
-            self.pause_icon if self.timer.is_running else self.play_icon)
-        self.next = self._create_button(self._create_icon(next_icon))
-        self.turn_left = self._create_button(self._create_icon(turn_left_icon))
-        self.turn_right = self._create_button(self._create_icon(turn_right_icon))
-        self.delete = self._create_button(self._create_icon(delete_icon))
-        self.open_explorer = self._create_button(self._create_icon(explorer_icon))
-        self.open_config = self._create_button(self._create_icon(config_icon))
-        self.tools = self._create_button(self._create_icon(tools_icon))
+        self._icons = IconCache(self.icon_color, icon_cache_folder)
+        self._icon_paths = {'previous': previous_icon, 'pause': pause_icon, 'play': play_icon, 'next': next_icon,
+                            'turn_left': turn_left_icon, 'turn_right': turn_right_icon, 'delete': delete_icon,
+                            'explorer': explorer_icon, 'config': config_icon, 'tools': tools_icon}
+
+        self.previous = self._create_button()
+        self.play_or_pause = self._create_button()
+        self.next = self._create_button()
+        self.turn_left = self._create_button()
+        self.turn_right = self._create_button()
+        self.delete = self._create_button()
+        self.open_explorer = self._create_button()
+        self.open_config = self._create_button()
+        self.tools = self._create_button()
+        self.show_history = QtWidgets.QToolButton()
+        self.show_history.setArrowType(Qt.DownArrow)
+        self.show_history.setCheckable(True)
+        # Shown for the undo window after a deletion
+        self.undo_delete = QtWidgets.QPushButton('Undo')
+        self.undo_delete.hide()
+        self._undo_generation = 0
         self.tools.setCheckable(True)
         self.tools.setChecked(not initially_expanded)
 
         self.action_buttons = [self.previous, self.play_or_pause, self.next, self.turn_left, self.turn_right,
-                               self.delete, self.open_explorer, self.open_config]
+                               self.delete, self.open_explorer, self.open_config, self.show_history]
 
-        self.hlayout = QtWidgets.QHBoxLayout(self)
+        self.vlayout = QtWidgets.QVBoxLayout(self)
         self.layout().setContentsMargins(5, 5, 5, 5)
+        self.vlayout.setSpacing(5)
+        self.hlayout = QtWidgets.QHBoxLayout()
         self.hlayout.setSpacing(0)
         for btn in self.action_buttons:
             self.hlayout.addWidget(btn)
+            if btn is self.delete:
+                self.hlayout.addWidget(self.undo_delete)
         self.hlayout.addWidget(self.tools)
+        self.vlayout.addLayout(self.hlayout)
+        self.filmstrip = Filmstrip(manager, self)
+        self.filmstrip.hide()
+        self.vlayout.addWidget(self.filmstrip)
 
         self.previous.clicked.connect(self._handle_previous)
         self.play_or_pause.clicked.connect(self._handle_play_or_pause)
@@ -68,11 +96,17 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
         self.turn_left.clicked.connect(self._handle_turn_left)
         self.turn_right.clicked.connect(self._handle_turn_right)
         self.delete.clicked.connect(self._handle_delete)
+        self.undo_delete.clicked.connect(self._handle_undo_delete)
         self.open_explorer.clicked.connect(self._handle_open_explorer)
         self.open_config.clicked.connect(self._handle_open_config)
         self.tools.clicked.connect(self._handle_tool_toggle)
+        self.show_history.clicked.connect(self._handle_history_toggle)
+        self.wallpaper_changed.connect(self._handle_wallpaper_changed)
+        self.config_changed.connect(self._handle_config_changed)
 
         self._update_button_size()
+        self.filmstrip.set_scale(self.manager.get_config(ConfigField.WIDGET_SCALE),
+                                 QApplication.primaryScreen().devicePixelRatio())
 
         if initially_expanded:
             self.expand()
@@ -81,33 +115,70 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
 
     def start(self):
         self.manager.subscribe(self)
+        self._update_screens()
+        app = QApplication.instance()
+        app.screenAdded.connect(self._update_screens)
+        app.screenRemoved.connect(self._update_screens)
         self.show()
 
-    def _create_icon(self, path: str) -> QIcon:
-        pixmap = QIcon(path).pixmap(QSize(512, 512))
-        mask = pixmap.createMaskFromColor(QColor('black'), Qt.MaskOutColor)
-        pixmap.fill(self.icon_color)
-        pixmap.setMask(mask)
-        return QIcon(pixmap)
+    def _update_screens(self, *args):
+        screens = []
+        for screen in QApplication.screens():
+            # Qt keeps the position of a screen in native pixels and only scales its size by the screen's own
+            # ratio, so that screens with different ratios still line up in the virtual desktop
+            geo = screen.geometry()
+            ratio = screen.devicePixelRatio()
+            screens.append(Screen(geo.x(), geo.y(), round(geo.width() * ratio), round(geo.height() * ratio)))
+        self.manager.set_screens(screens)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self._created_at is not None:
+            seconds = time.perf_counter() - self._created_at
+            self._created_at = None
+            logging.info(f'Widget shown {seconds:.3f} s after it was created')
+            self.manager.metrics.set_gauge('widget_time_to_show_seconds', seconds)
 
-    def _create_button(self, icon: QIcon):
-        btn = QtWidgets.QPushButton(icon, '')
+    def _create_button(self):
+        btn = QtWidgets.QPushButton('')
         return btn
 
+    def _update_icons(self, size: int):
+        """Rasterize the icons for buttons of `size` logical pixels, or take them from the cache."""
+        ratio = QApplication.primaryScreen().devicePixelRatio()
+        icons = {name: self._icons.icon(path, size, ratio) for name, path in self._icon_paths.items()}
+        self.pause_icon = icons['pause']
+        self.play_icon = icons['play']
+        self.previous.setIcon(icons['previous'])
+        self.play_or_pause.setIcon(self.pause_icon if self.timer.is_running else self.play_icon)
+        self.next.setIcon(icons['next'])
+        self.turn_left.setIcon(icons['turn_left'])
+        self.turn_right.setIcon(icons['turn_right'])
+        self.delete.setIcon(icons['delete'])
+        self.open_explorer.setIcon(icons['explorer'])
+        self.open_config.setIcon(icons['config'])
+        self.tools.setIcon(icons['tools'])
+
     def expand(self):
         for btn in self.action_buttons:
             btn.show()
+        if self.show_history.isChecked():
+            self.filmstrip.refresh()
+            self.filmstrip.show()
         self._refresh_geometry()
         self.setWindowOpacity(0.95)
 
     def collapse(self):
         for btn in self.action_buttons:
             btn.hide()
+        self.undo_delete.hide()
+        self.filmstrip.hide()
         self._refresh_geometry()
         self.setWindowOpacity(0.6)
 
     def _refresh_geometry(self):
-        self.setFixedSize(self.hlayout.sizeHint())
+        self.filmstrip.setFixedWidth(self.hlayout.sizeHint().width())
+        self.setFixedSize(self.vlayout.sizeHint())
         self._move_to_top_right()
 
     def _move_to_top_right(self):
@@ -117,16 +188,40 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
         self.move(geo.topLeft())
 
     def on_config_change(self, field: ConfigField, value: Any) -> None:
+        self.config_changed.emit(field, value)
+
+    @QtCore.Slot(object, object)
+    def _handle_config_changed(self, field: ConfigField, value: Any) -> None:
+        # Pixmaps, widgets and the models of views can only be changed on the GUI thread
         if field == ConfigField.WIDGET_SCALE:
             self._update_button_size()
+            self.filmstrip.set_scale(value, QApplication.primaryScreen().devicePixelRatio())
             self._refresh_geometry()
 
     def _update_button_size(self):
-        s = self.default_button_size * self.manager.get_config(ConfigField.WIDGET_SCALE)
+        s = round(self.default_button_size * self.manager.get_config(ConfigField.WIDGET_SCALE))
+        self._update_icons(s)
         for btn in self.action_buttons:
             btn.setIconSize(QSize(s, s))
         self.tools.setIconSize(QSize(s, s))
 
+    def on_wallpaper_change(self, file_id: FileId) -> None:
+        self.wallpaper_changed.emit()
+
+    @QtCore.Slot()
+    def _handle_wallpaper_changed(self):
+        if self.filmstrip.isVisible():
+            self.filmstrip.refresh()
+
+    @QtCore.Slot()
+    def _handle_history_toggle(self):
+        if self.show_history.isChecked():
+            self.filmstrip.refresh()
+            self.filmstrip.show()
+        else:
+            self.filmstrip.hide()
+        self._refresh_geometry()
+
     @QtCore.Slot()
     def _handle_previous(self):
         self.manager.previous()
@@ -158,7 +253,11 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
         msg_box.setWindowTitle("Delete wallpaper")
         msg_box.setText(
             f"Are you sure you want to delete {self.manager.current_source.get_label(self.manager.current_path)}?")
-        msg_box.setInformativeText("This action cannot be undone.")
+        undo_seconds = self.manager.get_config(ConfigField.UNDO_DELETE_SECONDS)
+        if undo_seconds > 0:
+            msg_box.setInformativeText(f"The deletion can be undone for {undo_seconds:g} seconds.")
+        else:
+            msg_box.setInformativeText("This action cannot be undone.")
         msg_box.setStandardButtons(QMessageBox.Ok | QMessageBox.Cancel)
         msg_box.setDefaultButton(QMessageBox.Ok)
         is_running = self.timer.is_running
@@ -166,9 +265,30 @@ class WallpaperWidget(WallpaperObserver, QtWidgets.QWidget):
             self.timer.pause()
         if msg_box.exec() == QMessageBox.Ok:
             self.manager.delete_current()
+            if undo_seconds > 0:
+                self._show_undo(undo_seconds)
         if is_running:
             self.timer.resume()
 
+    def _show_undo(self, seconds: float):
+        self._undo_generation += 1
+        generation = self._undo_generation
+        self.undo_delete.show()
+        self._refresh_geometry()
+        QtCore.QTimer.singleShot(round(seconds * 1000), lambda: self._hide_undo(generation))
+
+    def _hide_undo(self, generation: int):
+        # A later deletion has its own window
+        if generation == self._undo_generation and self.undo_delete.isVisible():
+            self.undo_delete.hide()
+            self._refresh_geometry()
+
+    @QtCore.Slot()
+    def _handle_undo_delete(self):
+        self.undo_delete.hide()
+        self._refresh_geometry()
+        self.manager.undo_delete()
+
     @QtCore.Slot()
     def _handle_open_explorer(self):
         self.manager.show_source_of_current()
@@ -0,0 +1,58 @@
+import io
+import os
+import zipfile
+
+import PIL.Image as Image
+import pytest
+
+from handler import archivesource
+from handler.archivesource import ArchiveSource
+
+
+def write_archive(path, count: int) -> None:
+    with zipfile.ZipFile(path, 'w') as archive:
+        for i in range(count):
+            data = io.BytesIO()
+            Image.new('RGB', (40, 30), (20 * i, 0, 0)).save(data, 'PNG')
+            archive.writestr(f'img{i}.png', data.getvalue())
+
+
+@pytest.fixture
+def index_folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'indexes'
+    monkeypatch.setattr(archivesource, '_index_folder', str(folder))
+    return folder
+
+
+def test_reuses_the_saved_index(tmp_path, index_folder, monkeypatch):
+    archive = tmp_path / 'images.zip'
+    write_archive(archive, 3)
+    assert len(ArchiveSource('images', str(archive)).scan()) == 3
+    assert len(os.listdir(index_folder)) == 1
+
+    monkeypatch.setattr(ArchiveSource, '_index_zip', lambda self: pytest.fail('the archive was indexed again'))
+    source = ArchiveSource('images', str(archive))
+    paths = source.scan()
+    assert len(paths) == 3
+    assert source.read_image(paths[2]).size == (40, 30)
+
+
+def test_indexes_a_changed_archive_again(tmp_path, index_folder):
+    archive = tmp_path / 'images.zip'
+    write_archive(archive, 3)
+    source = ArchiveSource('images', str(archive))
+    paths = source.scan()
+    fingerprint = source.fingerprint(paths[0])
+    reader = source._open(paths[0])
+
+    write_archive(archive, 5)
+    os.utime(archive, ns=(0, os.stat(archive).st_mtime_ns + 1))
+    paths = source.scan()
+    assert len(paths) == 5
+    assert source._map is None
+    # The open member stays readable until it is closed
+    assert Image.open(reader).size == (40, 30)
+    reader.close()
+    assert source.fingerprint(paths[0]) == fingerprint
+    assert ArchiveSource('images', str(archive)).scan() == paths
+    source.close()
@@ -0,0 +1,116 @@
+import socket
+import urllib.error
+import urllib.request
+
+import pytest
+
+from control.server import ControlServer
+from handler.configmanager import ConfigField
+from handler.metrics import Metrics
+from timer.scheduler import Scheduler
+from timer.timer import WallpaperTimer
+
+
+class FakeManager:
+    def __init__(self, port: int) -> None:
+        self.config = {ConfigField.CONTROL_HOST: '127.0.0.1', ConfigField.CONTROL_PORT: port,
+                       ConfigField.CHANGE_TIME: 60.0, ConfigField.LUMINANCE_SCHEDULE: ()}
+        self.metrics = Metrics()
+        self.scanned_count = 12
+        self.history_size = 0
+        self.observers = []
+
+    def get_config(self, field: ConfigField):
+        return self.config[field]
+
+    def subscribe(self, observer) -> None:
+        self.observers.append(observer)
+
+    def next(self) -> None:
+        self.history_size += 1
+        for observer in self.observers:
+            observer.on_wallpaper_change(None)
+
+    def dump_metrics(self) -> str:
+        return self.metrics.dump()
+
+    def previous(self) -> None:
+        raise RuntimeError('no previous wallpaper')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def control():
+    manager = FakeManager(free_port())
+    scheduler = Scheduler()
+    timer = WallpaperTimer(manager, scheduler)
+    timer.start()
+    server = ControlServer(manager, timer)
+    server.start()
+    yield server
+    server.stop()
+    scheduler.stop()
+
+
+def request(server: ControlServer, path: str, method: str = 'GET') -> tuple[int, str]:
+    host, port = server.address
+    try:
+        with urllib.request.urlopen(urllib.request.Request(f'http://{host}:{port}{path}', method=method)) as r:
+            return r.status, r.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+def test_serves_metrics(control):
+    with control.manager.metrics.span('decode'):
+        pass
+    control.manager.metrics.increment('history_hits')
+    status, body = request(control, '/metrics')
+    assert status == 200
+    assert 'wallpaper_stage_seconds_count{stage="decode"} 1' in body
+    assert 'wallpaper_events_total{event="history_hits"} 1' in body
+    assert 'wallpaper_scanned_files 12' in body
+    assert 'wallpaper_timer_running 1' in body
+    assert '# TYPE process_max_resident_memory_bytes gauge' in body
+
+
+def test_serves_a_metrics_summary(control):
+    with control.manager.metrics.span('decode'):
+        pass
+    status, body = request(control, '/metrics/summary')
+    assert status == 200
+    assert body.splitlines()[1].split()[:2] == ['decode', '1']
+
+
+def test_runs_commands(control):
+    assert request(control, '/next', 'POST') == (200, 'OK\n')
+    assert control.manager.history_size == 1
+    assert request(control, '/pause', 'POST')[0] == 200
+    assert not control.timer.is_running
+    assert 'wallpaper_timer_running 0' in request(control, '/metrics')[1]
+    assert request(control, '/resume', 'POST')[0] == 200
+    assert control.timer.is_running
+
+
+def test_reports_failed_and_unknown_commands(control):
+    assert request(control, '/previous', 'POST') == (500, 'no previous wallpaper\n')
+    status, body = request(control, '/shutdown', 'POST')
+    assert status == 404
+    assert 'next, previous, pause, resume' in body
+    assert request(control, '/status')[0] == 404
+
+
+def test_listens_on_the_configured_port(control):
+    port = free_port()
+    control.manager.config[ConfigField.CONTROL_PORT] = port
+    control.on_config_changes({ConfigField.CONTROL_PORT: port})
+    assert control.address[1] == port
+    assert request(control, '/metrics')[0] == 200
+    control.manager.config[ConfigField.CONTROL_PORT] = 0
+    control.on_config_changes({ConfigField.CONTROL_PORT: 0})
+    assert control.address is None
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import PIL.Image as Image
+import pytest
+
+from conftest import wait_until
+from handler.httpsource import HttpSource
+from handler.imagesource import ImageUnavailableError
+
+IMAGE_NAMES = ['a.bmp', 'b.bmp', 'c.bmp']
+
+
+class ImageServer(ThreadingHTTPServer):
+    """Serves the files of `folder` and an index of them, with ETags, and counts what it was asked."""
+    daemon_threads = True
+
+    def __init__(self, folder: str) -> None:
+        super().__init__(('127.0.0.1', 0), ImageRequestHandler)
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.connections = 0
+        # Sent for every image instead of a hash of its contents, like servers that derive it from mtime and size
+        self.fixed_etag: str = None
+        # (path, status) of every request
+        self.requests: list[tuple[str, int]] = []
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, status: int, suffix: str = '.bmp') -> int:
+        with self.lock:
+            return sum(1 for path, s in self.requests if s == status and path.endswith(suffix))
+
+
+class ImageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self) -> None:
+        if self.path == '/index.txt':
+            body = '\n'.join(IMAGE_NAMES).encode()
+            content_type = 'text/plain'
+        else:
+            try:
+                with open(os.path.join(self.server.folder, self.path.lstrip('/')), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                self._reply(404)
+                return
+            content_type = 'image/bmp'
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.server.fixed_etag is not None and content_type == 'image/bmp':
+            etag = self.server.fixed_etag
+        if self.headers.get('If-None-Match') == etag:
+            self._reply(304, etag=etag)
+            return
+        self._reply(200, body, content_type, etag)
+
+    def _reply(self, status: int, body: bytes = b'', content_type: str = None, etag: str = None) -> None:
+        with self.server.lock:
+            self.server.requests.append((self.path, status))
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    folder = tmp_path / 'served'
+    folder.mkdir()
+    for i, name in enumerate(IMAGE_NAMES):
+        # Bitmaps of the same size take exactly the same number of bytes
+        Image.new('RGB', (64, 48), (80 * i, 40, 200)).save(folder / name)
+    server = ImageServer(str(folder))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def image_bytes(server) -> int:
+    return os.path.getsize(os.path.join(server.folder, IMAGE_NAMES[0]))
+
+
+def make_source(server: ImageServer, tmp_path, cache_bytes: int) -> HttpSource:
+    return HttpSource('web', server.url + '/index.txt', str(tmp_path / 'cache'), cache_bytes)
+
+
+def test_revalidates_cached_images_with_etags(server, tmp_path, image_bytes):
+    source = make_source(server, tmp_path, 10 * image_bytes)
+    try:
+        urls = source.scan()
+        assert sorted(urls) == sorted(f'{server.url}/{name}' for name in IMAGE_NAMES)
+        assert wait_until(lambda: all(source.is_available(url) for url in urls))
+        downloads = server.count(200)
+
+        source.scan()
+        assert server.count(304, '/index.txt') == 1
+        assert wait_until(lambda: server.count(304) == len(IMAGE_NAMES))
+        assert server.count(200) == downloads
+        assert all(source.is_available(url) for url in urls)
+        assert source.read_image(urls[0]).size == (64, 48)
+    finally:
+        source.close()
+
+
+def test_evicts_shown_images_to_make_room(server, tmp_path, image_bytes):
+    source = make_source(server, tmp_path, int(2.5 * image_bytes))
+    try:
+        urls = source.scan()
+
+        def cached() -> list[str]:
+            return [url for url in urls if source.is_available(url)]
+
+        assert wait_until(lambda: len(cached()) == 2)
+        # The cache is full: nothing more is fetched
+        assert not wait_until(lambda: len(cached()) == 3, 0.3)
+        shown = cached()[0]
+        cached_file = source._cached_file(shown)
+        source.on_shown(shown)
+
+        assert wait_until(lambda: not source.is_available(shown))
+        assert wait_until(lambda: len(cached()) == 2)
+        assert shown not in cached()
+        assert not os.path.exists(cached_file)
+        assert source.cached_bytes <= source.cache_bytes
+    finally:
+        source.close()
+
+
+def test_reuses_connections(server, tmp_path, image_bytes):
+    source = make_source(server, tmp_path, 10 * image_bytes)
+    try:
+        urls = source.scan()
+        assert wait_until(lambda: all(source.is_available(url) for url in urls))
+        source.scan()
+        assert wait_until(lambda: server.count(304) == len(IMAGE_NAMES))
+        with server.lock:
+            requests, connections = len(server.requests), server.connections
+        assert requests == 2 * (len(IMAGE_NAMES) + 1)
+        assert connections <= HttpSource.WORKERS + 1
+    finally:
+        source.close()
+
+
+def test_evicted_file_is_unavailable(server, tmp_path, image_bytes):
+    source = make_source(server, tmp_path, 10 * image_bytes)
+    try:
+        urls = source.scan()
+        assert wait_until(lambda: source.is_available(urls[0]))
+        # As if the file was evicted between the lookup and the read
+        os.remove(source._cached_file(urls[0]))
+        with pytest.raises(ImageUnavailableError):
+            source.read_image(urls[0])
+    finally:
+        source.close()
+
+
+def test_fingerprints_differ_for_a_shared_etag(server, tmp_path, image_bytes):
+    server.fixed_etag = '"5f3a1c2b-2c46"'
+    source = make_source(server, tmp_path, 10 * image_bytes)
+    try:
+        urls = source.scan()
+        assert wait_until(lambda: all(source.is_available(url) for url in urls))
+        assert len({source.fingerprint(url) for url in urls}) == len(urls)
+    finally:
+        source.close()
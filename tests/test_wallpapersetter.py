@@ -0,0 +1,89 @@
+import sys
+import textwrap
+
+import pytest
+
+from handler.wallpapersetter import HelperSetter, SetterError, SetterUnavailableError
+
+# Answers like the real helper; the wallpaper value picks how it misbehaves
+STUB_HELPER = textwrap.dedent('''
+    import sys, time
+    if sys.argv[1] == 'silent':
+        time.sleep(60)
+    print('ready', flush=True)
+    with open(sys.argv[2], 'a') as log:
+        for line in sys.stdin:
+            schema, key, value = line.rstrip('\\n').split('\\t')
+            log.write(value + '\\n')
+            log.flush()
+            if value == 'hang':
+                time.sleep(60)
+            elif value == 'exit':
+                sys.exit(1)
+            print('error no such file' if value == 'missing' else 'ok', flush=True)
+''')
+
+
+@pytest.fixture
+def helper(tmp_path, monkeypatch):
+    monkeypatch.setattr(HelperSetter, 'HANDSHAKE_SECONDS', 1.0)
+    monkeypatch.setattr(HelperSetter, 'REPLY_SECONDS', 0.5)
+    script = tmp_path / 'helper.py'
+    script.write_text(STUB_HELPER)
+    log = tmp_path / 'requests.log'
+    log.touch()
+    setters = []
+
+    def create(mode: str = 'serve') -> HelperSetter:
+        setter = HelperSetter([sys.executable, str(script), mode, str(log)], 'org.gnome.desktop.background',
+                              'picture-uri')
+        setters.append(setter)
+        return setter
+
+    create.requests = lambda: log.read_text().splitlines()
+    yield create
+    for setter in setters:
+        setter.close()
+
+
+def test_sends_every_change_to_one_helper(helper):
+    setter = helper()
+    process = setter._process
+    setter.apply('file:///a.png')
+    setter.apply('file:///b.png')
+    assert setter._process is process
+    assert helper.requests() == ['file:///a.png', 'file:///b.png']
+
+
+def test_reports_helper_errors(helper):
+    setter = helper()
+    with pytest.raises(SetterError, match='no such file'):
+        setter.apply('missing')
+    setter.apply('file:///a.png')
+
+
+def test_restarts_a_helper_that_exited(helper):
+    setter = helper()
+    setter.apply('file:///a.png')
+    process = setter._process
+    with pytest.raises(SetterError, match='exited'):
+        setter.apply('exit')
+    setter.apply('file:///b.png')
+    assert setter._process is not process
+    assert process.poll() is not None
+    assert helper.requests() == ['file:///a.png', 'exit', 'exit', 'file:///b.png']
+
+
+def test_restarts_a_helper_that_hangs(helper):
+    setter = helper()
+    process = setter._process
+    with pytest.raises(SetterError, match='did not respond'):
+        setter.apply('hang')
+    assert process.poll() is not None
+    setter.apply('file:///a.png')
+    assert helper.requests() == ['hang', 'hang', 'file:///a.png']
+
+
+def test_gives_up_on_a_helper_without_handshake(helper):
+    with pytest.raises(SetterUnavailableError, match='no response'):
+        helper('silent')